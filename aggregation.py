@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, date
+from typing import Any, Dict, Optional
+from sqlalchemy import func
+from models import Message, User, Group
+from rollup import STATS_SOURCE, rollup_message_stats
+from hll import DISTINCT_USERS
+
+def resolve_group_id(session, telegram_id: int) -> Optional[int]:
+    """由群组的Telegram ID获取内部ID"""
+    return session.query(Group.id).filter(Group.telegram_id == telegram_id).scalar()
+
+def resolve_user_id(session, telegram_id: int) -> Optional[int]:
+    """由用户的Telegram ID获取内部ID"""
+    return session.query(User.id).filter(User.telegram_id == telegram_id).scalar()
+
+def exact_stats_queries(session, since: datetime, group_id: Optional[int] = None,
+                        user_id: Optional[int] = None) -> Dict[str, Any]:
+    """直接聚合消息表的各项查询（未执行），query_plan 使用相同的语句检查执行计划
+
+    totals 返回 (消息数, 最后消息时间, 发言用户数, 活跃群组数)，其余为分组计数。
+    """
+    filters = [Message.created_at >= since]
+    if group_id is not None:
+        filters.append(Message.group_id == group_id)
+    if user_id is not None:
+        filters.append(Message.user_id == user_id)
+
+    msg_type = func.coalesce(Message.chat_type, 'text')
+    day = func.date(Message.created_at)
+    return {
+        'totals': session.query(
+            func.count(Message.id),
+            func.max(Message.created_at),
+            func.count(func.distinct(Message.user_id)),
+            func.count(func.distinct(Message.group_id))
+        ).filter(*filters),
+        'message_types': session.query(msg_type, func.count(Message.id)).filter(*filters).group_by(msg_type),
+        'daily_messages': session.query(day, func.count(Message.id)).filter(*filters).group_by(day),
+        'user_counts': session.query(Message.user_id, func.count(Message.id)).filter(*filters).group_by(Message.user_id),
+    }
+
+def message_stats(session, group_id: Optional[int] = None, user_id: Optional[int] = None,
+                  days: int = 30, with_users: bool = False) -> Optional[Dict[str, Any]]:
+    """在数据库端按群组或用户聚合最近若干天的消息统计
+
+    只返回聚合结果，内存占用与消息数量无关。group_id / user_id 为内部ID。
+    返回字段：
+        total_messages  消息总数
+        message_types   {类型: 数量}
+        daily_messages  {日期: 数量}
+        active_users    发言用户数
+        active_groups   活跃群组数
+        last_active     最后一条消息时间
+        user_counts     {用户内部ID: 数量}（仅 with_users=True 时）
+    STATS_SOURCE=rollup 时读取每日汇总表，另外返回 media_bytes（文件总字节数）。
+    同时 DISTINCT_USERS=hll 时，按群组或全局统计的发言用户数由草图估计，另外返回 active_users_error（相对标准误差）。
+    """
+    # 消息时间以UTC保存
+    start_date = datetime.utcnow() - timedelta(days=days)
+    approximate_users = DISTINCT_USERS == 'hll' and user_id is None and not with_users
+    if STATS_SOURCE == 'rollup':
+        return rollup_message_stats(session, start_date, group_id=group_id, user_id=user_id, with_users=with_users,
+                                    approximate_users=approximate_users)
+
+    queries = exact_stats_queries(session, start_date, group_id=group_id, user_id=user_id)
+    total, last_active, active_users, active_groups = queries['totals'].one()
+    if not total:
+        return None
+
+    message_types = dict(queries['message_types'].all())
+    daily_messages = {
+        date.fromisoformat(day_str): count for day_str, count in queries['daily_messages'].all()
+    }
+
+    stats: Dict[str, Any] = {
+        'total_messages': total,
+        'message_types': message_types,
+        'daily_messages': daily_messages,
+        'active_users': active_users,
+        'active_groups': active_groups,
+        'last_active': last_active
+    }
+
+    if with_users:
+        stats['user_counts'] = dict(queries['user_counts'].all())
+    return stats
+
+def user_display_names(session, user_ids) -> Dict[int, str]:
+    """获取用户显示名称：用户名，没有时使用Telegram ID"""
+    users = session.query(User.id, User.username, User.telegram_id).filter(User.id.in_(list(user_ids))).all()
+    return {uid: username or f"用户{telegram_id}" for uid, username, telegram_id in users}
@@ -1,13 +1,15 @@
 import logging
-from datetime import datetime, timedelta
 from typing import Dict, Optional, Any
 from sqlalchemy.orm import sessionmaker
-from models import engine, Message, User, Group
+from models import read_engine, session_scope, User, Group
 from telegram import Update
 from telegram.ext import ContextTypes
-import jieba
-from collections import Counter
 from database import get_db
+from aggregation import message_stats, resolve_group_id, resolve_user_id, user_display_names
+from db_executor import run_analytics
+from result_cache import result_cache
+from hll import format_estimate
+from term_index import index_pending, top_terms, TERM_INDEX_LAZY_LIMIT
 
 # 配置日志
 logging.basicConfig(
@@ -16,52 +18,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 创建数据库会话
-Session = sessionmaker(bind=engine)
+# 创建数据库会话（只读，与机器人写入互不阻塞）
+Session = sessionmaker(bind=read_engine)
 
 class MessageAnalyzer:
-    def __init__(self):
-        self.session = Session()
+    """消息统计分析，每次调用使用独立的短生命周期会话，实例可在多个处理器间共享"""
+
+    def __init__(self, session_factory=Session):
+        self.session_factory = session_factory
     
     def get_user_stats(self, user_id: int) -> Optional[Dict[str, Any]]:
         """获取用户统计数据"""
         try:
-            # 获取用户最近30天的消息
-            start_date = datetime.now() - timedelta(days=30)
-            messages = self.session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.created_at >= start_date
-            ).all()
-            
-            if not messages:
+            with session_scope(self.session_factory) as session:
+                # 获取用户最近30天的聚合统计
+                stats = message_stats(session, user_id=user_id)
+            if not stats:
                 return None
             
-            # 处理数据
-            stats: Dict[str, Any] = {
-                'total_messages': len(messages),
-                'message_types': {},
-                'active_groups': set(),
-                'daily_stats': {},
-                'last_active': None
+            # 按日期字符串输出每日消息数
+            stats['daily_stats'] = {
+                day.strftime('%Y-%m-%d'): count for day, count in stats.pop('daily_messages').items()
             }
-            
-            for msg in messages:
-                # 统计消息类型
-                msg_type = msg.chat_type or 'text'
-                stats['message_types'][msg_type] = stats['message_types'].get(msg_type, 0) + 1
-                
-                # 记录活跃群组
-                if msg.group_id:
-                    stats['active_groups'].add(msg.group_id)
-                
-                # 统计每日消息
-                date = msg.created_at.strftime('%Y-%m-%d')
-                stats['daily_stats'][date] = stats['daily_stats'].get(date, 0) + 1
-                
-                # 更新最后活跃时间
-                if not stats['last_active'] or msg.created_at > stats['last_active']:
-                    stats['last_active'] = msg.created_at
-            
             return stats
         except Exception as e:
             logger.error(f"获取用户统计数据失败: {e}")
@@ -70,55 +48,25 @@ class MessageAnalyzer:
     def get_group_stats(self, group_id: int) -> Optional[Dict[str, Any]]:
         """获取群组统计数据"""
         try:
-            # 首先获取群组的内部ID
-            group = self.session.query(Group).filter_by(telegram_id=group_id).first()
-            if not group:
-                return None
-            
-            # 获取群组最近30天的消息
-            start_date = datetime.now() - timedelta(days=30)
-            messages = self.session.query(Message).filter(
-                Message.group_id == group.id,
-                Message.created_at >= start_date
-            ).all()
-            
-            if not messages:
-                return None
-            
-            # 处理数据
-            stats: Dict[str, Any] = {
-                'total_messages': len(messages),
-                'message_types': {},
-                'active_users': set(),
-                'daily_stats': {},
-                'user_stats': {},
-                'last_active': None
-            }
-            
-            for msg in messages:
-                # 统计消息类型
-                msg_type = msg.chat_type or 'text'
-                stats['message_types'][msg_type] = stats['message_types'].get(msg_type, 0) + 1
-                
-                # 记录活跃用户
-                stats['active_users'].add(msg.user_id)
-                stats['user_stats'][msg.user_id] = stats['user_stats'].get(msg.user_id, 0) + 1
+            with session_scope(self.session_factory) as session:
+                # 首先获取群组的内部ID
+                internal_id = resolve_group_id(session, group_id)
+                if not internal_id:
+                    return None
                 
-                # 统计每日消息
-                date = msg.created_at.strftime('%Y-%m-%d')
-                stats['daily_stats'][date] = stats['daily_stats'].get(date, 0) + 1
+                # 获取群组最近30天的聚合统计
+                stats = message_stats(session, group_id=internal_id, with_users=True)
+                if not stats:
+                    return None
                 
-                # 更新最后活跃时间
-                if not stats['last_active'] or msg.created_at > stats['last_active']:
-                    stats['last_active'] = msg.created_at
+                # 获取用户名
+                user_counts = stats.pop('user_counts')
+                user_map = user_display_names(session, user_counts.keys())
             
-            # 获取用户名
-            user_ids = list(stats['user_stats'].keys())
-            users = self.session.query(User).filter(User.id.in_(user_ids)).all()
-            user_map = {user.id: user.username or f"用户{user.telegram_id}" for user in users}
-            
-            # 更新用户统计
-            stats['user_stats'] = {user_map[uid]: count for uid, count in stats['user_stats'].items()}
+            stats['daily_stats'] = {
+                day.strftime('%Y-%m-%d'): count for day, count in stats.pop('daily_messages').items()
+            }
+            stats['user_stats'] = {user_map.get(uid, f"用户{uid}"): count for uid, count in user_counts.items()}
             
             return stats
         except Exception as e:
@@ -128,38 +76,15 @@ class MessageAnalyzer:
     def analyze_keywords(self, group_id: int) -> Optional[Dict[str, Any]]:
         """分析关键词使用情况"""
         try:
-            # 获取群组最近30天的消息
-            start_date = datetime.now() - timedelta(days=30)
-            messages = self.session.query(Message).filter(
-                Message.group_id == group_id,
-                Message.created_at >= start_date,
-                Message.content.isnot(None)  # 只分析有内容的消息
-            ).all()
-            
-            if not messages:
-                return None
-            
-            # 分词并统计
-            all_words = []
-            for message in messages:
-                if message.content:  # 再次检查内容是否为空
-                    words = jieba.cut(message.content)
-                    all_words.extend([w for w in words if len(w) > 1])  # 只统计长度大于1的词
-            
-            word_counts = Counter(all_words)
-            
-            return {
-                'total_words': len(all_words),
-                'unique_words': len(word_counts),
-                'top_keywords': dict(word_counts.most_common(20))
-            }
+            # 先为新消息分词，再在词频表上聚合最近30天的关键词
+            pending = index_pending(limit=TERM_INDEX_LAZY_LIMIT)
+            if pending >= TERM_INDEX_LAZY_LIMIT:
+                logger.warning("词频索引积压较多，请运行 python term_index.py backfill")
+            with session_scope(self.session_factory) as session:
+                return top_terms(session, group_id=group_id)
         except Exception as e:
             logger.error(f"分析关键词失败: {e}")
             return None
-    
-    def close(self) -> None:
-        """关闭数据库会话"""
-        self.session.close()
 
 # 创建分析器实例
 analyzer = MessageAnalyzer()
@@ -174,14 +99,19 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if chat_type == 'private':
             # 私聊中显示用户在所有群组/频道的数据
-            user_id = update.effective_user.id
-            stats = get_user_stats(user_id)
-            response = format_user_stats(stats)
+            key = ('stats', 'user', update.effective_user.id, 30)
         else:
             # 群组/频道中显示该群组/频道的数据
-            group_id = update.effective_chat.id
-            stats = analyzer.get_group_stats(group_id)
-            response = format_group_stats(stats)
+            key = ('stats', 'group', update.effective_chat.id, 30)
+        
+        response = result_cache.get(key)
+        if response is None:
+            watermark = result_cache.watermark(key[1], key[2])
+            if key[1] == 'user':
+                response = format_user_stats(await run_analytics(get_user_stats, key[2]))
+            else:
+                response = format_group_stats(await run_analytics(get_group_stats, key[2]))
+            result_cache.put(key, response, watermark)
         
         await update.message.reply_text(response)
     except Exception as e:
@@ -189,46 +119,16 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("生成统计信息时发生错误")
 
 def get_user_stats(user_id: int) -> Optional[Dict]:
-    """获取用户统计数据"""
+    """获取用户统计数据（user_id 为Telegram用户ID）"""
+    session = Session()
     try:
-        session = Session()
-        # 获取用户最近30天的消息
-        start_date = datetime.now() - timedelta(days=30)
-        messages = session.query(Message).filter(
-            Message.user_id == user_id,
-            Message.created_at >= start_date
-        ).all()
-        
-        if not messages:
+        # 首先获取用户的内部ID
+        internal_id = resolve_user_id(session, user_id)
+        if not internal_id:
             return None
         
-        # 处理数据
-        stats = {
-            'total_messages': len(messages),
-            'message_types': {},
-            'active_groups': set(),
-            'daily_messages': {},
-            'last_active': None
-        }
-        
-        for msg in messages:
-            # 统计消息类型
-            msg_type = msg.chat_type or 'text'
-            stats['message_types'][msg_type] = stats['message_types'].get(msg_type, 0) + 1
-            
-            # 记录活跃群组
-            if msg.group_id:
-                stats['active_groups'].add(msg.group_id)
-            
-            # 统计每日消息
-            date = msg.created_at.date()
-            stats['daily_messages'][date] = stats['daily_messages'].get(date, 0) + 1
-            
-            # 更新最后活跃时间
-            if not stats['last_active'] or msg.created_at > stats['last_active']:
-                stats['last_active'] = msg.created_at
-        
-        return stats
+        # 获取用户最近30天的聚合统计
+        return message_stats(session, user_id=internal_id)
     except Exception as e:
         logger.error(f"获取用户统计数据失败: {e}")
         return None
@@ -236,50 +136,16 @@ def get_user_stats(user_id: int) -> Optional[Dict]:
         session.close()
 
 def get_group_stats(group_id: int) -> Optional[Dict]:
-    """获取群组统计数据"""
+    """获取群组统计数据（group_id 为群组Telegram ID）"""
+    session = Session()
     try:
-        session = Session()
         # 首先获取群组的内部ID
-        group = session.query(Group).filter_by(telegram_id=group_id).first()
-        if not group:
+        internal_id = resolve_group_id(session, group_id)
+        if not internal_id:
             return None
-            
-        # 获取群组最近30天的消息
-        start_date = datetime.now() - timedelta(days=30)
-        messages = session.query(Message).filter(
-            Message.group_id == group.id,
-            Message.created_at >= start_date
-        ).all()
-        
-        if not messages:
-            return None
-        
-        # 处理数据
-        stats = {
-            'total_messages': len(messages),
-            'message_types': {},
-            'active_users': set(),
-            'daily_messages': {},
-            'last_active': None
-        }
-        
-        for msg in messages:
-            # 统计消息类型
-            msg_type = msg.chat_type or 'text'
-            stats['message_types'][msg_type] = stats['message_types'].get(msg_type, 0) + 1
-            
-            # 记录活跃用户
-            stats['active_users'].add(msg.user_id)
-            
-            # 统计每日消息
-            date = msg.created_at.date()
-            stats['daily_messages'][date] = stats['daily_messages'].get(date, 0) + 1
-            
-            # 更新最后活跃时间
-            if not stats['last_active'] or msg.created_at > stats['last_active']:
-                stats['last_active'] = msg.created_at
         
-        return stats
+        # 获取群组最近30天的聚合统计
+        return message_stats(session, group_id=internal_id)
     except Exception as e:
         logger.error(f"获取群组统计数据失败: {e}")
         return None
@@ -294,7 +160,7 @@ def format_user_stats(stats: Dict) -> str:
     response = (
         f"📊 用户统计报告\n\n"
         f"总消息数: {stats['total_messages']}\n"
-        f"活跃群组数: {len(stats['active_groups'])}\n"
+        f"活跃群组数: {stats['active_groups']}\n"
         f"最后活跃时间: {stats['last_active'].strftime('%Y-%m-%d %H:%M:%S')}\n\n"
         f"消息类型分布:\n"
     )
@@ -312,7 +178,7 @@ def format_group_stats(stats: Dict) -> str:
     response = (
         f"📊 群组统计报告\n\n"
         f"总消息数: {stats['total_messages']}\n"
-        f"活跃用户数: {len(stats['active_users'])}\n"
+        f"活跃用户数: {format_estimate(stats['active_users'], stats.get('active_users_error'))}\n"
         f"最后活跃时间: {stats['last_active'].strftime('%Y-%m-%d %H:%M:%S')}\n\n"
         f"消息类型分布:\n"
     )
@@ -1,5 +1,5 @@
 import os
-import shutil
+import sqlite3
 import datetime
 import logging
 from pathlib import Path
@@ -25,8 +25,15 @@ def backup_database():
     backup_file = os.path.join(backup_dir, f'bot_{timestamp}.db')
     
     try:
-        # 复制数据库文件
-        shutil.copy2(db_path, backup_file)
+        # 使用SQLite在线备份接口，WAL模式下也能得到一致的快照
+        busy_timeout = int(os.getenv('DB_BUSY_TIMEOUT', '5000').split('#')[0].strip())
+        source = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=busy_timeout / 1000)
+        target = sqlite3.connect(backup_file)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
         logger.info(f'数据库备份成功: {backup_file}')
         
         # 清理旧备份（保留最近7天的备份）
@@ -0,0 +1,132 @@
+import os
+import sys
+import gc
+import random
+import argparse
+import time
+from typing import Callable, List
+from matcher import AhoCorasick
+
+def _timeit(func: Callable, repeat: int = 3) -> float:
+    """运行多次，返回最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _random_text(alphabet: str, min_len: int, max_len: int) -> str:
+    return ''.join(random.choices(alphabet, k=random.randint(min_len, max_len)))
+
+def bench_sensitive_words(word_count: int = 5000, message_count: int = 2000) -> None:
+    """对比逐词 `in` 检查与 Aho-Corasick 自动机的敏感词匹配性能"""
+    random.seed(42)
+    # 常用汉字区间内随机取字，模拟中文敏感词和消息
+    alphabet = ''.join(chr(code) for code in range(0x4e00, 0x4e00 + 3000))
+    words = {_random_text(alphabet, 2, 4) for _ in range(word_count)}
+    word_list = list(words)
+    messages: List[str] = []
+    for _ in range(message_count):
+        text = _random_text(alphabet, 10, 120)
+        if random.random() < 0.1:
+            position = random.randint(0, len(text))
+            text = text[:position] + random.choice(word_list) + text[position:]
+        messages.append(text)
+
+    def loop_check():
+        for text in messages:
+            [word for word in words if word in text]
+
+    build_start = time.perf_counter()
+    matcher = AhoCorasick(words)
+    build_time = time.perf_counter() - build_start
+
+    def automaton_check():
+        for text in messages:
+            matcher.matched_patterns(text)
+
+    # 两种方式的结果必须一致
+    for text in messages:
+        assert set(matcher.matched_patterns(text)) == {word for word in words if word in text}
+
+    loop_time = _timeit(loop_check)
+    automaton_time = _timeit(automaton_check)
+    print(f"敏感词数量: {len(words)}, 消息数量: {message_count}")
+    print(f"自动机构建耗时: {build_time * 1000:.1f} ms")
+    print(f"逐词检查: {loop_time * 1e6 / message_count:.1f} µs/条")
+    print(f"自动机匹配: {automaton_time * 1e6 / message_count:.1f} µs/条")
+    print(f"加速比: {loop_time / automaton_time:.1f}x")
+
+def _rss_bytes() -> int:
+    """当前进程常驻内存（字节），没有 /proc 的系统退化为峰值内存"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def stats_operations(groups, users) -> List[Callable[[], object]]:
+    """分析器、可视化器和监控的统计接口调用，groups / users 为 (内部ID, Telegram ID) 列表"""
+    from analyzer import analyzer
+    from visualizer import visualizer
+    from monitor import monitor
+
+    operations = []
+    for group_id, group_telegram_id in groups:
+        operations.append(lambda tg_id=group_telegram_id: analyzer.get_group_stats(tg_id))
+        operations.append(lambda tg_id=group_telegram_id: visualizer.get_group_data(tg_id))
+        operations.append(lambda gid=group_id: monitor.check_message_activity(gid))
+    for user_id, user_telegram_id in users:
+        operations.append(lambda uid=user_id: analyzer.get_user_stats(uid))
+        operations.append(lambda uid=user_id, gid=groups[0][0]: monitor.check_user_behavior(uid, gid))
+    return operations
+
+def measure_rss_growth(operations: List[Callable[[], object]], calls: int, warmup: int,
+                       verbose: bool = False) -> float:
+    """预热后循环调用 calls 次，返回常驻内存增长（MB）"""
+    for index in range(warmup):
+        operations[index % len(operations)]()
+    gc.collect()
+    baseline = _rss_bytes()
+
+    for index in range(calls):
+        operations[index % len(operations)]()
+        if verbose and (index + 1) % (calls // 10 or 1) == 0:
+            print(f"  {index + 1} 次调用, 常驻内存 {_rss_bytes() / 2**20:.1f} MB")
+    gc.collect()
+    return (_rss_bytes() - baseline) / 2**20
+
+def bench_stats_memory(calls: int = 100000, warmup: int = 2000, limit_mb: float = 32) -> None:
+    """对当前数据库反复调用统计接口，观察常驻内存（回归测试见 tests/test_stats_memory.py）"""
+    # 读取已有数据库（只读），不写入任何数据
+    from models import session_scope, Group, User
+
+    with session_scope() as session:
+        groups = session.query(Group.id, Group.telegram_id).limit(20).all()
+        users = session.query(User.id, User.telegram_id).limit(20).all()
+    if not groups or not users:
+        print("数据库中没有群组或用户数据，请先运行机器人收集消息")
+        return
+
+    start = time.perf_counter()
+    growth = measure_rss_growth(stats_operations(groups, users), calls, warmup, verbose=True)
+    elapsed = time.perf_counter() - start
+    print(f"调用次数: {calls}, 耗时: {elapsed:.1f} 秒（{elapsed * 1e6 / calls:.0f} µs/次）")
+    print(f"常驻内存增长 {growth:.1f} MB（参考上限 {limit_mb:.0f} MB）")
+
+BENCHMARKS = {
+    'sensitive_words': bench_sensitive_words,
+    'stats_memory': bench_stats_memory,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    parser.add_argument('name', nargs='?', choices=sorted(BENCHMARKS), help='要运行的基准测试，默认全部运行')
+    args = parser.parse_args()
+
+    for name in [args.name] if args.name else BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
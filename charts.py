@@ -0,0 +1,179 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 绘图进程数，0 表示在事件循环的默认线程池中绘制
+CHART_WORKERS = int(_env('CHART_WORKERS', '2'))
+# 按数据指纹缓存的图表数
+CHART_CACHE_SIZE = int(_env('CHART_CACHE_SIZE', '64'))
+# 图表字体，按顺序选用第一个已安装的字体（需包含中文字形）
+CHART_FONTS = [name.strip() for name in _env(
+    'CHART_FONTS', 'Noto Sans CJK SC,WenQuanYi Zen Hei,WenQuanYi Micro Hei,SimHei,Microsoft YaHei,PingFang SC,DejaVu Sans'
+).split(',') if name.strip()]
+# 图表分辨率
+CHART_DPI = int(_env('CHART_DPI', '100'))
+
+_style_ready = False
+
+def setup_style() -> None:
+    """设置字体和样式，每个进程只执行一次"""
+    global _style_ready
+    if _style_ready:
+        return
+    # matplotlib 导入较慢，只在第一次绘图时加载
+    import matplotlib
+    matplotlib.rcParams.update({
+        'font.family': 'sans-serif',
+        'font.sans-serif': CHART_FONTS,
+        'axes.unicode_minus': False,  # 中文字体通常没有Unicode负号
+        'axes.grid': True,
+        'grid.alpha': 0.3,
+        'figure.dpi': CHART_DPI,
+        'savefig.dpi': CHART_DPI,
+    })
+    _style_ready = True
+
+def _figure(width: float, height: float):
+    from matplotlib.figure import Figure
+    return Figure(figsize=(width, height))
+
+def _to_png(figure) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    buf = BytesIO()
+    FigureCanvasAgg(figure)
+    figure.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+def _message_type_chart(message_types: Dict[str, int]) -> bytes:
+    """消息类型分布饼图"""
+    figure = _figure(10, 6)
+    ax = figure.add_subplot()
+    ax.pie(list(message_types.values()), labels=list(message_types.keys()), autopct='%1.1f%%')
+    ax.set_title('消息类型分布')
+    return _to_png(figure)
+
+def _daily_chart(daily_messages: Dict[Any, int]) -> bytes:
+    """每日消息数量折线图"""
+    figure = _figure(12, 6)
+    ax = figure.add_subplot()
+    dates = sorted(daily_messages.keys())
+    # 时间窗口较长时不再标出每个数据点
+    ax.plot(dates, [daily_messages[date] for date in dates], marker='o' if len(dates) <= 60 else None)
+    ax.set_title('每日消息数量')
+    ax.set_xlabel('日期')
+    ax.set_ylabel('消息数量')
+    ax.tick_params(axis='x', labelrotation=45)
+    return _to_png(figure)
+
+def _hourly_chart(hourly_messages: Dict[int, int]) -> bytes:
+    """按小时（UTC）消息分布柱状图"""
+    figure = _figure(12, 6)
+    ax = figure.add_subplot()
+    hours = sorted(hourly_messages.keys())
+    ax.bar(hours, [hourly_messages[hour] for hour in hours])
+    ax.set_title('每小时消息分布')
+    ax.set_xlabel('小时（UTC）')
+    ax.set_ylabel('消息数量')
+    ax.set_xticks(range(24))
+    return _to_png(figure)
+
+def render(data: Dict[str, Any]) -> List[bytes]:
+    """绘制全部图表，返回PNG字节列表（不使用pyplot全局状态，可在线程或子进程中调用）"""
+    setup_style()
+    images = [
+        _message_type_chart(data['message_types']),
+        _daily_chart(data['daily_messages'])
+    ]
+    if data.get('hourly_messages'):
+        images.append(_hourly_chart(data['hourly_messages']))
+    return images
+
+def chart_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """从统计数据中取出绘图需要的部分"""
+    return {
+        name: data[name] for name in ('message_types', 'daily_messages', 'hourly_messages') if name in data
+    }
+
+def fingerprint(data: Dict[str, Any]) -> str:
+    """绘图数据的指纹，数据相同则图表相同"""
+    canonical = repr(sorted(
+        (name, sorted(values.items(), key=lambda item: str(item[0]))) for name, values in data.items()
+    ))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+class ChartRenderer:
+    """在独立进程池中绘制图表，并按数据指纹缓存PNG"""
+
+    def __init__(self, workers: int = CHART_WORKERS, cache_size: int = CHART_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _executor(self) -> Optional[Executor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            # 使用 spawn 启动，避免复制机器人进程中的线程和连接
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_style
+            )
+        return self._pool
+
+    def _cached(self, key: str) -> Optional[List[bytes]]:
+        with self._lock:
+            images = self._cache.get(key)
+            if images is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return images
+
+    def _store(self, key: str, images: List[bytes]) -> None:
+        with self._lock:
+            self._cache[key] = images
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def render(self, data: Dict[str, Any]) -> List[bytes]:
+        """绘制图表，不阻塞事件循环"""
+        data = chart_data(data)
+        key = fingerprint(data)
+        images = self._cached(key)
+        if images is not None:
+            return images
+        loop = asyncio.get_running_loop()
+        images = await loop.run_in_executor(self._executor(), render, data)
+        self._store(key, images)
+        return images
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'workers': self.workers, 'size': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+# 创建绘图实例
+chart_renderer = ChartRenderer()
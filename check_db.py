@@ -1,9 +1,9 @@
 from sqlalchemy.orm import sessionmaker
-from models import engine, Message, User, Group
+from models import read_engine, Message, User, Group
 from datetime import datetime, timedelta
 
-# 创建数据库会话
-Session = sessionmaker(bind=engine)
+# 创建数据库会话（只读，与机器人写入互不阻塞）
+Session = sessionmaker(bind=read_engine)
 session = Session()
 
 def check_database():
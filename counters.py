@@ -0,0 +1,213 @@
+import os
+import sys
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Session, read_engine, Counter, MessageHourlyCount, Message, User, Group
+from db_executor import run_db
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 与精确计数校准的间隔（秒），0 表示不定期校准
+COUNTER_RECONCILE_INTERVAL = float(_env('COUNTER_RECONCILE_INTERVAL', '3600'))
+# 每小时消息数保留的小时数
+COUNTER_HOURLY_RETENTION = int(_env('COUNTER_HOURLY_RETENTION', '48'))
+
+# 计数名称 -> 计数的表
+COUNTED_TABLES = {
+    'users': User,
+    'groups': Group,
+    'messages': Message,
+}
+
+def _hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def apply_counter_deltas(session, deltas: Dict[str, int]) -> None:
+    """在写入数据的同一事务中累加计数（不提交）"""
+    now = datetime.utcnow()
+    rows = [{'name': name, 'value': delta, 'updated_at': now} for name, delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = sqlite_insert(Counter)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'value': Counter.value + stmt.excluded.value, 'updated_at': stmt.excluded.updated_at}
+    )
+    session.execute(stmt, rows)
+
+def apply_hourly_deltas(session, deltas: Dict[datetime, int]) -> None:
+    rows = [{'hour': hour, 'message_count': delta} for hour, delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = sqlite_insert(MessageHourlyCount)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['hour'],
+        set_={'message_count': MessageHourlyCount.message_count + stmt.excluded.message_count}
+    )
+    session.execute(stmt, rows)
+
+def apply_message_counters(session, rows: List[Dict[str, Any]]) -> None:
+    """在写入消息的同一事务中累加消息总数和每小时消息数（不提交）"""
+    if not rows:
+        return
+    hourly: Dict[datetime, int] = {}
+    for row in rows:
+        hour = _hour(row['created_at'])
+        hourly[hour] = hourly.get(hour, 0) + 1
+    apply_counter_deltas(session, {'messages': len(rows)})
+    apply_hourly_deltas(session, hourly)
+
+def _snapshot(since: datetime) -> Dict[str, Any]:
+    """在同一个只读快照中读取计数表和精确计数，两者可以直接相减"""
+    with read_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # pysqlite 默认不为查询开启事务，显式 BEGIN 使以下查询看到同一快照
+        conn.exec_driver_sql('BEGIN')
+        try:
+            counters = dict(conn.execute(select(Counter.name, Counter.value)).all())
+            exact = {
+                name: conn.execute(select(func.count()).select_from(model)).scalar()
+                for name, model in COUNTED_TABLES.items()
+            }
+            hourly = dict(conn.execute(
+                select(MessageHourlyCount.hour, MessageHourlyCount.message_count).where(MessageHourlyCount.hour >= since)
+            ).all())
+            hour = func.strftime('%Y-%m-%d %H:00:00', Message.created_at)
+            exact_hourly = {
+                datetime.fromisoformat(hour_str): count
+                for hour_str, count in conn.execute(
+                    select(hour, func.count(Message.id)).where(Message.created_at >= since).group_by(hour)
+                ).all()
+            }
+        finally:
+            conn.exec_driver_sql('COMMIT')
+    return {'counters': counters, 'exact': exact, 'hourly': hourly, 'exact_hourly': exact_hourly}
+
+def reconcile_counters() -> Dict[str, int]:
+    """与精确计数校准，返回各计数的偏差
+
+    精确计数在只读快照中计算，不阻塞写入；写入时按偏差累加，
+    快照之后入库的增量不受影响。同时清理超过保留期的每小时消息数。
+    """
+    since = _hour(datetime.utcnow() - timedelta(hours=COUNTER_HOURLY_RETENTION))
+    snapshot = _snapshot(since)
+    drift = {
+        name: exact - snapshot['counters'].get(name, 0) for name, exact in snapshot['exact'].items()
+    }
+    hours = set(snapshot['hourly']) | set(snapshot['exact_hourly'])
+    hourly_drift = {
+        hour: snapshot['exact_hourly'].get(hour, 0) - snapshot['hourly'].get(hour, 0) for hour in hours
+    }
+
+    session = Session()
+    try:
+        apply_counter_deltas(session, drift)
+        apply_hourly_deltas(session, hourly_drift)
+        session.execute(delete(MessageHourlyCount).where(MessageHourlyCount.hour < since))
+        now = datetime.utcnow()
+        # 计数行不存在时（新数据库）也记录校准时间
+        stmt = sqlite_insert(Counter).values([
+            {'name': name, 'value': 0, 'updated_at': now, 'reconciled_at': now} for name in COUNTED_TABLES
+        ])
+        session.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'reconciled_at': now}))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    changed = {name: value for name, value in drift.items() if value}
+    hourly_changed = sum(1 for value in hourly_drift.values() if value)
+    if changed or hourly_changed:
+        logger.warning(f"计数校准: 偏差 {changed}, 校正每小时消息数 {hourly_changed} 个")
+    return drift
+
+def ensure_counters() -> None:
+    """计数表为空时（升级后首次启动）从精确计数初始化"""
+    session = Session()
+    try:
+        initialized = session.query(Counter.name).first() is not None
+    finally:
+        session.close()
+    if not initialized:
+        reconcile_counters()
+        logger.info("已从现有数据初始化全局计数")
+
+def read_counters(session, since: datetime) -> Dict[str, Any]:
+    """读取全局计数和 since 之后（按小时对齐）的消息数
+
+    computed_at 为计数最后一次更新的时间，reconciled_at 为最后一次校准的时间。
+    """
+    rows = session.query(Counter.name, Counter.value, Counter.updated_at, Counter.reconciled_at).all()
+    stats: Dict[str, Any] = {name: 0 for name in COUNTED_TABLES}
+    computed_at = reconciled_at = None
+    for name, value, updated_at, row_reconciled_at in rows:
+        stats[name] = value
+        if updated_at and (computed_at is None or updated_at > computed_at):
+            computed_at = updated_at
+        if row_reconciled_at and (reconciled_at is None or row_reconciled_at < reconciled_at):
+            reconciled_at = row_reconciled_at
+    stats['recent_messages'] = session.query(
+        func.coalesce(func.sum(MessageHourlyCount.message_count), 0)
+    ).filter(MessageHourlyCount.hour >= _hour(since)).scalar()
+    stats['computed_at'] = computed_at
+    stats['reconciled_at'] = reconciled_at
+    return stats
+
+class CounterReconciler:
+    """后台任务：按固定间隔校准全局计数"""
+
+    def __init__(self, interval: float = COUNTER_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_db(reconcile_counters)
+            except Exception as e:
+                logger.error(f"计数校准失败: {e}")
+
+# 创建校准任务实例
+counter_reconciler = CounterReconciler()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全局计数维护')
+    parser.add_argument('command', choices=['reconcile'], help='reconcile - 与精确计数校准')
+    args = parser.parse_args()
+
+    try:
+        drift = reconcile_counters()
+        logger.info(f"计数校准完成，偏差: {drift}")
+    except Exception as e:
+        logger.error(f"计数校准失败: {e}")
+        sys.exit(1)
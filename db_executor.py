@@ -0,0 +1,72 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+def _env_int(name: str, default: str) -> int:
+    return int(os.getenv(name, default).split('#')[0].strip())
+
+# 消息处理等热点路径使用的数据库线程数及排队上限
+DB_WORKERS = _env_int('DB_WORKERS', '4')
+DB_QUEUE_DEPTH = _env_int('DB_QUEUE_DEPTH', '256')
+# 统计、图表等重查询使用独立线程池，避免拖慢消息处理
+ANALYTICS_WORKERS = _env_int('ANALYTICS_WORKERS', '2')
+ANALYTICS_QUEUE_DEPTH = _env_int('ANALYTICS_QUEUE_DEPTH', '16')
+
+class DatabaseExecutor:
+    """在有界线程池中执行阻塞的数据库操作，供异步处理器 await"""
+
+    def __init__(self, name: str, workers: int, queue_depth: int):
+        self.name = name
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        # 执行中与排队中的任务总数上限，超出时调用方等待
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+        # 成功完成与抛出异常的任务数
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行 func(*args, **kwargs) 并返回结果"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_depth)
+        self.pending += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def shutdown(self) -> None:
+        """等待已提交的任务完成并关闭线程池"""
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'pending': self.pending,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+# 创建线程池实例
+db_executor = DatabaseExecutor('db', DB_WORKERS, DB_QUEUE_DEPTH)
+analytics_executor = DatabaseExecutor('analytics', ANALYTICS_WORKERS, ANALYTICS_QUEUE_DEPTH)
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """在数据库线程池中执行阻塞操作"""
+    return await db_executor.run(func, *args, **kwargs)
+
+async def run_analytics(func: Callable, *args, **kwargs) -> Any:
+    """在统计线程池中执行重查询"""
+    return await analytics_executor.run(func, *args, **kwargs)
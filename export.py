@@ -0,0 +1,296 @@
+import os
+import io
+import csv
+import sys
+import json
+import zlib
+import base64
+import binascii
+import argparse
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from sqlalchemy import select, tuple_
+from models import ReadSession, Message, User, Group
+from aggregation import resolve_group_id
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 每次从数据库读取的行数，内存占用与导出总量无关
+EXPORT_BATCH_SIZE = int(_env('EXPORT_BATCH_SIZE', '5000'))
+# 命令行导出时每隔多少行记录一次断点
+EXPORT_CHECKPOINT_ROWS = int(_env('EXPORT_CHECKPOINT_ROWS', '50000'))
+
+# 导出的字段，cursor 为该条消息之后继续导出所用的游标
+EXPORT_FIELDS = [
+    'id', 'message_id', 'created_at', 'group_id', 'group_title', 'user_id', 'username',
+    'chat_type', 'content', 'file_type', 'file_path', 'file_size', 'mime_type', 'cursor'
+]
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """把消息的 (时间, ID) 编码为不透明的游标"""
+    raw = json.dumps([created_at.isoformat(), message_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, message_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    """解析ISO格式时间，带时区时转换为UTC（消息时间以UTC保存）"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def messages_page_query(session, per_page: int, group_id: Optional[int] = None, user_id: Optional[int] = None,
+                        file_type: Optional[str] = None, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, after: Optional[Tuple[datetime, int]] = None):
+    """Web界面 /api/messages 的分页查询（未执行），query_plan 使用相同的语句检查执行计划
+
+    group_id / user_id 为内部ID，以便使用 (group_id, created_at) / (user_id, created_at) 索引；
+    after 为解析后的游标。按 (created_at, id) 倒序，多取一条用于判断是否还有下一页。
+    """
+    query = session.query(
+        Message.id,
+        Message.content,
+        Message.file_type,
+        Message.file_path,
+        Message.created_at,
+        User.telegram_id,
+        User.username,
+        User.first_name,
+        Group.telegram_id,
+        Group.title
+    ).join(User, Message.user_id == User.id).outerjoin(Group, Message.group_id == Group.id)
+
+    if group_id is not None:
+        query = query.filter(Message.group_id == group_id)
+    if user_id is not None:
+        query = query.filter(Message.user_id == user_id)
+    if file_type:
+        query = query.filter(Message.file_type == file_type)
+    if since is not None:
+        query = query.filter(Message.created_at >= since)
+    if until is not None:
+        query = query.filter(Message.created_at < until)
+    if after is not None:
+        query = query.filter(tuple_(Message.created_at, Message.id) < tuple_(*after))
+    return query.order_by(Message.created_at.desc(), Message.id.desc()).limit(per_page + 1)
+
+def iter_messages(session, group_id: Optional[int] = None, since: Optional[datetime] = None,
+                  until: Optional[datetime] = None, cursor: Optional[str] = None,
+                  batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """按 (created_at, id) 升序逐条返回消息，group_id 为群组Telegram ID
+
+    使用 yield_per 分批读取，任意时刻内存中最多一批数据。cursor 为上次导出的最后一条消息的游标，
+    从其后继续。
+    """
+    stmt = select(
+        Message.id,
+        Message.message_id,
+        Message.created_at,
+        Group.telegram_id,
+        Group.title,
+        User.telegram_id,
+        User.username,
+        Message.chat_type,
+        Message.content,
+        Message.file_type,
+        Message.file_path,
+        Message.file_size,
+        Message.mime_type
+    ).join(User, Message.user_id == User.id).outerjoin(Group, Message.group_id == Group.id)
+
+    if group_id is not None:
+        internal_id = resolve_group_id(session, group_id)
+        if internal_id is None:
+            return
+        stmt = stmt.where(Message.group_id == internal_id)
+    if since is not None:
+        stmt = stmt.where(Message.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(Message.created_at < until)
+    if cursor:
+        stmt = stmt.where(tuple_(Message.created_at, Message.id) > tuple_(*decode_cursor(cursor)))
+    stmt = stmt.order_by(Message.created_at, Message.id)
+
+    result = session.execute(stmt.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        for row in rows:
+            record = dict(zip(EXPORT_FIELDS, row))
+            record['cursor'] = encode_cursor(row[2], row[0])
+            record['created_at'] = row[2].isoformat()
+            yield record
+
+def iter_ndjson(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+def iter_csv(records: Iterable[Dict[str, Any]], header: bool = True) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    if header:
+        writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # 没有数据时输出表头
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def encode_lines(records: Iterable[Dict[str, Any]], fmt: str, header: bool = True) -> Iterator[str]:
+    """把记录转为指定格式的文本行"""
+    if fmt == 'csv':
+        return iter_csv(records, header=header)
+    return iter_ndjson(records)
+
+def chunked(lines: Iterable[str], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """把文本行合并为约 chunk_size 字节的块，减少HTTP分块和写文件的次数"""
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """流式gzip压缩"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(fmt: str = 'ndjson', compress: bool = False, **filters) -> Iterator[bytes]:
+    """生成导出文件内容，会话在生成器结束时关闭，可直接用作HTTP流式响应"""
+    session = ReadSession()
+    try:
+        chunks = chunked(encode_lines(iter_messages(session, **filters), fmt))
+        if compress:
+            chunks = gzip_stream(chunks)
+        yield from chunks
+    finally:
+        session.close()
+
+def export_to_file(path: str, fmt: str = 'ndjson', compress: bool = False, resume: bool = False,
+                   checkpoint_rows: int = EXPORT_CHECKPOINT_ROWS, **filters) -> int:
+    """导出到文件，返回本次写入的消息数
+
+    每 checkpoint_rows 条在 <path>.cursor 中记录游标和已写入的字节数（gzip时每段为独立的gzip成员），
+    resume=True 时截断到最后一个断点并从其后继续，中断后重新运行不会重复或遗漏消息。
+    """
+    state_path = path + '.cursor'
+    offset = 0
+    if resume and os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as state_file:
+            state = json.load(state_file)
+        if {key: state.get(key) for key in ('format', 'compress')} != {'format': fmt, 'compress': compress}:
+            raise ValueError(f"断点文件的格式与本次导出不一致: {state}")
+        filters['cursor'] = state['cursor']
+        offset = state['offset']
+        if not os.path.exists(path):
+            raise ValueError(f"找到断点文件 {state_path}，但导出文件 {path} 不存在")
+    elif os.path.exists(path) and not resume:
+        raise FileExistsError(f"文件已存在: {path}，继续导出请使用 --resume")
+
+    def checkpoint(output, cursor: str) -> None:
+        output.flush()
+        os.fsync(output.fileno())
+        temp_path = state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'cursor': cursor, 'offset': output.tell(), 'format': fmt, 'compress': compress}, state_file)
+        os.replace(temp_path, state_path)
+
+    def write_segment(output, lines) -> None:
+        chunks = chunked(lines)
+        if compress:
+            chunks = gzip_stream(chunks)
+        for chunk in chunks:
+            output.write(chunk)
+
+    count = 0
+    session = ReadSession()
+    try:
+        with open(path, 'r+b' if offset else 'wb') as output:
+            output.seek(offset)
+            output.truncate()
+            segment = []
+            last_cursor = filters.get('cursor')
+            header = offset == 0
+            for record in iter_messages(session, **filters):
+                segment.append(record)
+                if len(segment) >= checkpoint_rows:
+                    write_segment(output, encode_lines(segment, fmt, header=header))
+                    header = False
+                    count += len(segment)
+                    last_cursor = segment[-1]['cursor']
+                    segment = []
+                    checkpoint(output, last_cursor)
+                    logger.info(f"已导出 {count} 条消息")
+            if segment or header:
+                write_segment(output, encode_lines(segment, fmt, header=header))
+                count += len(segment)
+                if segment:
+                    last_cursor = segment[-1]['cursor']
+            if last_cursor:
+                checkpoint(output, last_cursor)
+    finally:
+        session.close()
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按时间顺序导出消息（NDJSON / CSV，可gzip压缩）')
+    parser.add_argument('output', help='输出文件，- 表示标准输出')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='gzip压缩')
+    parser.add_argument('--group', type=int, help='群组Telegram ID')
+    parser.add_argument('--since', help='开始时间（ISO格式，含）')
+    parser.add_argument('--until', help='结束时间（ISO格式，不含）')
+    parser.add_argument('--cursor', help='从该游标之后开始导出（取自已导出记录的 cursor 字段）')
+    parser.add_argument('--resume', action='store_true', help='从 <output>.cursor 记录的断点继续')
+    args = parser.parse_args()
+
+    filters = {'group_id': args.group, 'since': parse_time(args.since), 'until': parse_time(args.until)}
+    if args.cursor:
+        filters['cursor'] = args.cursor
+    try:
+        if args.output == '-':
+            for chunk in stream_export(args.format, args.gzip, **filters):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            count = export_to_file(args.output, args.format, args.gzip, resume=args.resume, **filters)
+            logger.info(f"导出完成: {count} 条消息 -> {args.output}")
+    except (ValueError, FileExistsError) as e:
+        logger.error(f"导出失败: {e}")
+        sys.exit(1)
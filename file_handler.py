@@ -1,9 +1,12 @@
 import os
+import asyncio
 import logging
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from telegram import Update
-from models import Message
+from sqlalchemy import inspect, text
+from models import Session, engine, Message, PendingDownload
+from db_executor import run_db
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -11,6 +14,27 @@ logger = logging.getLogger(__name__)
 # 基础存储路径
 BASE_STORAGE_PATH = "/vol1/1000/tg"
 
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 同时下载的文件数
+MEDIA_DOWNLOAD_WORKERS = int(_env('MEDIA_DOWNLOAD_WORKERS', '3'))
+# 单个文件大小上限（字节），Bot API 最多只能下载20MB
+MEDIA_MAX_FILE_SIZE = int(_env('MEDIA_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
+# 每个文件最多尝试次数
+MEDIA_DOWNLOAD_RETRIES = int(_env('MEDIA_DOWNLOAD_RETRIES', '3'))
+# 没有新任务时检查队列表的间隔（秒）
+MEDIA_POLL_INTERVAL = float(_env('MEDIA_POLL_INTERVAL', '30'))
+
+def ensure_media_columns() -> None:
+    """旧数据库的消息表缺少下载状态列时补齐（入库会写入该列）"""
+    table = Message.__table__
+    columns = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    if 'file_status' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN file_status VARCHAR(20)"))
+        logger.info("已为消息表添加 file_status 列")
+
 def get_file_info(update: Update) -> Tuple[Optional[str], Optional[str], Optional[int], Optional[str]]:
     """获取文件信息"""
     message = update.message
@@ -51,25 +75,31 @@ def get_file_path(file_type: str, group_id: Optional[int] = None) -> str:
         return group_dir
     return base_dir
 
+async def download_file(bot, file_type: str, file_id: str, chat_id: Optional[int] = None) -> Optional[str]:
+    """下载文件到本地，超过大小限制时返回None"""
+    file = await bot.get_file(file_id)
+    if file.file_size and file.file_size > MEDIA_MAX_FILE_SIZE:
+        return None
+    
+    # 生成文件名
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = os.path.splitext(file.file_path)[1] if file.file_path else ".bin"
+    filename = f"{timestamp}_{file_id}{extension}"
+    
+    # 获取存储路径
+    storage_path = get_file_path(file_type, chat_id)
+    file_path = os.path.join(storage_path, filename)
+    
+    # 下载文件
+    await file.download_to_drive(file_path)
+    return file_path
+
 async def save_file(update: Update, context, file_type: str, file_id: str, group_id: Optional[int] = None) -> Optional[str]:
     """保存文件到本地"""
     try:
-        # 获取文件
-        file = await context.bot.get_file(file_id)
-        
-        # 生成文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        extension = os.path.splitext(file.file_path)[1] if file.file_path else ".bin"
-        filename = f"{timestamp}_{file_id}{extension}"
-        
-        # 获取存储路径
-        storage_path = get_file_path(file_type, group_id)
-        file_path = os.path.join(storage_path, filename)
-        
-        # 下载文件
-        await file.download_to_drive(file_path)
-        
-        logger.info(f"文件已保存: {file_path}")
+        file_path = await download_file(context.bot, file_type, file_id, group_id)
+        if file_path:
+            logger.info(f"文件已保存: {file_path}")
         return file_path
         
     except Exception as e:
@@ -82,4 +112,173 @@ def update_message_with_file(message: Message, file_type: str, file_id: str, fil
     message.file_id = file_id
     message.file_path = file_path
     message.file_size = file_size
-    message.mime_type = mime_type 
\ No newline at end of file
+    message.mime_type = mime_type 
+
+def update_record_with_file(record: dict, file_type: str, file_id: str, file_path: str, file_size: int, mime_type: str) -> None:
+    """更新入库记录中的文件信息"""
+    record['file_type'] = file_type
+    record['file_id'] = file_id
+    record['file_path'] = file_path
+    record['file_size'] = file_size
+    record['mime_type'] = mime_type
+
+def update_record_with_pending_file(record: dict, file_type: str, file_id: str, file_size: Optional[int], mime_type: Optional[str]) -> None:
+    """记录文件信息并标记为待下载，超过大小限制的文件不下载"""
+    update_record_with_file(record, file_type, file_id, None, file_size, mime_type)
+    if file_size and file_size > MEDIA_MAX_FILE_SIZE:
+        record['file_status'] = 'skipped'
+    else:
+        record['file_status'] = 'pending'
+
+class MediaDownloadPipeline:
+    """文件下载流水线：消息先入库，文件由后台下载任务补全
+
+    待下载任务保存在 pending_downloads 表中，重启后继续下载。
+    """
+
+    def __init__(self, workers: int = MEDIA_DOWNLOAD_WORKERS, retries: int = MEDIA_DOWNLOAD_RETRIES,
+                 poll_interval: float = MEDIA_POLL_INTERVAL):
+        self.workers = workers
+        self.retries = retries
+        self.poll_interval = poll_interval
+        self.bot = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._claimed: Set[int] = set()  # 已取出、尚未完成的任务ID
+        self.downloaded = 0
+        self.failed = 0
+
+    async def start(self, bot) -> None:
+        """启动下载任务"""
+        if self._tasks:
+            return
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._feed())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"文件下载流水线已启动: 并发={self.workers}")
+
+    async def stop(self) -> None:
+        """停止下载任务，未完成的任务留在队列表中"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._claimed.clear()
+        logger.info("文件下载流水线已停止")
+
+    def notify(self) -> None:
+        """有新的待下载任务时唤醒"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _claim(self, limit: int) -> List[dict]:
+        """取出一批待下载任务（阻塞）"""
+        session = Session()
+        try:
+            query = session.query(PendingDownload).filter(PendingDownload.status == 'pending')
+            if self._claimed:
+                query = query.filter(PendingDownload.id.notin_(self._claimed))
+            jobs = query.order_by(PendingDownload.id).limit(limit).all()
+            return [
+                {
+                    'id': job.id,
+                    'file_id': job.file_id,
+                    'file_type': job.file_type,
+                    'chat_id': job.chat_id,
+                    'attempts': job.attempts or 0
+                }
+                for job in jobs
+            ]
+        finally:
+            session.close()
+
+    def _finish(self, job: dict, file_path: Optional[str], status: str, error: Optional[str] = None) -> None:
+        """记录下载结果（阻塞）：成功或放弃时回填消息并移出队列，否则记录重试次数"""
+        session = Session()
+        try:
+            if status == 'pending':
+                session.query(PendingDownload).filter_by(id=job['id']).update(
+                    {'attempts': job['attempts'], 'last_error': (error or '')[:512]}
+                )
+            else:
+                session.query(Message).filter(
+                    Message.file_id == job['file_id'],
+                    Message.file_status == 'pending'
+                ).update({'file_path': file_path, 'file_status': status}, synchronize_session=False)
+                if status == 'failed':
+                    session.query(PendingDownload).filter_by(id=job['id']).update(
+                        {'status': 'failed', 'attempts': job['attempts'], 'last_error': (error or '')[:512]}
+                    )
+                else:
+                    session.query(PendingDownload).filter_by(id=job['id']).delete()
+            session.commit()
+        finally:
+            session.close()
+
+    async def _feed(self) -> None:
+        """从队列表中取任务交给下载任务，没有任务时等待唤醒或定时轮询"""
+        while True:
+            try:
+                jobs = await run_db(self._claim, self.workers * 2)
+            except Exception as e:
+                logger.error(f"读取待下载任务失败: {e}")
+                jobs = []
+            for job in jobs:
+                self._claimed.add(job['id'])
+                await self._queue.put(job)
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._download(job)
+            except Exception as e:
+                logger.error(f"处理下载任务失败: {job['file_id']}: {e}")
+            finally:
+                self._claimed.discard(job['id'])
+
+    async def _download(self, job: dict) -> None:
+        """下载单个文件，失败时按指数退避重试"""
+        while True:
+            try:
+                file_path = await download_file(self.bot, job['file_type'], job['file_id'], job['chat_id'])
+            except Exception as e:
+                job['attempts'] += 1
+                if job['attempts'] >= self.retries:
+                    logger.error(f"文件下载失败，已放弃: {job['file_id']}: {e}")
+                    await run_db(self._finish, job, None, 'failed', str(e))
+                    self.failed += 1
+                    return
+                logger.warning(f"文件下载失败，稍后重试({job['attempts']}/{self.retries}): {job['file_id']}: {e}")
+                await run_db(self._finish, job, None, 'pending', str(e))
+                await asyncio.sleep(2 ** job['attempts'])
+                continue
+
+            if file_path:
+                logger.info(f"文件已保存: {file_path}")
+                await run_db(self._finish, job, file_path, 'done')
+                self.downloaded += 1
+            else:
+                logger.info(f"文件超过大小限制，跳过下载: {job['file_id']}")
+                await run_db(self._finish, job, None, 'skipped')
+            return
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'workers': self.workers,
+            'in_progress': len(self._claimed),
+            'downloaded': self.downloaded,
+            'failed': self.failed
+        }
+
+# 创建下载流水线实例
+media_pipeline = MediaDownloadPipeline()
@@ -0,0 +1,70 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import select, func, type_coerce, String
+from models import Message
+
+# 每次从数据库读取的行数，内存占用与时间窗口长度无关
+FRAME_CHUNK_SIZE = int(os.getenv('FRAME_CHUNK_SIZE', '50000').split('#')[0].strip())
+
+def _accumulate(total, counts):
+    return counts if total is None else total.add(counts, fill_value=0)
+
+def frame_stats(session, group_id: Optional[int] = None, user_id: Optional[int] = None, days: int = 30,
+                chunk_size: int = FRAME_CHUNK_SIZE) -> Optional[Dict[str, Any]]:
+    """按块读取所需列到DataFrame，向量化计算每日、每小时和类型分布
+
+    group_id / user_id 为内部ID。返回格式与 aggregation.message_stats 相同，
+    另有 hourly_messages {小时(UTC): 数量}。没有消息时返回None。
+    """
+    # pandas 导入较慢，只在生成图表时加载
+    import numpy as np
+    import pandas as pd
+
+    # 消息时间以UTC保存
+    start_date = datetime.utcnow() - timedelta(days=days)
+    stmt = select(
+        # 直接读取SQLite中的时间字符串，由pandas批量解析
+        type_coerce(Message.created_at, String).label('created_at'),
+        func.coalesce(Message.chat_type, 'text').label('chat_type'),
+        Message.user_id,
+        Message.group_id
+    ).where(Message.created_at >= start_date)
+    if group_id is not None:
+        stmt = stmt.where(Message.group_id == group_id)
+    if user_id is not None:
+        stmt = stmt.where(Message.user_id == user_id)
+
+    total = 0
+    daily = hourly = types = None
+    users = np.empty(0, dtype=np.int64)
+    groups = np.empty(0, dtype=np.int64)
+    last_active = None
+    result = session.execute(stmt.execution_options(yield_per=chunk_size))
+    columns = list(result.keys())
+    for rows in result.partitions():
+        chunk = pd.DataFrame(rows, columns=columns)
+        created_at = pd.to_datetime(chunk['created_at'], format='ISO8601')
+        total += len(chunk)
+        daily = _accumulate(daily, created_at.dt.normalize().value_counts())
+        hourly = _accumulate(hourly, created_at.dt.hour.value_counts())
+        types = _accumulate(types, chunk['chat_type'].value_counts())
+        users = np.union1d(users, chunk['user_id'].to_numpy(dtype=np.int64))
+        groups = np.union1d(groups, chunk['group_id'].dropna().to_numpy(dtype=np.int64))
+        chunk_last = created_at.max()
+        if last_active is None or chunk_last > last_active:
+            last_active = chunk_last
+
+    if not total:
+        return None
+
+    hourly = hourly.reindex(range(24), fill_value=0)
+    return {
+        'total_messages': total,
+        'message_types': {name: int(count) for name, count in types.items()},
+        'daily_messages': {day.date(): int(count) for day, count in daily.sort_index().items()},
+        'hourly_messages': {int(hour): int(count) for hour, count in hourly.items()},
+        'active_users': len(users),
+        'active_groups': len(groups),
+        'last_active': last_active.to_pydatetime()
+    }
@@ -0,0 +1,127 @@
+import sys
+import argparse
+import logging
+from typing import Any, Dict, Iterable, List, Tuple
+from sqlalchemy import func, select, update, exists, bindparam, inspect, text
+from models import Session, engine, Group, Message, UserGroup
+from watermarks import bump_watermark
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# 群组表的计数列及升级时添加的DDL
+_COUNTER_COLUMNS = {
+    'message_count': 'INTEGER NOT NULL DEFAULT 0',
+    'member_count': 'INTEGER NOT NULL DEFAULT 0',
+    'last_message_at': 'DATETIME',
+}
+
+_groups = Group.__table__
+
+# 按群组累加消息数并推进最后消息时间
+_message_counter_update = update(_groups).where(_groups.c.id == bindparam('group_key')).values(
+    message_count=_groups.c.message_count + bindparam('message_delta'),
+    last_message_at=func.max(func.coalesce(_groups.c.last_message_at, bindparam('last_at')), bindparam('last_at'))
+)
+
+# 按群组累加成员数
+_member_counter_update = update(_groups).where(_groups.c.id == bindparam('group_key')).values(
+    member_count=_groups.c.member_count + bindparam('member_delta')
+)
+
+def apply_message_counts(session, rows: List[Dict[str, Any]]) -> None:
+    """在写入消息的同一事务中累加群组消息数（不提交）"""
+    counters: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        if not row['group_id']:
+            continue
+        item = counters.get(row['group_id'])
+        if item is None:
+            item = counters[row['group_id']] = {
+                'group_key': row['group_id'], 'message_delta': 0, 'last_at': row['created_at']
+            }
+        item['message_delta'] += 1
+        if row['created_at'] > item['last_at']:
+            item['last_at'] = row['created_at']
+    if counters:
+        session.execute(_message_counter_update, list(counters.values()))
+        bump_watermark(session, _groups.name)
+
+def apply_member_counts(session, pairs: Iterable[Tuple[int, int]]) -> None:
+    """在写入成员关系的同一事务中累加群组成员数（不提交），pairs 为新增的 (用户ID, 群组ID)"""
+    deltas: Dict[int, int] = {}
+    for _, group_id in pairs:
+        deltas[group_id] = deltas.get(group_id, 0) + 1
+    if deltas:
+        session.execute(_member_counter_update, [
+            {'group_key': group_id, 'member_delta': delta} for group_id, delta in deltas.items()
+        ])
+        bump_watermark(session, _groups.name)
+
+def rebuild_group_counters(session) -> int:
+    """由消息表和成员关系表重新计算所有群组的计数（不提交），返回更新的群组数"""
+    message_count = select(func.count(Message.id)).where(Message.group_id == _groups.c.id).scalar_subquery()
+    last_message_at = select(func.max(Message.created_at)).where(Message.group_id == _groups.c.id).scalar_subquery()
+    member_count = select(func.count()).select_from(UserGroup.__table__).where(
+        UserGroup.group_id == _groups.c.id
+    ).scalar_subquery()
+    result = session.execute(update(_groups).values(
+        message_count=message_count,
+        last_message_at=last_message_at,
+        member_count=member_count
+    ))
+    bump_watermark(session, _groups.name)
+    return result.rowcount
+
+def ensure_counter_columns() -> None:
+    """旧数据库的群组表缺少计数列时补齐列和索引（不重建计数，Web界面启动时也会调用）"""
+    columns = {column['name'] for column in inspect(engine).get_columns(_groups.name)}
+    with engine.begin() as conn:
+        for name, ddl in _COUNTER_COLUMNS.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE {_groups.name} ADD COLUMN {name} {ddl}"))
+                logger.info(f"已为群组表添加 {name} 列")
+        for index in _groups.indexes:
+            index.create(conn, checkfirst=True)
+
+def ensure_group_counters() -> None:
+    """补齐计数列；有群组存在消息却没有计数（升级后首次启动）时执行一次全量重建"""
+    ensure_counter_columns()
+    session = Session()
+    try:
+        uncounted = session.query(Group.id).filter(
+            Group.last_message_at.is_(None),
+            exists().where(Message.group_id == Group.id)
+        ).first()
+        if uncounted is None:
+            return
+        count = rebuild_group_counters(session)
+        session.commit()
+        logger.info(f"已从历史消息重建群组计数: {count} 个群组")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='群组消息数/成员数计数维护')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild - 从消息表和成员关系表重新计算')
+    args = parser.parse_args()
+
+    ensure_counter_columns()
+    session = Session()
+    try:
+        count = rebuild_group_counters(session)
+        session.commit()
+        logger.info(f"群组计数重建完成: {count} 个群组")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"群组计数重建失败: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
@@ -0,0 +1,317 @@
+import os
+import sys
+import zlib
+import math
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Session, Message, UserSketch
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 去重用户数的计算方式：hll - 读取 HyperLogLog 草图（近似值）；exact - 精确统计
+DISTINCT_USERS = _env('DISTINCT_USERS', 'hll').lower()
+# 草图精度：寄存器数为 2^HLL_PRECISION，标准误差约 1.04/sqrt(2^HLL_PRECISION)，12 时约 1.6%
+HLL_PRECISION = int(_env('HLL_PRECISION', '12'))
+# 写入时缓存的 (群组, 日期) 草图数量，用户已计入时无需写库
+HLL_CACHE_SIZE = int(_env('HLL_CACHE_SIZE', '1024'))
+
+_MASK64 = (1 << 64) - 1
+# 2^-r 查表，r 最大为 64 - 精度 + 1
+_INV_POW2 = [2.0 ** -r for r in range(66)]
+
+def _hash64(value: int) -> int:
+    """splitmix64 混合函数，把用户ID映射为均匀分布的64位整数"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+class HyperLogLog:
+    """HyperLogLog 基数估计草图，可按寄存器取最大值合并"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytearray] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"HLL精度应在4到16之间: {precision}")
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    @property
+    def error_bound(self) -> float:
+        """相对标准误差"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value: int) -> bool:
+        """加入一个整数，寄存器有变化时返回True"""
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.precision != self.precision:
+            raise ValueError(f"HLL精度不一致: {self.precision} != {other.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    @classmethod
+    def union(cls, sketches: List['HyperLogLog'], precision: int = HLL_PRECISION) -> 'HyperLogLog':
+        """一次合并多个草图（逐个寄存器取最大值）"""
+        if not sketches:
+            return cls(precision)
+        if any(sketch.precision != sketches[0].precision for sketch in sketches):
+            raise ValueError("HLL精度不一致")
+        if len(sketches) == 1:
+            return sketches[0].copy()
+        return cls(sketches[0].precision, bytearray(map(max, *(sketch.registers for sketch in sketches))))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_INV_POW2[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        # 小基数时改用线性计数
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def copy(self) -> 'HyperLogLog':
+        return HyperLogLog(self.precision, bytearray(self.registers))
+
+    def to_bytes(self) -> bytes:
+        """压缩后的寄存器，小群组的草图大部分为0，压缩后只有几十字节"""
+        return zlib.compress(bytes(self.registers), 1)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        registers = bytearray(zlib.decompress(data))
+        return cls(len(registers).bit_length() - 1, registers)
+
+class SketchStore:
+    """维护每个群组每天（UTC）的发言用户草图
+
+    入库时在写入消息的同一事务中更新；最近用过的草图缓存在内存中，
+    用户已计入时寄存器不变，不产生写库操作。
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION, cache_size: int = HLL_CACHE_SIZE):
+        self.precision = precision
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, session, keys: List[Tuple[int, date]]) -> Dict[Tuple[int, date], HyperLogLog]:
+        sketches = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                sketch = self._cache.get(key)
+                if sketch is None:
+                    missing.append(key)
+                else:
+                    self._cache.move_to_end(key)
+                    sketches[key] = sketch
+        if missing:
+            rows = session.query(UserSketch.group_id, UserSketch.day, UserSketch.registers).filter(
+                UserSketch.group_id.in_({group_id for group_id, _ in missing}),
+                UserSketch.day.in_({day for _, day in missing})
+            ).all()
+            stored = {(group_id, day): registers for group_id, day, registers in rows}
+            for key in missing:
+                data = stored.get(key)
+                sketches[key] = HyperLogLog.from_bytes(data) if data else HyperLogLog(self.precision)
+        return sketches
+
+    def _remember(self, sketches: Dict[Tuple[int, date], HyperLogLog]) -> None:
+        with self._lock:
+            for key, sketch in sketches.items():
+                self._cache[key] = sketch
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _merge_stored(self, session, sketches: Dict[Tuple[int, date], HyperLogLog]) -> None:
+        """把数据库中的草图合并进即将写回的草图
+
+        缓存可能落后于其他事务已提交的更新，直接覆盖会丢失其中的用户；
+        本事务已写入消息并持有写锁，此时读到的是最新提交的数据。
+        """
+        rows = session.query(UserSketch.group_id, UserSketch.day, UserSketch.registers).filter(
+            UserSketch.group_id.in_({group_id for group_id, _ in sketches}),
+            UserSketch.day.in_({day for _, day in sketches})
+        ).all()
+        for group_id, day, data in rows:
+            sketch = sketches.get((group_id, day))
+            if sketch is not None and data:
+                sketch.merge(HyperLogLog.from_bytes(data))
+
+    def apply(self, session, rows: List[Dict]) -> None:
+        """在写入消息的同一事务中把发言用户加入草图（不提交）
+
+        须在本事务写入消息之后调用：写回前在写锁内重新读取并合并已存储的草图，
+        并发写入同一 (群组, 日期) 时不会丢失用户。
+        """
+        members: Dict[Tuple[int, date], set] = {}
+        for row in rows:
+            members.setdefault((row['group_id'] or 0, row['created_at'].date()), set()).add(row['user_id'])
+        if not members:
+            return
+
+        sketches = self._load(session, list(members))
+        updated = {}
+        for key, user_ids in members.items():
+            # 在副本上修改，事务回滚时缓存不受影响
+            sketch = sketches[key].copy()
+            changed = False
+            for user_id in user_ids:
+                changed = sketch.add(user_id) or changed
+            sketches[key] = sketch
+            if changed:
+                updated[key] = sketch
+        if updated:
+            self._merge_stored(session, updated)
+            values = [
+                {'group_id': key[0], 'day': key[1], 'registers': sketch.to_bytes()}
+                for key, sketch in updated.items()
+            ]
+            stmt = sqlite_insert(UserSketch)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['group_id', 'day'],
+                set_={'registers': stmt.excluded.registers}
+            )
+            session.execute(stmt, values)
+        # 事务提交后才更新缓存
+        session.info.setdefault('pending_sketches', {}).update(sketches)
+
+    def commit(self, session) -> None:
+        """事务提交后调用，缓存本事务更新过的草图"""
+        pending = session.info.pop('pending_sketches', None)
+        if pending:
+            self._remember(pending)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': len(self._cache), 'precision': self.precision}
+
+def window_sketch_queries(session, since: datetime, group_id: Optional[int] = None) -> Tuple[Any, Any]:
+    """window_sketch 使用的 (草图表查询, 消息表补齐查询)（未执行），query_plan 使用相同的语句检查执行计划"""
+    first_full_day = since.date() if since.time() == time.min else since.date() + timedelta(days=1)
+    boundary = datetime.combine(first_full_day, time.min)
+
+    sketch_query = session.query(UserSketch.registers).filter(UserSketch.day >= first_full_day)
+    raw_query = session.query(Message.user_id).filter(
+        Message.created_at >= since,
+        Message.created_at < boundary
+    ).distinct()
+    if group_id is not None:
+        sketch_query = sketch_query.filter(UserSketch.group_id == group_id)
+        raw_query = raw_query.filter(Message.group_id == group_id)
+    return sketch_query, raw_query
+
+def window_sketch(session, since: datetime, group_id: Optional[int] = None) -> HyperLogLog:
+    """合并 since 之后的草图：完整的天读取草图表，起始日不完整的部分从消息表补齐"""
+    sketch_query, raw_query = window_sketch_queries(session, since, group_id=group_id)
+    result = HyperLogLog.union([HyperLogLog.from_bytes(data) for (data,) in sketch_query.all()])
+    for (user_id,) in raw_query.all():
+        result.add(user_id)
+    return result
+
+def distinct_users(session, since: datetime, group_id: Optional[int] = None) -> Tuple[int, float]:
+    """since 之后的发言用户数估计值及相对标准误差"""
+    sketch = window_sketch(session, since, group_id=group_id)
+    return sketch.count(), sketch.error_bound
+
+def rebuild_sketches(session, since: Optional[date] = None) -> int:
+    """从消息表重建草图表（不提交），指定 since 时只重建该日及之后的数据，返回写入的草图数"""
+    day = func.date(Message.created_at)
+    group_key = func.coalesce(Message.group_id, 0)
+    query = select(group_key, day, Message.user_id).distinct()
+    purge = delete(UserSketch)
+    if since is not None:
+        query = query.where(Message.created_at >= datetime.combine(since, time.min))
+        purge = purge.where(UserSketch.day >= since)
+
+    sketches: Dict[Tuple[int, str], HyperLogLog] = {}
+    for group_id, day_str, user_id in session.execute(query.execution_options(yield_per=10000)):
+        key = (group_id, day_str)
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = HyperLogLog(HLL_PRECISION)
+        sketch.add(user_id)
+
+    session.execute(purge)
+    rows = [
+        {'group_id': group_id, 'day': date.fromisoformat(day_str), 'registers': sketch.to_bytes()}
+        for (group_id, day_str), sketch in sketches.items()
+    ]
+    if rows:
+        session.execute(sqlite_insert(UserSketch), rows)
+    sketch_store.clear()
+    return len(rows)
+
+def ensure_sketches() -> None:
+    """草图表为空而消息表有数据时（升级后首次启动）执行一次全量重建"""
+    session = Session()
+    try:
+        if session.query(UserSketch.day).first() is not None:
+            return
+        if session.query(Message.id).first() is None:
+            return
+        count = rebuild_sketches(session)
+        session.commit()
+        logger.info(f"已从历史消息重建发言用户草图: {count} 个")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def format_estimate(count: int, error: Optional[float]) -> str:
+    """格式化用户数，近似值附带误差"""
+    if error is None:
+        return str(count)
+    return f"约{count}（±{error * 100:.1f}%）"
+
+# 创建草图存储实例
+sketch_store = SketchStore()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='发言用户 HyperLogLog 草图维护')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild - 从消息表重建草图表')
+    parser.add_argument('--days', type=int, help='只重建最近N天，默认重建全部历史')
+    args = parser.parse_args()
+
+    since = datetime.utcnow().date() - timedelta(days=args.days) if args.days else None
+    session = Session()
+    try:
+        count = rebuild_sketches(session, since)
+        session.commit()
+        logger.info(f"草图表重建完成: {count} 个" + (f"（自 {since} 起）" if since else ""))
+    except Exception as e:
+        session.rollback()
+        logger.error(f"草图表重建失败: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
@@ -0,0 +1,152 @@
+import os
+import gzip
+import hashlib
+import logging
+from datetime import timezone
+from functools import wraps
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+from models import ReadSession
+from watermarks import read_watermarks
+
+logger = logging.getLogger(__name__)
+
+# 可选依赖（requirements.txt 已包含）：缺少时退回标准库 json 和 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 响应体达到该字节数时压缩
+HTTP_COMPRESS_MIN_SIZE = int(_env('HTTP_COMPRESS_MIN_SIZE', '1024'))
+# gzip 压缩级别（1-9）
+HTTP_COMPRESS_LEVEL = int(_env('HTTP_COMPRESS_LEVEL', '6'))
+# brotli 压缩质量（0-11），安装 brotli 且客户端支持时优先使用
+HTTP_BROTLI_QUALITY = int(_env('HTTP_BROTLI_QUALITY', '4'))
+
+# 值得压缩的响应类型
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/javascript',
+    'text/plain',
+}
+
+class FastJSONProvider(DefaultJSONProvider):
+    """安装 orjson 时用其序列化 jsonify 的响应，输出UTF-8而不转义非ASCII字符；否则使用标准库"""
+
+    def _orjson_options(self) -> int:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs) -> str:
+        # 指定了 indent 等参数时交给标准库
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        # 调试模式下保留缩进格式
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+def _not_modified(etag: str) -> bool:
+    """只按 If-None-Match 判断
+
+    水位时间只精确到秒，同一秒内的两次修改 Last-Modified 相同，按 If-Modified-Since
+    判断会返回过期的304；ETag 包含版本号，每次修改都会变化。
+    """
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+
+def conditional(*tables: str):
+    """视图装饰器：按所依赖表的变更水位生成 ETag / Last-Modified，ETag 未变化时直接返回304
+
+    水位在查询数据之前读取，读取后发生的修改只会使下次请求的ETag不匹配，不会返回过期内容。
+    水位尚未初始化（未运行 watermarks.ensure_watermarks）时按普通请求处理。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            session = ReadSession()
+            try:
+                watermarks = read_watermarks(session, tables)
+            finally:
+                session.close()
+            if watermarks is None:
+                return view(*args, **kwargs)
+
+            # 同一水位下不同查询参数的结果不同，一并计入ETag
+            fingerprint = repr((sorted(watermarks.items()), request.full_path))
+            etag = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+            last_modified = max(updated_at for _, updated_at in watermarks.values()).replace(tzinfo=timezone.utc)
+
+            if _not_modified(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # 压缩后内容按编码不同，使用弱ETag
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            # 允许浏览器缓存，但每次使用前都要重新验证
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+def _choose_encoding():
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(available)
+
+def compress_response(response):
+    """after_request 钩子：按 Accept-Encoding 压缩超过阈值的文本响应
+
+    流式响应（导出）和文件响应（send_from_directory）保持原样。
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < HTTP_COMPRESS_MIN_SIZE:
+        return response
+
+    # 足够大的响应是否压缩取决于请求头，缓存需按 Accept-Encoding 区分
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=HTTP_BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=HTTP_COMPRESS_LEVEL, mtime=0)
+    else:
+        return response
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_app(app) -> None:
+    """为Flask应用启用快速JSON序列化和响应压缩"""
+    if orjson is None:
+        logger.warning("未安装 orjson，JSON响应使用标准库序列化")
+    if brotli is None:
+        logger.warning("未安装 brotli，响应压缩只使用 gzip")
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
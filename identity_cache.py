@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Dict, Optional, Any, Hashable
+from models import Session, User
+
+# 每类缓存最多保存的条目数
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', '10000').split('#')[0].strip())
+
+# 用户身份：内部ID、资料字段，以及待验证的验证码（已验证时为None）
+UserIdentity = namedtuple('UserIdentity', ['id', 'username', 'first_name', 'last_name', 'pending_code'])
+# 群组身份：内部ID和资料字段
+GroupIdentity = namedtuple('GroupIdentity', ['id', 'title', 'type'])
+
+class _LRU:
+    """带命中统计的有界LRU映射"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self.data.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.data), 'hits': self.hits, 'misses': self.misses}
+
+class IdentityCache:
+    """Telegram用户/群组ID到内部主键的进程内缓存，同时记录已知的用户-群组关系"""
+
+    def __init__(self, maxsize: int = IDENTITY_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._users = _LRU(maxsize)
+        self._groups = _LRU(maxsize)
+        self._memberships = _LRU(maxsize * 4)
+
+    def get_user(self, telegram_id: int) -> Optional[UserIdentity]:
+        with self._lock:
+            return self._users.get(telegram_id)
+
+    def put_user(self, telegram_id: int, identity: UserIdentity) -> None:
+        with self._lock:
+            self._users.put(telegram_id, identity)
+
+    def invalidate_user(self, telegram_id: int) -> None:
+        with self._lock:
+            self._users.pop(telegram_id)
+
+    def get_group(self, telegram_id: int) -> Optional[GroupIdentity]:
+        with self._lock:
+            return self._groups.get(telegram_id)
+
+    def put_group(self, telegram_id: int, identity: GroupIdentity) -> None:
+        with self._lock:
+            self._groups.put(telegram_id, identity)
+
+    def invalidate_group(self, telegram_id: int) -> None:
+        with self._lock:
+            self._groups.pop(telegram_id)
+
+    def has_membership(self, user_id: int, group_id: int) -> bool:
+        with self._lock:
+            return self._memberships.get((user_id, group_id)) is not None
+
+    def add_membership(self, user_id: int, group_id: int) -> None:
+        with self._lock:
+            self._memberships.put((user_id, group_id), True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.data.clear()
+            self._groups.data.clear()
+            self._memberships.data.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """返回各类缓存的大小和命中统计"""
+        with self._lock:
+            return {
+                'users': self._users.stats(),
+                'groups': self._groups.stats(),
+                'memberships': self._memberships.stats()
+            }
+
+def user_identity(user: User) -> UserIdentity:
+    """由用户记录构造缓存条目"""
+    return UserIdentity(
+        user.id,
+        user.username,
+        user.first_name,
+        user.last_name,
+        None if user.is_verified else user.verification_code
+    )
+
+def load_user_identity(telegram_id: int) -> Optional[UserIdentity]:
+    """缓存未命中时从数据库加载用户身份并写入缓存（阻塞，应在数据库线程池中调用）"""
+    session = Session()
+    try:
+        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        if not user:
+            return None
+        identity = user_identity(user)
+        identity_cache.put_user(telegram_id, identity)
+        return identity
+    finally:
+        session.close()
+
+# 创建缓存实例
+identity_cache = IdentityCache()
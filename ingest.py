@@ -0,0 +1,379 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Any, Optional
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Session, User, Group, Message, UserGroup, PendingDownload
+from db_executor import run_db
+from identity_cache import identity_cache, user_identity, GroupIdentity
+from rollup import apply_rollups
+from hll import sketch_store
+from group_counters import apply_message_counts, apply_member_counts
+from counters import apply_counter_deltas, apply_message_counters
+from result_cache import result_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 入库模式：direct - 每条消息立即写入；batch - 写入队列后由后台任务批量提交
+INGEST_MODE = os.getenv('INGEST_MODE', 'direct').split('#')[0].strip().lower()
+# 每批最多写入的消息数
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '200').split('#')[0].strip())
+# 批次最长等待时间（秒），到时即使未满也会提交
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '0.5').split('#')[0].strip())
+# 队列容量，队列满时处理器会等待（背压）
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '10000').split('#')[0].strip())
+
+# 停止写入任务的哨兵对象
+_STOP = object()
+
+def build_record(message) -> Dict[str, Any]:
+    """将Telegram消息规范化为入库记录"""
+    from_user = message.from_user
+    chat = message.chat
+    return {
+        'message_id': message.message_id,
+        'user_telegram_id': from_user.id,
+        'username': from_user.username,
+        'first_name': from_user.first_name,
+        'last_name': from_user.last_name,
+        'chat_telegram_id': chat.id,
+        'chat_title': chat.title,
+        'chat_type': chat.type,
+        'is_group': chat.type in ['group', 'supergroup'],
+        'content': message.text or '',
+        'created_at': datetime.utcnow(),
+        'file_type': None,
+        'file_id': None,
+        'file_path': None,
+        'file_size': None,
+        'mime_type': None,
+        'file_status': None
+    }
+
+def _resolve_users(session, records: List[Dict[str, Any]]) -> Dict[int, int]:
+    """批量获取或创建用户，返回 telegram_id -> 内部ID 映射
+
+    已知用户直接从身份缓存解析；资料（用户名、姓名）变化时更新数据库。
+    """
+    # 同一批次中以最新的资料为准
+    profiles = {
+        record['user_telegram_id']: (record['username'], record['first_name'], record['last_name'])
+        for record in records
+    }
+
+    user_ids = {}
+    changed = {}
+    unknown = []
+    for telegram_id, profile in profiles.items():
+        identity = identity_cache.get_user(telegram_id)
+        if identity is None:
+            unknown.append(telegram_id)
+            continue
+        user_ids[telegram_id] = identity.id
+        if (identity.username, identity.first_name, identity.last_name) != profile:
+            changed[telegram_id] = identity
+
+    def load(telegram_ids: List[int]) -> None:
+        for user in session.query(User).filter(User.telegram_id.in_(telegram_ids)).all():
+            identity = user_identity(user)
+            user_ids[user.telegram_id] = user.id
+            identity_cache.put_user(user.telegram_id, identity)
+            if (identity.username, identity.first_name, identity.last_name) != profiles[user.telegram_id]:
+                changed[user.telegram_id] = identity
+
+    if unknown:
+        load(unknown)
+        # 创建新用户：并发写入可能同时创建同一用户，冲突时跳过并读取已存在的记录
+        missing = [telegram_id for telegram_id in unknown if telegram_id not in user_ids]
+        if missing:
+            # 通过连接执行以取得实际插入的行数
+            result = session.connection().execute(
+                sqlite_insert(User).on_conflict_do_nothing(index_elements=['telegram_id']),
+                [
+                    {
+                        'telegram_id': telegram_id,
+                        'username': profiles[telegram_id][0],
+                        'first_name': profiles[telegram_id][1],
+                        'last_name': profiles[telegram_id][2]
+                    }
+                    for telegram_id in missing
+                ]
+            )
+            apply_counter_deltas(session, {'users': result.rowcount})
+            load(missing)
+
+    # 更新资料发生变化的用户
+    if changed:
+        session.execute(update(User), [
+            {
+                'id': identity.id,
+                'username': profiles[telegram_id][0],
+                'first_name': profiles[telegram_id][1],
+                'last_name': profiles[telegram_id][2]
+            }
+            for telegram_id, identity in changed.items()
+        ])
+        for telegram_id, identity in changed.items():
+            identity_cache.put_user(telegram_id, identity._replace(
+                username=profiles[telegram_id][0],
+                first_name=profiles[telegram_id][1],
+                last_name=profiles[telegram_id][2]
+            ))
+    return user_ids
+
+def _resolve_groups(session, records: List[Dict[str, Any]]) -> Dict[int, int]:
+    """批量获取或创建群组，返回 telegram_id -> 内部ID 映射
+
+    已知群组直接从身份缓存解析；标题或类型变化时更新数据库。
+    """
+    profiles = {
+        record['chat_telegram_id']: (record['chat_title'], record['chat_type'])
+        for record in records if record['is_group']
+    }
+    if not profiles:
+        return {}
+
+    group_ids = {}
+    changed = {}
+    unknown = []
+    for telegram_id, profile in profiles.items():
+        identity = identity_cache.get_group(telegram_id)
+        if identity is None:
+            unknown.append(telegram_id)
+            continue
+        group_ids[telegram_id] = identity.id
+        if (identity.title, identity.type) != profile:
+            changed[telegram_id] = identity.id
+
+    def load(telegram_ids: List[int]) -> None:
+        groups = session.query(Group.telegram_id, Group.id, Group.title, Group.type).filter(
+            Group.telegram_id.in_(telegram_ids)
+        ).all()
+        for telegram_id, group_id, title, group_type in groups:
+            group_ids[telegram_id] = group_id
+            identity_cache.put_group(telegram_id, GroupIdentity(group_id, title, group_type))
+            if (title, group_type) != profiles[telegram_id]:
+                changed[telegram_id] = group_id
+
+    if unknown:
+        load(unknown)
+        # 创建新群组：并发写入可能同时创建同一群组，冲突时跳过并读取已存在的记录
+        missing = [telegram_id for telegram_id in unknown if telegram_id not in group_ids]
+        if missing:
+            result = session.connection().execute(
+                sqlite_insert(Group).on_conflict_do_nothing(index_elements=['telegram_id']),
+                [
+                    {
+                        'telegram_id': telegram_id,
+                        'title': profiles[telegram_id][0],
+                        'type': profiles[telegram_id][1],
+                        'is_monitoring': True
+                    }
+                    for telegram_id in missing
+                ]
+            )
+            apply_counter_deltas(session, {'groups': result.rowcount})
+            load(missing)
+
+    # 更新标题或类型发生变化的群组
+    if changed:
+        session.execute(update(Group), [
+            {'id': group_id, 'title': profiles[telegram_id][0], 'type': profiles[telegram_id][1]}
+            for telegram_id, group_id in changed.items()
+        ])
+        for telegram_id, group_id in changed.items():
+            identity_cache.put_group(telegram_id, GroupIdentity(group_id, *profiles[telegram_id]))
+    return group_ids
+
+def _ensure_memberships(session, pairs: set) -> None:
+    """批量补全用户-群组关系"""
+    pairs = {pair for pair in pairs if not identity_cache.has_membership(*pair)}
+    if not pairs:
+        return
+    user_ids = {user_id for user_id, _ in pairs}
+    group_ids = {group_id for _, group_id in pairs}
+    existing = set(
+        session.query(UserGroup.user_id, UserGroup.group_id).filter(
+            UserGroup.user_id.in_(user_ids),
+            UserGroup.group_id.in_(group_ids)
+        ).all()
+    )
+    missing = pairs - existing
+    if missing:
+        session.execute(
+            insert(UserGroup),
+            [{'user_id': user_id, 'group_id': group_id} for user_id, group_id in missing]
+        )
+        apply_member_counts(session, missing)
+    for pair in pairs:
+        identity_cache.add_membership(*pair)
+
+def write_records(session, records: List[Dict[str, Any]]) -> None:
+    """在同一事务中写入一批消息记录（不提交）"""
+    user_ids = _resolve_users(session, records)
+    group_ids = _resolve_groups(session, records)
+
+    rows = []
+    pairs = set()
+    for record in records:
+        user_id = user_ids[record['user_telegram_id']]
+        group_id = group_ids.get(record['chat_telegram_id']) if record['is_group'] else None
+        if group_id:
+            pairs.add((user_id, group_id))
+        rows.append({
+            'message_id': record['message_id'],
+            'user_id': user_id,
+            'group_id': group_id,
+            'content': record['content'],
+            'chat_type': record['chat_type'],
+            'created_at': record['created_at'],
+            'file_type': record['file_type'],
+            'file_id': record['file_id'],
+            'file_path': record['file_path'],
+            'file_size': record['file_size'],
+            'mime_type': record['mime_type'],
+            'file_status': record['file_status']
+        })
+
+    _ensure_memberships(session, pairs)
+    session.execute(insert(Message), rows)
+    # 每日汇总与消息在同一事务中更新
+    apply_rollups(session, rows)
+    sketch_store.apply(session, rows)
+    apply_message_counts(session, rows)
+    apply_message_counters(session, rows)
+
+    # 待下载的文件与消息在同一事务中进入下载队列
+    downloads = [
+        {
+            'file_id': record['file_id'],
+            'file_type': record['file_type'],
+            'file_size': record['file_size'],
+            'chat_id': record['chat_telegram_id'] if record['is_group'] else None
+        }
+        for record in records if record['file_status'] == 'pending'
+    ]
+    if downloads:
+        session.execute(insert(PendingDownload), downloads)
+
+def save_records(records: List[Dict[str, Any]]) -> None:
+    """使用独立会话写入并提交一批消息记录"""
+    session = Session()
+    try:
+        write_records(session, records)
+        session.commit()
+        sketch_store.commit(session)
+    except Exception:
+        session.rollback()
+        # 回滚后缓存中可能包含未提交的ID，直接清空
+        identity_cache.clear()
+        raise
+    finally:
+        session.close()
+    # 已缓存的统计结果随之过期
+    result_cache.note_ingested(records)
+
+class IngestQueue:
+    """消息写入队列：处理器入队，后台任务按数量或时间分批提交"""
+
+    def __init__(self, maxsize: int = INGEST_QUEUE_SIZE, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 每批提交成功后调用的回调
+        self.flush_listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """启动后台写入任务"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"消息写入队列已启动: 批大小={self.batch_size}, 间隔={self.flush_interval}s, 容量={self.maxsize}")
+
+    async def put(self, record: Dict[str, Any]) -> None:
+        """消息入队，队列满时等待"""
+        if not self.running:
+            # 写入任务未启动时退化为直接写入
+            await run_db(save_records, [record])
+            return
+        await self.queue.put(record)
+
+    async def stop(self) -> None:
+        """停止写入任务，并确保队列中的消息全部写入"""
+        if not self.running:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info("消息写入队列已停止")
+
+    async def _run(self) -> None:
+        """后台写入循环"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # 停止前写入剩余消息
+        remaining = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        """在数据库线程池中提交一批消息"""
+        try:
+            await run_db(save_records, batch)
+            logger.debug(f"批量写入消息: {len(batch)} 条")
+        except Exception as e:
+            logger.error(f"批量写入消息失败({len(batch)} 条)，改为逐条写入: {e}")
+            written = []
+            for record in batch:
+                try:
+                    await run_db(save_records, [record])
+                    written.append(record)
+                except Exception as e:
+                    logger.error(f"写入消息失败: chat={record['chat_telegram_id']}, message={record['message_id']}: {e}")
+            batch = written
+        # 回调在提交之后执行，回调出错不影响已写入的消息
+        if not batch:
+            return
+        for listener in self.flush_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                logger.error(f"写入回调执行失败: {e}")
+
+# 创建写入队列实例
+ingest_queue = IngestQueue()
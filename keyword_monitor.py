@@ -1,9 +1,10 @@
 import logging
 import re
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Tuple
 from telegram import Update
 from telegram.ext import ContextTypes
 from database import get_db
+from matcher import AhoCorasick
 
 logger = logging.getLogger(__name__)
 
@@ -11,23 +12,32 @@ class KeywordMonitor:
     def __init__(self):
         self.db = get_db()
         self.sensitive_words = set()  # 敏感词集合
+        self._matcher = AhoCorasick(())  # 敏感词匹配自动机
+        self.version = 0  # 敏感词列表版本，每次变化递增
         self.load_sensitive_words()
     
+    def _set_sensitive_words(self, words: Set[str]) -> None:
+        """构建新的匹配自动机后整体替换，检查过程中不会看到构建到一半的状态"""
+        matcher = AhoCorasick(words)
+        self.sensitive_words = words
+        self._matcher = matcher
+        self.version += 1
+    
     def load_sensitive_words(self):
         """从数据库加载敏感词列表"""
         try:
             words = self.db.sensitive_words.find()
-            self.sensitive_words = {word['word'] for word in words}
+            self._set_sensitive_words({word['word'] for word in words})
         except Exception as e:
             logger.error(f"加载敏感词失败: {e}")
-            self.sensitive_words = set()
+            self._set_sensitive_words(set())
     
     def add_sensitive_word(self, word: str) -> bool:
         """添加敏感词"""
         try:
             if word not in self.sensitive_words:
                 self.db.sensitive_words.insert_one({'word': word})
-                self.sensitive_words.add(word)
+                self._set_sensitive_words(self.sensitive_words | {word})
                 return True
             return False
         except Exception as e:
@@ -39,7 +49,7 @@ class KeywordMonitor:
         try:
             if word in self.sensitive_words:
                 self.db.sensitive_words.delete_one({'word': word})
-                self.sensitive_words.remove(word)
+                self._set_sensitive_words(self.sensitive_words - {word})
                 return True
             return False
         except Exception as e:
@@ -48,11 +58,11 @@ class KeywordMonitor:
     
     def check_sensitive_content(self, text: str) -> List[str]:
         """检查文本中的敏感词"""
-        found_words = []
-        for word in self.sensitive_words:
-            if word in text:
-                found_words.append(word)
-        return found_words
+        return self._matcher.matched_patterns(text)
+    
+    def find_sensitive_matches(self, text: str) -> List[Tuple[int, int, str]]:
+        """查找文本中所有敏感词及其位置 (起始, 结束, 敏感词)"""
+        return self._matcher.find_all(text)
     
     def analyze_user_behavior(self, user_id: int, group_id: int = None) -> Dict:
         """分析用户行为"""
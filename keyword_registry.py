@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from models import ReadSession, Keyword
+from matcher import AhoCorasick
+from keyword_monitor import monitor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 全局敏感词的严重程度：1-低，2-中，3-高
+SENSITIVE_WORD_SEVERITY = int(os.getenv('SENSITIVE_WORD_SEVERITY', '2').split('#')[0].strip())
+# 匹配器最长使用时间（秒），用于发现其他进程对关键词表的修改；0 表示仅在显式失效时重建
+KEYWORD_REFRESH_INTERVAL = float(os.getenv('KEYWORD_REFRESH_INTERVAL', '300').split('#')[0].strip())
+# 检查关键词表是否变化的间隔（秒），任何进程修改关键词后最迟在此时间后重建；0 表示不检查
+KEYWORD_CHECK_INTERVAL = float(os.getenv('KEYWORD_CHECK_INTERVAL', '5').split('#')[0].strip())
+
+def _keywords_fingerprint(session) -> int:
+    """关键词表内容的摘要，任何行的增删改都会使其变化（关键词表很小，整表读取代价很低）"""
+    rows = session.query(
+        Keyword.id, Keyword.word, Keyword.group_id, Keyword.severity, Keyword.is_active
+    ).order_by(Keyword.id).all()
+    return hash(tuple(tuple(row) for row in rows))
+
+class _CompiledRules:
+    """已编译的群组规则集"""
+
+    __slots__ = ('matcher', 'group_version', 'global_version', 'built_at')
+
+    def __init__(self, matcher: AhoCorasick, group_version: int, global_version: int):
+        self.matcher = matcher
+        self.group_version = group_version
+        self.global_version = global_version
+        self.built_at = time.monotonic()
+
+class KeywordRegistry:
+    """按群组编译的关键词匹配器注册表
+
+    每个群组的启用关键词（Keyword表）与全局敏感词合并后编译为一个自动机，
+    按版本号缓存，只在关键词变化时重建。匹配不区分大小写，结果带严重程度。
+    """
+
+    def __init__(self, refresh_interval: float = KEYWORD_REFRESH_INTERVAL,
+                 check_interval: float = KEYWORD_CHECK_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._checked_at: Optional[float] = None
+        self._keywords_fingerprint: Optional[int] = None
+        self._rules: Dict[Optional[int], _CompiledRules] = {}
+        self._group_versions: Dict[Optional[int], int] = {}
+        self.builds = 0
+
+    def invalidate(self, group_id: Optional[int] = None) -> None:
+        """群组关键词变化后调用；不指定群组时使所有群组失效"""
+        with self._lock:
+            if group_id is None:
+                for key in list(self._rules):
+                    self._group_versions[key] = self._group_versions.get(key, 0) + 1
+            else:
+                self._group_versions[group_id] = self._group_versions.get(group_id, 0) + 1
+
+    def _check_keywords(self) -> None:
+        """关键词表内容变化时使所有群组失效，最多每 check_interval 秒查询一次"""
+        if not self.check_interval:
+            return
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        # 其他线程正在检查时直接使用现有规则
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            session = ReadSession()
+            try:
+                fingerprint = _keywords_fingerprint(session)
+            finally:
+                session.close()
+            if self._keywords_fingerprint is not None and fingerprint != self._keywords_fingerprint:
+                self.invalidate()
+            self._keywords_fingerprint = fingerprint
+        except Exception as e:
+            logger.error(f"检查关键词表变化失败: {e}")
+        finally:
+            self._check_lock.release()
+
+    def _is_current(self, rules: _CompiledRules, group_id: Optional[int]) -> bool:
+        if rules.group_version != self._group_versions.get(group_id, 0):
+            return False
+        if rules.global_version != monitor.version:
+            return False
+        if self.refresh_interval and time.monotonic() - rules.built_at > self.refresh_interval:
+            return False
+        return True
+
+    def _build(self, group_id: Optional[int]) -> AhoCorasick:
+        """合并群组关键词与全局敏感词并编译"""
+        patterns: Dict[str, Tuple[str, int]] = {
+            word.lower(): (word, SENSITIVE_WORD_SEVERITY) for word in monitor.sensitive_words
+        }
+        if group_id is not None:
+            session = ReadSession()
+            try:
+                keywords = session.query(Keyword.word, Keyword.severity).filter(
+                    Keyword.group_id == group_id,
+                    Keyword.is_active.is_(True)
+                ).all()
+            finally:
+                session.close()
+            for word, severity in keywords:
+                if not word:
+                    continue
+                key = word.lower()
+                severity = severity or 1
+                # 与全局敏感词重复时取较高的严重程度
+                if key not in patterns or patterns[key][1] < severity:
+                    patterns[key] = (word, severity)
+        return AhoCorasick(patterns)
+
+    def get_matcher(self, group_id: Optional[int]) -> AhoCorasick:
+        """获取群组的匹配器，过期时重建"""
+        self._check_keywords()
+        rules = self._rules.get(group_id)
+        if rules is not None and self._is_current(rules, group_id):
+            return rules.matcher
+
+        with self._lock:
+            rules = self._rules.get(group_id)
+            if rules is not None and self._is_current(rules, group_id):
+                return rules.matcher
+            group_version = self._group_versions.get(group_id, 0)
+            global_version = monitor.version
+            matcher = self._build(group_id)
+            self._rules[group_id] = _CompiledRules(matcher, group_version, global_version)
+            self.builds += 1
+            logger.debug(f"编译关键词规则: 群组={group_id}, 关键词数={len(matcher)}")
+            return matcher
+
+    def check(self, group_id: Optional[int], text: str) -> List[Tuple[str, int]]:
+        """检查文本，返回命中的 (关键词, 严重程度)，按首次出现顺序去重"""
+        if not text:
+            return []
+        matcher = self.get_matcher(group_id)
+        return [matcher.values[pattern] for pattern in matcher.matched_patterns(text.lower())]
+
+# 创建注册表实例
+keyword_registry = KeywordRegistry()
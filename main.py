@@ -1,21 +1,37 @@
 import os
 import logging
 from datetime import datetime
+from typing import List, Optional, Tuple
+# 启动计时需在其他模块之前导入
+from startup import startup_timer
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from models import Session, User, Group, Message, Keyword, Alert, UserGroup
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from models import Session, User, Group, Keyword
 from analyzer import stats_command
 from visualizer import visualize_command
+from charts import chart_renderer
 from keyword_monitor import (
     add_sensitive_word_command,
     remove_sensitive_word_command,
     check_behavior_command,
     monitor
 )
-from monitor import check_group_activity, check_user_behavior_alert, GroupMonitor
+from monitor import check_group_activity, check_user_behavior_alert, monitor as group_monitor, activity_tracker
 from utils import generate_verification_code
-from file_handler import get_file_info, save_file, update_message_with_file
+from file_handler import get_file_info, update_record_with_pending_file, media_pipeline, ensure_media_columns
+from ingest import INGEST_MODE, build_record, save_records, ingest_queue
+from identity_cache import identity_cache, load_user_identity
+from update_processor import ChatOrderedUpdateProcessor, UPDATE_CONCURRENCY
+from db_executor import db_executor, analytics_executor, run_db, run_analytics
+from keyword_registry import keyword_registry
+from rollup import ensure_rollups
+from result_cache import result_cache
+from hll import ensure_sketches, format_estimate
+from group_counters import ensure_group_counters
+from query_plan import ensure_message_indexes
+from counters import ensure_counters, counter_reconciler
+from watermarks import ensure_watermarks
 
 # 加载环境变量
 load_dotenv()
@@ -39,6 +55,11 @@ if admin_ids_str:
 else:
     ADMIN_USER_IDS = []
 
+# 更新处理器：并发上限大于1时按会话并行处理
+update_processor = ChatOrderedUpdateProcessor() if UPDATE_CONCURRENCY > 1 else None
+
+startup_timer.mark('imports')
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理/start命令"""
     await update.message.reply_text('欢迎使用群组管理机器人！\n'
@@ -65,7 +86,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /stats - 查看群组统计信息
 /monitor - 查看监控设置
 /analysis - 分析群组消息
-/visualize - 生成数据可视化图表
+/visualize [天数] - 生成数据可视化图表（默认30天）
 
 🔒 敏感词管理：
 /addword <敏感词> - 添加敏感词
@@ -84,6 +105,25 @@ async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # TODO: 实现验证逻辑
     await update.message.reply_text("验证功能开发中...")
 
+def load_monitor_report(group_id: int) -> Optional[Tuple[str, dict, list]]:
+    """读取群组监控数据（阻塞），群组未注册时返回None"""
+    session = Session()
+    try:
+        # 获取群组
+        group = session.query(Group).filter_by(telegram_id=group_id).first()
+        if not group:
+            return None
+        
+        # 检查群组活跃度
+        activity = group_monitor.check_message_activity(group.id)
+        
+        # 检查关键词告警
+        alerts = group_monitor.check_keyword_alerts(group.id)
+        
+        return group.title, activity, alerts
+    finally:
+        session.close()
+
 async def monitor_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理监控命令"""
     chat_type = update.effective_chat.type
@@ -95,48 +135,34 @@ async def monitor_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 获取群组ID
         group_id = update.effective_chat.id
         
-        # 获取数据库会话
-        session = Session()
         try:
-            # 获取群组
-            group = session.query(Group).filter_by(telegram_id=group_id).first()
-            if not group:
-                await update.message.reply_text("群组未注册，请先发送一条消息！")
-                return
-            
-            # 创建监控实例
-            group_monitor = GroupMonitor()
-            try:
-                # 检查群组活跃度
-                activity = group_monitor.check_message_activity(group.id)
-                
-                # 检查关键词告警
-                alerts = group_monitor.check_keyword_alerts(group.id)
-                
-                # 构建响应消息
-                response = (
-                    f"📊 群组监控报告\n\n"
-                    f"群组名称: {group.title}\n"
-                    f"最近 {activity['time_period']} 小时活跃度:\n"
-                    f"- 消息数量: {activity['message_count']}\n"
-                    f"- 活跃用户数: {activity['active_users']}\n\n"
-                )
-                
-                if alerts:
-                    response += "⚠️ 关键词告警:\n"
-                    for alert in alerts:
-                        response += f"- {alert}\n"
-                
-                await update.message.reply_text(response)
-                
-            finally:
-                group_monitor.close()
-            
+            report = await run_analytics(load_monitor_report, group_id)
         except Exception as e:
             logger.error(f"获取监控数据失败: {e}")
             await update.message.reply_text("获取监控数据失败，请稍后重试！")
-        finally:
-            session.close()
+            return
+        
+        if not report:
+            await update.message.reply_text("群组未注册，请先发送一条消息！")
+            return
+        
+        title, activity, alerts = report
+        
+        # 构建响应消息
+        response = (
+            f"📊 群组监控报告\n\n"
+            f"群组名称: {title}\n"
+            f"最近 {activity['time_period']} 小时活跃度:\n"
+            f"- 消息数量: {activity['message_count']}\n"
+            f"- 活跃用户数: {format_estimate(activity['active_users'], activity.get('active_users_error'))}\n\n"
+        )
+        
+        if alerts:
+            response += "⚠️ 关键词告警:\n"
+            for alert in alerts:
+                response += f"- {alert}\n"
+        
+        await update.message.reply_text(response)
             
     except Exception as e:
         logger.error(f"处理监控命令失败: {e}")
@@ -151,108 +177,82 @@ async def analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await stats_command(update, context)
 
+def mark_user_verified(user_id: int) -> None:
+    """标记用户已通过验证（阻塞）"""
+    session = Session()
+    try:
+        session.query(User).filter_by(id=user_id).update(
+            {'is_verified': True, 'verification_code': None}
+        )
+        session.commit()
+    finally:
+        session.close()
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理所有消息"""
-    # 获取数据库会话
-    session = Session()
     try:
         message = update.message
         if not message:
             return
 
-        # 获取或创建用户
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
-        if not user:
-            user = User(
-                telegram_id=message.from_user.id,
-                username=message.from_user.username,
-                first_name=message.from_user.first_name,
-                last_name=message.from_user.last_name
-            )
-            session.add(user)
-            session.commit()
-        
-        # 检查验证码
-        if not user.is_verified and user.verification_code:
-            if message.text == user.verification_code:
-                user.is_verified = True
-                user.verification_code = None
-                session.commit()
+        # 检查验证码（已知用户直接读取缓存）
+        identity = identity_cache.get_user(message.from_user.id)
+        if identity is None:
+            identity = await run_db(load_user_identity, message.from_user.id)
+        if identity and identity.pending_code:
+            if message.text == identity.pending_code:
+                await run_db(mark_user_verified, identity.id)
+                identity_cache.put_user(message.from_user.id, identity._replace(pending_code=None))
                 await update.message.reply_text("✅ 验证成功！您现在可以使用所有功能了。")
             else:
                 await update.message.reply_text("❌ 验证码错误，请重试！")
                 return
         
-        # 如果是群组消息，获取或创建群组
-        group = None
-        if message.chat.type in ['group', 'supergroup']:
-            group = session.query(Group).filter_by(telegram_id=message.chat.id).first()
-            if not group:
-                group = Group(
-                    telegram_id=message.chat.id,
-                    title=message.chat.title,
-                    type=message.chat.type,
-                    is_monitoring=True
-                )
-                session.add(group)
-                session.commit()
-            
-            # 更新用户-群组关系
-            if group and user:
-                user_group = session.query(UserGroup).filter_by(
-                    user_id=user.id,
-                    group_id=group.id
-                ).first()
-                if not user_group:
-                    user_group = UserGroup(
-                        user_id=user.id,
-                        group_id=group.id
-                    )
-                    session.add(user_group)
-                    session.commit()
-        
         # 创建消息记录
-        msg = Message(
-            message_id=message.message_id,
-            user_id=user.id,
-            group_id=group.id if group else None,
-            content=message.text or '',  # 保存文本消息内容
-            chat_type=message.chat.type
-        )
+        record = build_record(message)
+        is_group = record['is_group']
         
-        # 处理文件
+        # 处理文件（消息先入库，文件由下载流水线补全）
         file_type, file_id, file_size, mime_type = get_file_info(update)
         if file_type and file_id:
-            file_path = await save_file(update, context, file_type, file_id, group.id if group else None)
-            if file_path:
-                update_message_with_file(msg, file_type, file_id, file_path, file_size, mime_type)
+            update_record_with_pending_file(record, file_type, file_id, file_size, mime_type)
         
-        session.add(msg)
-        session.commit()
+        # 写入消息（批量模式下进入写入队列）
+        if INGEST_MODE == 'batch':
+            await ingest_queue.put(record)
+        else:
+            await run_db(save_records, [record])
+            if record['file_status'] == 'pending':
+                media_pipeline.notify()
         
         # 记录日志
-        logger.info(f"保存消息: 用户={user.telegram_id}, 群组={group.telegram_id if group else None}, 类型={message.chat.type}")
+        logger.info(f"保存消息: 用户={message.from_user.id}, 群组={message.chat.id if is_group else None}, 类型={message.chat.type}")
         
-        # 检查群组活跃度
-        if message.chat.type in ['group', 'supergroup']:
+        # 更新并检查群组活跃度
+        if is_group:
+            activity_tracker.record(message.chat.id, message.from_user.id)
             await check_group_activity(update, context)
         
         # 检查用户行为
         await check_user_behavior_alert(update, context)
         
-        # 检查敏感词
+        # 检查敏感词（群组关键词与全局敏感词）
         if message.text:
-            sensitive_words = monitor.check_sensitive_content(message.text)
-            if sensitive_words:
+            group_identity = identity_cache.get_group(message.chat.id) if is_group else None
+            matches = await run_db(
+                keyword_registry.check,
+                group_identity.id if group_identity else None,
+                message.text
+            )
+            if matches:
                 await update.message.reply_text(
                     f"⚠️ 检测到敏感词使用！\n"
-                    f"敏感词: {', '.join(sensitive_words)}"
+                    f"敏感词: {', '.join(word for word, _ in matches)}\n"
+                    f"严重程度: {max(severity for _, severity in matches)}"
                 )
         
     except Exception as e:
         logger.error(f"处理消息时发生错误: {e}")
-    finally:
-        session.close()
 
 async def add_sensitive_word_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """添加敏感词命令"""
@@ -317,71 +317,96 @@ async def check_behavior_command(update: Update, context: ContextTypes.DEFAULT_T
     
     await update.message.reply_text(response)
 
+def checkin_user(user_id: int) -> Tuple[str, int]:
+    """执行签到（阻塞），返回 (状态, 当前积分)；状态为 not_found / already / ok"""
+    session = Session()
+    try:
+        # 获取用户
+        user = session.query(User).filter_by(telegram_id=user_id).first()
+        if not user:
+            return 'not_found', 0
+        
+        # 检查是否已经签到
+        now = datetime.now()
+        if user.last_checkin and user.last_checkin.date() == now.date():
+            return 'already', user.points
+        
+        # 更新签到信息
+        user.last_checkin = now
+        user.points += 10  # 每次签到获得10积分
+        session.commit()
+        return 'ok', user.points
+    finally:
+        session.close()
+
 async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理签到命令"""
     try:
         user_id = update.effective_user.id
-        session = Session()
         
         try:
-            # 获取用户
-            user = session.query(User).filter_by(telegram_id=user_id).first()
-            if not user:
-                await update.message.reply_text("请先发送一条消息后再尝试签到！")
-                return
-            
-            # 检查是否已经签到
-            now = datetime.now()
-            if user.last_checkin and user.last_checkin.date() == now.date():
-                await update.message.reply_text("今天已经签到过了！")
-                return
-            
-            # 更新签到信息
-            user.last_checkin = now
-            user.points += 10  # 每次签到获得10积分
-            session.commit()
-            
+            status, points = await run_db(checkin_user, user_id)
+        except Exception as e:
+            logger.error(f"处理签到失败: {e}")
+            await update.message.reply_text("签到失败，请稍后重试！")
+            return
+        
+        if status == 'not_found':
+            await update.message.reply_text("请先发送一条消息后再尝试签到！")
+        elif status == 'already':
+            await update.message.reply_text("今天已经签到过了！")
+        else:
             await update.message.reply_text(
                 f"✅ 签到成功！\n"
                 f"获得积分: 10\n"
-                f"当前积分: {user.points}"
+                f"当前积分: {points}"
             )
             
-        except Exception as e:
-            logger.error(f"处理签到失败: {e}")
-            await update.message.reply_text("签到失败，请稍后重试！")
-        finally:
-            session.close()
-            
     except Exception as e:
         logger.error(f"处理签到命令失败: {e}")
         await update.message.reply_text("处理签到命令时发生错误！")
 
+def create_verification_code(user_id: int) -> Tuple[str, Optional[str]]:
+    """生成并保存验证码（阻塞），返回 (状态, 验证码)；状态为 not_found / verified / ok"""
+    session = Session()
+    try:
+        # 获取用户
+        user = session.query(User).filter_by(telegram_id=user_id).first()
+        if not user:
+            return 'not_found', None
+        
+        # 检查是否已经验证
+        if user.is_verified:
+            return 'verified', None
+        
+        # 生成验证码
+        verification_code = generate_verification_code()
+        
+        # 保存验证码到用户记录
+        user.verification_code = verification_code
+        session.commit()
+        identity_cache.invalidate_user(user_id)
+        return 'ok', verification_code
+    finally:
+        session.close()
+
 async def verify_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理验证命令"""
     try:
         user_id = update.effective_user.id
-        session = Session()
         
         try:
-            # 获取用户
-            user = session.query(User).filter_by(telegram_id=user_id).first()
-            if not user:
-                await update.message.reply_text("请先发送一条消息后再尝试验证！")
-                return
-            
-            # 检查是否已经验证
-            if user.is_verified:
-                await update.message.reply_text("您已经通过验证了！")
-                return
-            
-            # 生成验证码
-            verification_code = generate_verification_code()
-            
-            # 保存验证码到用户记录
-            user.verification_code = verification_code
-            session.commit()
-            
+            status, verification_code = await run_db(create_verification_code, user_id)
+        except Exception as e:
+            logger.error(f"处理验证失败: {e}")
+            await update.message.reply_text("验证失败，请稍后重试！")
+            return
+        
+        if status == 'not_found':
+            await update.message.reply_text("请先发送一条消息后再尝试验证！")
+        elif status == 'verified':
+            await update.message.reply_text("您已经通过验证了！")
+        else:
             await update.message.reply_text(
                 f"🔐 验证码已生成\n"
                 f"请在5分钟内输入以下验证码：\n"
@@ -390,16 +415,24 @@ async def verify_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='Markdown'
             )
             
-        except Exception as e:
-            logger.error(f"处理验证失败: {e}")
-            await update.message.reply_text("验证失败，请稍后重试！")
-        finally:
-            session.close()
-            
     except Exception as e:
         logger.error(f"处理验证命令失败: {e}")
         await update.message.reply_text("处理验证命令时发生错误！")
 
+def load_group_keywords(group_id: int) -> Optional[List[str]]:
+    """读取群组关键词列表（阻塞），群组未注册时返回None"""
+    session = Session()
+    try:
+        # 获取群组
+        group = session.query(Group).filter_by(telegram_id=group_id).first()
+        if not group:
+            return None
+        
+        # 获取群组的关键词列表
+        return [keyword.word for keyword in session.query(Keyword).filter_by(group_id=group.id).all()]
+    finally:
+        session.close()
+
 async def keywords_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理关键词命令"""
     chat_type = update.effective_chat.type
@@ -411,45 +444,185 @@ async def keywords_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 获取群组ID
         group_id = update.effective_chat.id
         
-        # 获取数据库会话
-        session = Session()
         try:
-            # 获取群组
-            group = session.query(Group).filter_by(telegram_id=group_id).first()
-            if not group:
-                await update.message.reply_text("群组未注册，请先发送一条消息！")
-                return
-            
-            # 获取群组的关键词列表
-            keywords = session.query(Keyword).filter_by(group_id=group.id).all()
-            
-            if not keywords:
-                await update.message.reply_text("当前没有设置任何关键词。\n\n使用 /addword 添加关键词")
-                return
-            
-            # 构建响应消息
-            response = "📝 当前监控的关键词列表：\n\n"
-            for keyword in keywords:
-                response += f"- {keyword.word}\n"
-            
-            response += "\n使用 /addword 添加关键词\n使用 /removeword 删除关键词"
-            
-            await update.message.reply_text(response)
-            
+            keywords = await run_db(load_group_keywords, group_id)
         except Exception as e:
             logger.error(f"获取关键词列表失败: {e}")
             await update.message.reply_text("获取关键词列表失败，请稍后重试！")
-        finally:
-            session.close()
+            return
+        
+        if keywords is None:
+            await update.message.reply_text("群组未注册，请先发送一条消息！")
+            return
+        
+        if not keywords:
+            await update.message.reply_text("当前没有设置任何关键词。\n\n使用 /addword 添加关键词")
+            return
+        
+        # 构建响应消息
+        response = "📝 当前监控的关键词列表：\n\n"
+        for word in keywords:
+            response += f"- {word}\n"
+        
+        response += "\n使用 /addword 添加关键词\n使用 /removeword 删除关键词"
+        
+        await update.message.reply_text(response)
             
     except Exception as e:
         logger.error(f"处理关键词命令失败: {e}")
         await update.message.reply_text("处理关键词命令时发生错误！")
 
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看运行指标（仅管理员）"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("此命令仅限管理员使用！")
+        return
+    
+    response = "📈 运行指标\n\n"
+    
+    stats = startup_timer.stats()
+    response += "启动耗时:\n"
+    for phase in ('imports', 'ready', 'first_update'):
+        if phase in stats:
+            response += f"- {phase}: {stats[phase]:.2f} 秒\n"
+    response += f"- 目标: {stats['target']:.1f} 秒\n\n"
+    
+    if update_processor:
+        stats = update_processor.stats()
+        response += (
+            f"更新处理:\n"
+            f"- 并发上限: {stats['max_in_flight']}\n"
+            f"- 处理中: {stats['running']}\n"
+            f"- 排队会话数: {stats['queued_chats']}\n"
+            f"- 排队更新数: {stats['queued_updates']}\n"
+            f"- 单会话最大队列深度: {stats['max_depth']}\n"
+            f"- 已处理: {stats['processed']}\n"
+        )
+        for chat_id, depth in stats['top_chats']:
+            response += f"  · 会话 {chat_id}: {depth}\n"
+        response += "\n"
+    
+    response += "身份缓存:\n"
+    for name, stats in identity_cache.stats().items():
+        response += f"- {name}: 大小 {stats['size']}, 命中 {stats['hits']}, 未命中 {stats['misses']}\n"
+    
+    stats = result_cache.stats()
+    response += (
+        f"\n统计结果缓存:\n"
+        f"- 大小: {stats['size']}, 命中: {stats['hits']}, 过期命中: {stats['stale_hits']}, "
+        f"未命中: {stats['misses']}, 淘汰: {stats['evictions']}\n"
+    )
+    
+    stats = chart_renderer.stats()
+    response += (
+        f"\n图表缓存:\n"
+        f"- 绘图进程: {stats['workers']}, 大小: {stats['size']}, 命中: {stats['hits']}, 未命中: {stats['misses']}\n"
+    )
+    
+    stats = media_pipeline.stats()
+    response += (
+        f"\n文件下载:\n"
+        f"- 并发: {stats['workers']}, 进行中: {stats['in_progress']}, "
+        f"已下载: {stats['downloaded']}, 失败: {stats['failed']}\n"
+    )
+    
+    response += "\n数据库线程池:\n"
+    for executor in (db_executor, analytics_executor):
+        stats = executor.stats()
+        response += f"- {executor.name}: 线程 {stats['workers']}, 等待中 {stats['pending']}, 已完成 {stats['completed']}, 失败 {stats['failed']}\n"
+    
+    await update.message.reply_text(response)
+
+def notify_media_pipeline(batch: List[dict]) -> None:
+    """批量写入后，如有待下载文件则唤醒下载流水线"""
+    if any(record['file_status'] == 'pending' for record in batch):
+        media_pipeline.notify()
+
+async def post_init(application: Application) -> None:
+    """应用启动后的初始化"""
+    # 补齐旧数据库缺少的列，须在读写消息表之前完成
+    try:
+        await run_db(ensure_media_columns)
+    except Exception as e:
+        logger.error(f"补齐消息表下载状态列失败: {e}")
+    
+    # 旧数据库缺少的消息表索引，热点查询依赖这些索引
+    try:
+        await run_db(ensure_message_indexes)
+    except Exception as e:
+        logger.error(f"创建消息表索引失败: {e}")
+    
+    # 从数据库恢复群组活跃度计数
+    try:
+        await run_db(activity_tracker.rehydrate)
+    except Exception as e:
+        logger.error(f"恢复群组活跃度计数失败: {e}")
+    
+    # 升级后首次启动时从历史消息生成每日汇总
+    try:
+        await run_db(ensure_rollups)
+    except Exception as e:
+        logger.error(f"重建每日汇总失败: {e}")
+    try:
+        await run_db(ensure_sketches)
+    except Exception as e:
+        logger.error(f"重建发言用户草图失败: {e}")
+    try:
+        await run_db(ensure_group_counters)
+    except Exception as e:
+        logger.error(f"重建群组计数失败: {e}")
+    try:
+        await run_db(ensure_counters)
+    except Exception as e:
+        logger.error(f"初始化全局计数失败: {e}")
+    try:
+        await run_db(ensure_watermarks)
+    except Exception as e:
+        logger.error(f"创建表变更水位失败: {e}")
+    # 定期校准全局计数
+    await counter_reconciler.start()
+    
+    # 启动消息写入队列
+    if INGEST_MODE == 'batch':
+        ingest_queue.flush_listeners.append(notify_media_pipeline)
+        await ingest_queue.start()
+    
+    # 启动文件下载流水线，继续下载上次未完成的文件
+    await media_pipeline.start(application.bot)
+    
+    startup_timer.mark_ready()
+
+async def note_first_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """在其他处理器之后执行，记录首条更新的处理时间"""
+    startup_timer.mark_first_update()
+
+async def post_shutdown(application: Application) -> None:
+    """应用关闭时的清理"""
+    # 停止计数校准
+    await counter_reconciler.stop()
+    # 停止文件下载，未完成的任务下次启动时继续
+    await media_pipeline.stop()
+    # 写入队列中剩余的消息
+    await ingest_queue.stop()
+    # 关闭绘图进程
+    chart_renderer.shutdown()
+    # 等待数据库线程池中的任务完成
+    db_executor.shutdown()
+    analytics_executor.shutdown()
+
 def main() -> None:
     """启动机器人"""
     # 创建应用
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    # 不同会话的更新并行处理，同一会话内保持顺序
+    if update_processor:
+        builder = builder.concurrent_updates(update_processor)
+    application = builder.build()
     
     # 添加命令处理器
     application.add_handler(CommandHandler("start", start))
@@ -464,10 +637,14 @@ def main() -> None:
     application.add_handler(CommandHandler("addword", add_sensitive_word_command))
     application.add_handler(CommandHandler("removeword", remove_sensitive_word_command))
     application.add_handler(CommandHandler("checkbehavior", check_behavior_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
     
     # 添加通用消息处理器（必须放在最后）
     application.add_handler(MessageHandler(filters.ALL, handle_message))
     
+    # 记录首条更新处理完成的时间（分组1在默认分组的处理器之后执行）
+    application.add_handler(TypeHandler(object, note_first_update), group=1)
+    
     # 启动机器人
     application.run_polling()
 
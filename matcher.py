@@ -0,0 +1,82 @@
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Tuple, Union
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机
+
+    构建后只读，可在多个协程/线程间共享；词表变化时重新构建新实例并整体替换。
+    传入映射时，每个模式串可携带一个附加值（如严重程度），通过 values 查询。
+    """
+
+    def __init__(self, patterns: Union[Iterable[str], Mapping[str, Any]]):
+        # goto[state] 为字符到下一状态的映射，fail[state] 为失配跳转，
+        # output[state] 为在该状态结束的所有模式串
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[str, ...]] = [()]
+        if isinstance(patterns, Mapping):
+            self.values: Dict[str, Any] = {p: v for p, v in patterns.items() if p}
+        else:
+            self.values = {p: None for p in patterns if p}
+        self.patterns = frozenset(self.values)
+
+        for pattern in self.patterns:
+            self._insert(pattern)
+        self._build_fail_links()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _insert(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] = (pattern,)
+
+    def _build_fail_links(self) -> None:
+        """广度优先计算失配跳转，并合并后缀状态的输出"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                if self._output[fail]:
+                    self._output[next_state] = self._output[next_state] + self._output[fail]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """单次扫描文本，依次产出 (起始位置, 结束位置, 模式串)"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                end = index + 1
+                for pattern in output[state]:
+                    yield end - len(pattern), end, pattern
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回文本中所有匹配及其位置"""
+        return list(self.finditer(text))
+
+    def matched_patterns(self, text: str) -> List[str]:
+        """返回文本中出现过的模式串（按首次出现顺序去重）"""
+        found = {}
+        for _, _, pattern in self.finditer(text):
+            found.setdefault(pattern, None)
+        return list(found)
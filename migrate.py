@@ -1,5 +1,11 @@
-from sqlalchemy import create_engine, text
-from models import Base, engine
+from sqlalchemy import text
+from models import engine
+from query_plan import ensure_message_indexes, verify_query_plans, QueryPlanError
+from rollup import ensure_rollups
+from hll import ensure_sketches
+from group_counters import ensure_group_counters
+from counters import ensure_counters
+from watermarks import ensure_watermarks
 
 def migrate_database():
     """执行数据库迁移"""
@@ -65,6 +71,11 @@ def migrate_database():
                 if 'chat_type' not in columns:
                     conn.execute(text("ALTER TABLE messages ADD COLUMN chat_type VARCHAR(50) DEFAULT 'text'"))
                     print("成功添加 chat_type 列")
+                
+                if 'file_status' not in columns:
+                    conn.execute(text("ALTER TABLE messages ADD COLUMN file_status VARCHAR(20)"))
+                    print("成功添加 file_status 列")
+                
             
             # 检查 user_groups 表是否存在
             result = conn.execute(text("SELECT * FROM sqlite_master WHERE type='table' AND name='user_groups'"))
@@ -96,9 +107,31 @@ def migrate_database():
                 print("成功更新管理员状态")
             
             conn.commit()
-            print("数据库迁移完成")
+        
+        # 创建消息表索引
+        ensure_message_indexes()
+        print("已确认消息表索引")
+        # 从历史消息生成每日汇总（汇总表已有数据时跳过）
+        ensure_rollups()
+        # 从历史消息生成发言用户草图（草图表已有数据时跳过）
+        ensure_sketches()
+        # 补齐群组计数列并从历史数据计算（已有计数时跳过）
+        ensure_group_counters()
+        # 初始化全局计数（已有计数时跳过）
+        ensure_counters()
+        # 创建Web界面条件请求所用的表变更水位
+        ensure_watermarks()
+        print("数据库迁移完成")
     except Exception as e:
         print(f"数据库迁移失败: {e}")
 
 if __name__ == "__main__":
-    migrate_database() 
\ No newline at end of file
+    migrate_database()
+    
+    # 检查热点查询是否使用索引
+    try:
+        verify_query_plans()
+        print("热点查询执行计划检查通过")
+    except QueryPlanError as e:
+        print(f"执行计划检查失败: {e}")
+        raise SystemExit(1) 
\ No newline at end of file
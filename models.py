@@ -1,8 +1,10 @@
 import os
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, Float, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Date, Boolean, ForeignKey, Float, Text, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -10,14 +12,71 @@ load_dotenv()
 
 # 获取当前文件所在目录的绝对路径
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# 数据库文件路径
-DATABASE_PATH = os.path.join(BASE_DIR, 'data', 'telegram_bot.db')
+# 数据库文件路径，可通过 DATABASE_PATH 指定（例如测试使用临时数据库）
+DATABASE_PATH = os.getenv('DATABASE_PATH') or os.path.join(BASE_DIR, 'data', 'telegram_bot.db')
 
 # 确保data目录存在
 os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
 
-# 创建数据库引擎
-engine = create_engine(f'sqlite:///{DATABASE_PATH}', connect_args={'check_same_thread': False})
+def _env(name: str, default: str) -> str:
+    """读取环境变量并去掉行内注释"""
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 数据库配置方案：production - WAL日志及性能相关PRAGMA；default - SQLite默认设置
+DB_PROFILE = _env('DB_PROFILE', 'production').lower()
+# 数据库被锁定时的等待时间（毫秒）
+DB_BUSY_TIMEOUT = int(_env('DB_BUSY_TIMEOUT', '5000'))
+# 页缓存大小，负数表示KiB
+DB_CACHE_SIZE = int(_env('DB_CACHE_SIZE', '-65536'))
+# 内存映射读取的最大字节数
+DB_MMAP_SIZE = int(_env('DB_MMAP_SIZE', '268435456'))
+# 连接池配置
+DB_POOL_SIZE = int(_env('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(_env('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(_env('DB_POOL_TIMEOUT', '30'))
+DB_READ_POOL_SIZE = int(_env('DB_READ_POOL_SIZE', '10'))
+
+def _set_sqlite_pragmas(dbapi_connection, read_only: bool) -> None:
+    """为新建立的SQLite连接设置PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    if DB_PROFILE == 'production':
+        if not read_only:
+            # WAL模式会持久化到数据库文件，读写互不阻塞
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+def create_db_engine(read_only: bool = False):
+    """创建写入或只读数据库引擎"""
+    if read_only:
+        url = f'sqlite:///file:{DATABASE_PATH}?mode=ro&uri=true'
+        pool_size = DB_READ_POOL_SIZE
+    else:
+        url = f'sqlite:///{DATABASE_PATH}'
+        pool_size = DB_POOL_SIZE
+    db_engine = create_engine(
+        url,
+        connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT / 1000},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT
+    )
+
+    @event.listens_for(db_engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        _set_sqlite_pragmas(dbapi_connection, read_only)
+
+    return db_engine
+
+# 创建数据库引擎：写入引擎用于机器人写入，只读引擎用于统计和Web界面
+engine = create_db_engine()
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -55,10 +114,21 @@ class Group(Base):
     min_activity_threshold = Column(Integer, default=10)  # 最低活跃度阈值
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 计数列，入库时与消息在同一事务中更新
+    message_count = Column(Integer, nullable=False, default=0)
+    member_count = Column(Integer, nullable=False, default=0)
+    last_message_at = Column(DateTime)
 
     messages = relationship("Message", back_populates="group")
     users = relationship("User", secondary="user_groups", back_populates="groups")
 
+    # 群组列表按活跃度排序分页
+    __table_args__ = (
+        Index('ix_groups_last_message_at', 'last_message_at'),
+        Index('ix_groups_message_count', 'message_count'),
+        Index('ix_groups_member_count', 'member_count'),
+    )
+
 class Message(Base):
     """消息表"""
     __tablename__ = 'messages'
@@ -79,10 +149,20 @@ class Message(Base):
     file_path = Column(String(512))  # 本地文件路径
     file_size = Column(Integer)  # 文件大小（字节）
     mime_type = Column(String(100))  # MIME类型
+    file_status = Column(String(20))  # 文件下载状态：pending, done, failed, skipped
     
     user = relationship("User", back_populates="messages")
     group = relationship("Group", back_populates="messages")
 
+    # 统计查询均按 群组/用户 + 时间范围 过滤，或按时间倒序分页（可按文件类型过滤）
+    __table_args__ = (
+        Index('ix_messages_group_id_created_at', 'group_id', 'created_at'),
+        Index('ix_messages_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_messages_created_at', 'created_at'),
+        Index('ix_messages_file_id', 'file_id'),
+        Index('ix_messages_file_type_created_at', 'file_type', 'created_at'),
+    )
+
 class Keyword(Base):
     """关键词表"""
     __tablename__ = 'keywords'
@@ -113,6 +193,90 @@ class Alert(Base):
     group = relationship("Group")
     user = relationship("User")
 
+class PendingDownload(Base):
+    """待下载文件队列，重启后继续下载"""
+    __tablename__ = 'pending_downloads'
+    
+    id = Column(Integer, primary_key=True)
+    file_id = Column(String(255), nullable=False)  # Telegram文件ID
+    file_type = Column(String(50))
+    file_size = Column(Integer)
+    chat_id = Column(Integer)  # 群组的Telegram ID，用于存储目录
+    status = Column(String(20), default='pending')  # pending, failed
+    attempts = Column(Integer, default=0)  # 已尝试次数
+    last_error = Column(String(512))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class MessageDailyStat(Base):
+    """每日消息汇总表，按 日期 + 群组 + 用户 + 消息类型 累计，入库时增量更新"""
+    __tablename__ = 'message_daily_stats'
+    
+    day = Column(Date, primary_key=True)  # 消息日期（UTC）
+    group_id = Column(Integer, primary_key=True, default=0)  # 群组内部ID，私聊为0
+    user_id = Column(Integer, primary_key=True)
+    chat_type = Column(String(50), primary_key=True, default='text')
+    message_count = Column(Integer, nullable=False, default=0)
+    media_bytes = Column(Integer, nullable=False, default=0)  # 多媒体文件总字节数
+    last_message_at = Column(DateTime)  # 当日最后一条消息时间
+
+    __table_args__ = (
+        Index('ix_message_daily_stats_group_id_day', 'group_id', 'day'),
+        Index('ix_message_daily_stats_user_id_day', 'user_id', 'day'),
+    )
+
+class TermFrequency(Base):
+    """词频表：按 群组 + 日期 + 词 累计分词结果，关键词分析直接在此表上聚合"""
+    __tablename__ = 'term_frequencies'
+    
+    group_id = Column(Integer, primary_key=True, default=0)  # 群组内部ID，私聊为0
+    day = Column(Date, primary_key=True)  # 消息日期（UTC）
+    term = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class IndexCheckpoint(Base):
+    """增量索引进度：记录已处理到的最大消息ID"""
+    __tablename__ = 'index_checkpoints'
+    
+    name = Column(String(50), primary_key=True)  # 索引名称
+    last_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserSketch(Base):
+    """发言用户草图表：按 群组 + 日期 保存 HyperLogLog 寄存器（zlib压缩），合并后估计去重用户数"""
+    __tablename__ = 'user_sketches'
+    
+    group_id = Column(Integer, primary_key=True, default=0)  # 群组内部ID，私聊为0
+    day = Column(Date, primary_key=True)  # 消息日期（UTC）
+    registers = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_sketches_day', 'day'),
+    )
+
+class Counter(Base):
+    """全局计数表（用户数、群组数、消息数），入库时增量更新，定期与精确计数校准"""
+    __tablename__ = 'counters'
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # 最后一次更新时间
+    reconciled_at = Column(DateTime)  # 最后一次校准时间
+
+class MessageHourlyCount(Base):
+    """每小时（UTC）消息数，用于最近24小时的消息统计"""
+    __tablename__ = 'message_hourly_counts'
+    
+    hour = Column(DateTime, primary_key=True)  # 整点时间
+    message_count = Column(Integer, nullable=False, default=0)
+
+class TableVersion(Base):
+    """表的变更水位，由触发器在每次插入、更新、删除时递增，用于HTTP条件请求"""
+    __tablename__ = 'table_versions'
+    
+    name = Column(String(50), primary_key=True)  # 表名
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)  # 最后一次变更的时间（UTC，精确到秒）
+
 class UserGroup(Base):
     __tablename__ = 'user_groups'
     
@@ -121,4 +285,17 @@ class UserGroup(Base):
     joined_at = Column(DateTime, default=datetime.utcnow)
 
 # 创建所有表
-Base.metadata.create_all(engine) 
\ No newline at end of file
+Base.metadata.create_all(engine)
+
+# 只读引擎需要数据库文件已存在，因此在建表之后创建
+read_engine = create_db_engine(read_only=True)
+ReadSession = sessionmaker(bind=read_engine)
+
+@contextmanager
+def session_scope(factory=None):
+    """为一次调用创建会话，结束时关闭，加载的对象随身份映射一起释放（默认只读）"""
+    session = (factory or ReadSession)()
+    try:
+        yield session
+    finally:
+        session.close()
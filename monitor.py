@@ -1,9 +1,17 @@
+import os
+import time
 import logging
+import threading
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from sqlalchemy import func, cast, Integer
 from sqlalchemy.orm import sessionmaker
-from models import engine, Message, User, Group
+from models import read_engine, session_scope, Message, User, Group
 from telegram import Update
 from telegram.ext import ContextTypes
+from db_executor import run_db
+from rollup import STATS_SOURCE, window_rows
+from hll import DISTINCT_USERS, distinct_users
 
 # 配置日志
 logging.basicConfig(
@@ -12,34 +20,65 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 创建数据库会话
-Session = sessionmaker(bind=engine)
+# 创建数据库会话（只读，与机器人写入互不阻塞）
+Session = sessionmaker(bind=read_engine)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 活跃度滑动窗口长度（小时）和分桶粒度（秒）
+ACTIVITY_WINDOW_HOURS = int(_env('ACTIVITY_WINDOW_HOURS', '24'))
+ACTIVITY_BUCKET_SECONDS = int(_env('ACTIVITY_BUCKET_SECONDS', '3600'))
+# 低活跃度阈值（窗口内消息数）
+ACTIVITY_MIN_MESSAGES = int(_env('ACTIVITY_MIN_MESSAGES', '10'))
+# 同一群组低活跃度告警的最小间隔（秒）
+ACTIVITY_ALERT_INTERVAL = float(_env('ACTIVITY_ALERT_INTERVAL', '21600'))
 
 class GroupMonitor:
-    def __init__(self):
-        self.session = Session()
+    """群组监控查询，每次调用使用独立的短生命周期会话，实例可在多个处理器间共享"""
+
+    def __init__(self, session_factory=Session):
+        self.session_factory = session_factory
         
     def check_message_activity(self, group_id: int, hours: int = 24) -> dict:
         """检查群组消息活跃度"""
+        with session_scope(self.session_factory) as session:
+            return self._message_activity(session, group_id, hours)
+    
+    def _message_activity(self, session, group_id: int, hours: int) -> dict:
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
         
-        # 获取指定时间内的消息数量
-        message_count = self.session.query(Message).filter(
-            Message.group_id == group_id,
-            Message.created_at >= cutoff_time
-        ).count()
+        if STATS_SOURCE == 'rollup':
+            # 从每日汇总表读取
+            rows = window_rows(session, cutoff_time, group_id=group_id, by_user=DISTINCT_USERS != 'hll')
+            message_count = sum(row[4] for row in rows)
+            active_users = len({row[2] for row in rows})
+        else:
+            # 获取指定时间内的消息数量
+            message_count = session.query(Message).filter(
+                Message.group_id == group_id,
+                Message.created_at >= cutoff_time
+            ).count()
+            active_users = None
         
-        # 获取活跃用户数
-        active_users = self.session.query(User).join(Message).filter(
-            Message.group_id == group_id,
-            Message.created_at >= cutoff_time
-        ).distinct().count()
-        
-        return {
+        activity = {
             'message_count': message_count,
-            'active_users': active_users,
             'time_period': hours
         }
+        if DISTINCT_USERS == 'hll':
+            # 合并草图估计活跃用户数
+            activity['active_users'], activity['active_users_error'] = distinct_users(
+                session, cutoff_time, group_id=group_id
+            )
+        elif active_users is not None:
+            activity['active_users'] = active_users
+        else:
+            # 获取活跃用户数
+            activity['active_users'] = session.query(User).join(Message).filter(
+                Message.group_id == group_id,
+                Message.created_at >= cutoff_time
+            ).distinct().count()
+        return activity
     
     def check_keyword_alerts(self, group_id: int) -> list:
         """检查关键词告警"""
@@ -48,11 +87,12 @@ class GroupMonitor:
     
     def check_user_behavior(self, user_id: int, group_id: int) -> dict:
         """检查用户行为"""
-        # 获取用户最近的消息
-        recent_messages = self.session.query(Message).filter(
-            Message.user_id == user_id,
-            Message.group_id == group_id
-        ).order_by(Message.created_at.desc()).limit(10).all()
+        # 获取用户最近的消息时间（只读取所需的列，不加载消息对象）
+        with session_scope(self.session_factory) as session:
+            recent_messages = session.query(Message.created_at).filter(
+                Message.user_id == user_id,
+                Message.group_id == group_id
+            ).order_by(Message.created_at.desc()).limit(10).all()
         
         # 分析用户行为
         behavior = {
@@ -73,23 +113,123 @@ class GroupMonitor:
             )
         except Exception as e:
             logger.error(f"发送告警消息失败: {str(e)}")
-    
-    def close(self):
-        """关闭数据库会话"""
-        self.session.close()
 
 # 创建监控实例
 monitor = GroupMonitor()
 
+class ActivityWindow:
+    """单个群组的滑动窗口计数：按时间分桶记录消息数和发言用户"""
+
+    def __init__(self, bucket_seconds: int, bucket_count: int):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = bucket_count
+        self.slots = [-1] * bucket_count  # 每个桶当前对应的时间槽编号
+        self.counts = [0] * bucket_count
+        self.users = [set() for _ in range(bucket_count)]
+
+    def _bucket(self, slot: int) -> int:
+        index = slot % self.bucket_count
+        if self.slots[index] != slot:
+            # 桶已过期，复用给新的时间槽
+            self.slots[index] = slot
+            self.counts[index] = 0
+            self.users[index] = set()
+        return index
+
+    def add(self, user_id: int, timestamp: float, count: int = 1) -> None:
+        index = self._bucket(int(timestamp // self.bucket_seconds))
+        self.counts[index] += count
+        self.users[index].add(user_id)
+
+    def totals(self, now: float) -> Tuple[int, int]:
+        """返回窗口内的 (消息数, 发言用户数估计)"""
+        oldest = int(now // self.bucket_seconds) - self.bucket_count + 1
+        message_count = 0
+        users = set()
+        for index, slot in enumerate(self.slots):
+            if slot >= oldest:
+                message_count += self.counts[index]
+                users |= self.users[index]
+        return message_count, len(users)
+
+class ActivityTracker:
+    """各群组最近一段时间的活跃度计数，消息入库时更新，避免每条消息都查询数据库"""
+
+    def __init__(self, window_hours: int = ACTIVITY_WINDOW_HOURS, bucket_seconds: int = ACTIVITY_BUCKET_SECONDS,
+                 alert_interval: float = ACTIVITY_ALERT_INTERVAL):
+        self.window_hours = window_hours
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = max(1, window_hours * 3600 // bucket_seconds)
+        self.alert_interval = alert_interval
+        self._lock = threading.Lock()
+        self._windows: Dict[int, ActivityWindow] = {}
+        self._last_alert: Dict[int, float] = {}
+
+    def _window(self, chat_id: int) -> ActivityWindow:
+        window = self._windows.get(chat_id)
+        if window is None:
+            window = self._windows[chat_id] = ActivityWindow(self.bucket_seconds, self.bucket_count)
+        return window
+
+    def record(self, chat_id: int, user_id: int, timestamp: Optional[float] = None) -> None:
+        """记录一条群组消息"""
+        with self._lock:
+            self._window(chat_id).add(user_id, timestamp or time.time())
+
+    def activity(self, chat_id: int) -> dict:
+        """返回群组在窗口内的活跃度，格式与 GroupMonitor.check_message_activity 相同"""
+        with self._lock:
+            window = self._windows.get(chat_id)
+            message_count, active_users = window.totals(time.time()) if window else (0, 0)
+        return {
+            'message_count': message_count,
+            'active_users': active_users,
+            'time_period': self.window_hours
+        }
+
+    def should_alert(self, chat_id: int) -> bool:
+        """同一群组在告警间隔内只告警一次"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_alert.get(chat_id)
+            if last is not None and now - last < self.alert_interval:
+                return False
+            self._last_alert[chat_id] = now
+            return True
+
+    def rehydrate(self) -> None:
+        """从数据库恢复窗口内的计数（阻塞，启动时在数据库线程池中调用）"""
+        cutoff_time = datetime.utcnow() - timedelta(hours=self.window_hours)
+        slot = cast(func.strftime('%s', Message.created_at), Integer) / self.bucket_seconds
+        session = Session()
+        try:
+            rows = session.query(
+                Group.telegram_id, User.telegram_id, slot, func.count(Message.id)
+            ).join(Group, Message.group_id == Group.id).join(User, Message.user_id == User.id).filter(
+                Message.created_at >= cutoff_time
+            ).group_by(Group.telegram_id, User.telegram_id, slot).all()
+        finally:
+            session.close()
+
+        with self._lock:
+            self._windows.clear()
+            for chat_id, user_id, slot_number, count in rows:
+                self._window(chat_id).add(user_id, slot_number * self.bucket_seconds, count)
+        logger.info(f"已恢复群组活跃度计数: 群组数={len(self._windows)}")
+
+# 创建活跃度计数实例
+activity_tracker = ActivityTracker()
+
 async def check_group_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """检查群组活跃度"""
     if not update.effective_chat.type == 'group':
         return
     
     group_id = update.effective_chat.id
-    activity = monitor.check_message_activity(group_id)
+    activity = activity_tracker.activity(group_id)
     
-    if activity['message_count'] < 10:  # 如果24小时内消息少于10条
+    # 如果24小时内消息少于阈值，每个告警间隔内只提醒一次
+    if activity['message_count'] < ACTIVITY_MIN_MESSAGES and activity_tracker.should_alert(group_id):
         await monitor.send_alert(
             update,
             context,
@@ -106,7 +246,7 @@ async def check_user_behavior_alert(update: Update, context: ContextTypes.DEFAUL
     user_id = update.effective_user.id
     group_id = update.effective_chat.id
     
-    behavior = monitor.check_user_behavior(user_id, group_id)
+    behavior = await run_db(monitor.check_user_behavior, user_id, group_id)
     
     if behavior['warning_count'] > 3:  # 如果警告次数超过3次
         await monitor.send_alert(
@@ -0,0 +1,160 @@
+import sys
+import logging
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Callable, Tuple
+from sqlalchemy import select, func, text
+from models import engine, Session, Message, User, Group, MessageDailyStat, TermFrequency, UserSketch
+from aggregation import exact_stats_queries
+from rollup import window_queries
+from hll import window_sketch_queries
+from export import messages_page_query
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+class QueryPlanError(RuntimeError):
+    """热点查询退化为全表扫描"""
+
+def ensure_message_indexes() -> None:
+    """创建消息表缺少的索引并更新统计信息（已存在的索引跳过）
+
+    旧数据库只由 create_all 建表时才会带上索引，机器人启动时和 migrate.py 都会调用。
+    """
+    with engine.begin() as conn:
+        for index in Message.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        conn.execute(text(f"ANALYZE {Message.__tablename__}"))
+
+def _since(days: int = 30) -> datetime:
+    return datetime.now() - timedelta(days=days)
+
+def _cursor():
+    """任意一页的游标条件"""
+    return _since(), 1000
+
+def _partial_since(days: int = 30) -> datetime:
+    """起始日不完整的窗口起点，window_rows / window_sketch 会同时查询汇总表和消息表"""
+    return datetime.combine(_since(days).date(), time(12))
+
+# 统计查询的范围：名称 -> 查询参数（群组、用户、全局）
+_STATS_SCOPES = {
+    'group': {'group_id': 1},
+    'user': {'user_id': 1},
+    'all': {},
+}
+
+# 热点查询：名称 -> 构造查询语句的函数，直接调用各模块构造查询的函数，与实际执行的语句一致
+HOT_QUERIES: Dict[str, Callable] = {
+    # monitor.check_message_activity 消息数量（STATS_SOURCE=exact）
+    'group_message_count_24h': lambda session: select(func.count()).select_from(Message).where(
+        Message.group_id == 1,
+        Message.created_at >= datetime.utcnow() - timedelta(hours=24)
+    ),
+    # monitor.check_message_activity 活跃用户数（STATS_SOURCE=exact）
+    'group_active_users_24h': lambda session: select(func.count(func.distinct(User.id))).select_from(User).join(Message).where(
+        Message.group_id == 1,
+        Message.created_at >= datetime.utcnow() - timedelta(hours=24)
+    ),
+    # hll.window_sketch 群组草图（monitor / 群组统计）
+    'group_sketches_30d': lambda session: window_sketch_queries(session, _partial_since(), group_id=1)[0],
+    'group_sketch_raw_30d': lambda session: window_sketch_queries(session, _partial_since(), group_id=1)[1],
+    # hll.window_sketch 全局草图（webui /api/stats）
+    'sketches_24h': lambda session: window_sketch_queries(session, _partial_since(1))[0],
+    'sketch_raw_24h': lambda session: window_sketch_queries(session, _partial_since(1))[1],
+    # term_index.top_terms 群组关键词
+    'group_terms_30d': lambda session: select(TermFrequency.term, func.sum(TermFrequency.count)).where(
+        TermFrequency.group_id == 1,
+        TermFrequency.day >= _since().date()
+    ).group_by(TermFrequency.term),
+    # webui /api/messages 键集分页（任意页）
+    'messages_page': lambda session: messages_page_query(session, 20, after=_cursor()),
+    'group_messages_page': lambda session: messages_page_query(session, 20, group_id=1, after=_cursor()),
+    'user_messages_page': lambda session: messages_page_query(session, 20, user_id=1, after=_cursor()),
+    'file_type_messages_page': lambda session: messages_page_query(session, 20, file_type='photo', after=_cursor()),
+    # webui /api/groups 按活跃度分页
+    'groups_by_activity': lambda session: select(Group).order_by(Group.last_message_at.desc(), Group.id.desc()).limit(20),
+    'groups_by_messages': lambda session: select(Group).order_by(Group.message_count.desc(), Group.id.desc()).limit(20),
+    # webui /api/stats 活跃群组数（计数模式）
+    'active_groups_by_last_message': lambda session: select(func.count(Group.id)).where(
+        Group.last_message_at >= datetime.utcnow() - timedelta(hours=24)
+    ),
+    # webui /api/stats 最近24小时消息数
+    'recent_message_count_24h': lambda session: select(func.count()).select_from(Message).where(
+        Message.created_at >= datetime.utcnow() - timedelta(hours=24)
+    ),
+    # webui /api/stats 活跃群组数
+    'active_groups_24h': lambda session: select(func.count(func.distinct(Group.id))).select_from(Group).join(Message).where(
+        Message.created_at >= datetime.utcnow() - timedelta(hours=24)
+    ),
+}
+
+# aggregation.message_stats（STATS_SOURCE=exact）：analyzer / visualizer / webui 统计
+for _scope, _params in _STATS_SCOPES.items():
+    for _part in ('totals', 'message_types', 'daily_messages', 'user_counts'):
+        # 各用户消息数只在群组统计中查询（analyzer.get_group_stats）
+        if _part == 'user_counts' and 'group_id' not in _params:
+            continue
+        HOT_QUERIES[f'{_scope}_stats_{_part}_30d'] = (
+            lambda session, params=_params, part=_part: exact_stats_queries(session, _since(), **params)[part]
+        )
+# rollup.window_rows（STATS_SOURCE=rollup）：按用户的行，以及 DISTINCT_USERS=hll 时在数据库端合并用户的行
+for _scope, _params in _STATS_SCOPES.items():
+    for _by_user in (True, False):
+        if _by_user is False and 'user_id' in _params:
+            continue
+        _suffix = '' if _by_user else '_merged'
+        HOT_QUERIES[f'{_scope}_window_raw{_suffix}_30d'] = (
+            lambda session, params=_params, by_user=_by_user:
+                window_queries(session, _partial_since(), by_user=by_user, **params)[0]
+        )
+        HOT_QUERIES[f'{_scope}_window_rollup{_suffix}_30d'] = (
+            lambda session, params=_params, by_user=_by_user:
+                window_queries(session, _partial_since(), by_user=by_user, **params)[1]
+        )
+
+def explain(stmt) -> List[str]:
+    """返回查询语句（Core 语句或 ORM Query）的 EXPLAIN QUERY PLAN 结果"""
+    stmt = getattr(stmt, 'statement', stmt)
+    compiled = stmt.compile(dialect=engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+    return [row[-1] for row in rows]
+
+def _is_table_scan(detail: str, table: str) -> bool:
+    """判断执行计划中是否存在未使用索引的全表扫描或排序"""
+    if detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+        return True
+    return detail.startswith(f'SCAN {table}') and 'USING' not in detail
+
+def verify_query_plans(tables: Tuple[str, ...] = (Message.__tablename__, MessageDailyStat.__tablename__, TermFrequency.__tablename__,
+                                                  UserSketch.__tablename__, Group.__tablename__)) -> Dict[str, List[str]]:
+    """检查所有热点查询的执行计划，存在全表扫描时抛出 QueryPlanError"""
+    plans = {}
+    failures = []
+    session = Session()
+    try:
+        for name, build in HOT_QUERIES.items():
+            details = explain(build(session))
+            plans[name] = details
+            if any(_is_table_scan(detail, table) for detail in details for table in tables):
+                failures.append(f"{name}: {' | '.join(details)}")
+    finally:
+        session.close()
+
+    if failures:
+        raise QueryPlanError("以下热点查询退化为全表扫描:\n" + "\n".join(failures))
+    return plans
+
+if __name__ == '__main__':
+    try:
+        for name, details in verify_query_plans().items():
+            logger.info(f"{name}: {' | '.join(details)}")
+        logger.info("所有热点查询均使用索引")
+    except QueryPlanError as e:
+        logger.error(str(e))
+        sys.exit(1)
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 最多缓存的结果数
+RESULT_CACHE_SIZE = int(_env('RESULT_CACHE_SIZE', '256'))
+# 结果最长保留时间（秒），即使没有新消息也会重新计算
+RESULT_CACHE_TTL = float(_env('RESULT_CACHE_TTL', '600'))
+# 有新消息到达后仍可使用旧结果的时间（秒），0 表示有新消息立即失效
+RESULT_CACHE_STALENESS = float(_env('RESULT_CACHE_STALENESS', '60'))
+
+# 缓存键：(命令, 范围, 群组或用户的Telegram ID, 时间窗口)，范围为 group 或 user
+CacheKey = Tuple[str, str, int, Hashable]
+
+class _Entry:
+    __slots__ = ('value', 'watermark', 'created_at')
+
+    def __init__(self, value: Any, watermark: int):
+        self.value = value
+        self.watermark = watermark
+        self.created_at = time.monotonic()
+
+class ResultCache:
+    """/stats、/visualize 的结果缓存
+
+    每个群组和用户有一个入库水位，新消息入库时递增。水位未变化且未超过TTL时直接使用缓存；
+    水位变化后，结果在容忍时间内仍可使用，超过后重新计算。
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 staleness: float = RESULT_CACHE_STALENESS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.staleness = staleness
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._watermarks: Dict[Tuple[str, int], int] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def watermark(self, scope: str, scope_id: int) -> int:
+        """返回当前入库水位，计算结果前获取并在 put 时传入"""
+        with self._lock:
+            return self._watermarks.get((scope, scope_id), 0)
+
+    def bump(self, scope: str, scope_id: int) -> None:
+        with self._lock:
+            key = (scope, scope_id)
+            self._watermarks[key] = self._watermarks.get(key, 0) + 1
+
+    def note_ingested(self, records: Iterable[Dict[str, Any]]) -> None:
+        """消息入库后推进相关群组和用户的水位"""
+        scopes = set()
+        for record in records:
+            scopes.add(('user', record['user_telegram_id']))
+            if record['is_group']:
+                scopes.add(('group', record['chat_telegram_id']))
+        with self._lock:
+            for key in scopes:
+                self._watermarks[key] = self._watermarks.get(key, 0) + 1
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """返回可用的缓存结果，没有时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            age = now - entry.created_at
+            current = self._watermarks.get((key[1], key[2]), 0)
+            if age < self.ttl and entry.watermark == current:
+                self.hits += 1
+            elif age < min(self.staleness, self.ttl):
+                self.stale_hits += 1
+            else:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, key: CacheKey, value: Any, watermark: int) -> None:
+        with self._lock:
+            self._entries[key] = _Entry(value, watermark)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存大小和命中统计"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# 创建缓存实例
+result_cache = ResultCache()
@@ -0,0 +1,222 @@
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime, date, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func, select, insert, delete, null
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Session, Message, MessageDailyStat
+from hll import distinct_users
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# 统计数据来源：rollup - 读取每日汇总表；raw - 直接聚合消息表
+STATS_SOURCE = os.getenv('STATS_SOURCE', 'rollup').split('#')[0].strip().lower()
+
+# 汇总表的键列，私聊消息的群组记为0
+_KEY_COLUMNS = ['day', 'group_id', 'user_id', 'chat_type']
+
+def rollup_increments(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """将一批消息行折算为汇总表的增量"""
+    increments: Dict[Tuple, Dict[str, Any]] = {}
+    for row in rows:
+        created_at = row['created_at']
+        key = (created_at.date(), row['group_id'] or 0, row['user_id'], row['chat_type'] or 'text')
+        item = increments.get(key)
+        if item is None:
+            item = increments[key] = dict(zip(_KEY_COLUMNS, key), message_count=0, media_bytes=0, last_message_at=created_at)
+        item['message_count'] += 1
+        item['media_bytes'] += row['file_size'] or 0
+        if created_at > item['last_message_at']:
+            item['last_message_at'] = created_at
+    return list(increments.values())
+
+def apply_rollups(session, rows: List[Dict[str, Any]]) -> None:
+    """在写入消息的同一事务中累加汇总表（不提交）"""
+    increments = rollup_increments(rows)
+    if not increments:
+        return
+    stmt = sqlite_insert(MessageDailyStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=_KEY_COLUMNS,
+        set_={
+            'message_count': MessageDailyStat.message_count + stmt.excluded.message_count,
+            'media_bytes': MessageDailyStat.media_bytes + stmt.excluded.media_bytes,
+            'last_message_at': func.max(MessageDailyStat.last_message_at, stmt.excluded.last_message_at)
+        }
+    )
+    session.execute(stmt, increments)
+
+def rebuild_rollups(session, since: Optional[date] = None) -> int:
+    """从消息表重建汇总表（不提交），指定 since 时只重建该日及之后的数据，返回写入的行数"""
+    day = func.date(Message.created_at)
+    group_key = func.coalesce(Message.group_id, 0)
+    chat_type = func.coalesce(Message.chat_type, 'text')
+    query = select(
+        day, group_key, Message.user_id, chat_type,
+        func.count(Message.id),
+        func.coalesce(func.sum(Message.file_size), 0),
+        func.max(Message.created_at)
+    ).group_by(day, group_key, Message.user_id, chat_type)
+    purge = delete(MessageDailyStat)
+    if since is not None:
+        query = query.where(Message.created_at >= datetime.combine(since, time.min))
+        purge = purge.where(MessageDailyStat.day >= since)
+
+    session.execute(purge)
+    result = session.execute(insert(MessageDailyStat).from_select(
+        _KEY_COLUMNS + ['message_count', 'media_bytes', 'last_message_at'], query
+    ))
+    return result.rowcount
+
+def ensure_rollups() -> None:
+    """汇总表为空而消息表有数据时（升级后首次启动）执行一次全量重建"""
+    session = Session()
+    try:
+        if session.query(MessageDailyStat.day).first() is not None:
+            return
+        if session.query(Message.id).first() is None:
+            return
+        count = rebuild_rollups(session)
+        session.commit()
+        logger.info(f"已从历史消息重建每日汇总: {count} 行")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def window_queries(session, since: datetime, group_id: Optional[int] = None,
+                   user_id: Optional[int] = None, by_user: bool = True) -> Tuple[Any, Any]:
+    """window_rows 使用的 (消息表补齐查询, 汇总表查询)（未执行），query_plan 使用相同的语句检查执行计划"""
+    first_full_day = since.date() if since.time() == time.min else since.date() + timedelta(days=1)
+    boundary = datetime.combine(first_full_day, time.min)
+
+    if by_user:
+        rollup_query = session.query(
+            MessageDailyStat.day,
+            MessageDailyStat.group_id,
+            MessageDailyStat.user_id,
+            MessageDailyStat.chat_type,
+            MessageDailyStat.message_count,
+            MessageDailyStat.media_bytes,
+            MessageDailyStat.last_message_at
+        )
+    else:
+        rollup_query = session.query(
+            MessageDailyStat.day,
+            MessageDailyStat.group_id,
+            null(),
+            MessageDailyStat.chat_type,
+            func.sum(MessageDailyStat.message_count),
+            func.sum(MessageDailyStat.media_bytes),
+            func.max(MessageDailyStat.last_message_at)
+        ).group_by(MessageDailyStat.day, MessageDailyStat.group_id, MessageDailyStat.chat_type)
+    rollup_query = rollup_query.filter(MessageDailyStat.day >= first_full_day)
+
+    day = func.date(Message.created_at)
+    group_key = func.coalesce(Message.group_id, 0)
+    chat_type = func.coalesce(Message.chat_type, 'text')
+    user_key = Message.user_id if by_user else null()
+    raw_query = session.query(
+        day, group_key, user_key, chat_type,
+        func.count(Message.id),
+        func.coalesce(func.sum(Message.file_size), 0),
+        func.max(Message.created_at)
+    ).filter(
+        Message.created_at >= since,
+        Message.created_at < boundary
+    ).group_by(day, group_key, *([Message.user_id] if by_user else []), chat_type)
+
+    if group_id is not None:
+        rollup_query = rollup_query.filter(MessageDailyStat.group_id == group_id)
+        raw_query = raw_query.filter(Message.group_id == group_id)
+    if user_id is not None:
+        rollup_query = rollup_query.filter(MessageDailyStat.user_id == user_id)
+        raw_query = raw_query.filter(Message.user_id == user_id)
+    return raw_query, rollup_query
+
+def window_rows(session, since: datetime, group_id: Optional[int] = None,
+                user_id: Optional[int] = None, by_user: bool = True) -> List[Tuple]:
+    """返回 since 之后按 (日期, 群组, 用户, 消息类型) 汇总的行
+
+    完整的天从汇总表读取；起始日不完整的部分从消息表补齐（最多一天的数据），
+    结果与直接聚合消息表一致，耗时与历史数据量无关。
+    每行为 (日期, 群组ID(私聊为0), 用户ID, 消息类型, 消息数, 文件字节数, 最后消息时间)。
+    by_user=False 时在数据库端合并各用户的行，用户ID为None。
+    """
+    raw_query, rollup_query = window_queries(session, since, group_id=group_id, user_id=user_id, by_user=by_user)
+    rows = [(date.fromisoformat(row[0]),) + tuple(row[1:]) for row in raw_query.all()]
+    rows.extend(tuple(row) for row in rollup_query.all())
+    return rows
+
+def rollup_message_stats(session, since: datetime, group_id: Optional[int] = None, user_id: Optional[int] = None,
+                         with_users: bool = False, approximate_users: bool = False) -> Optional[Dict[str, Any]]:
+    """基于汇总表计算消息统计，返回格式与 aggregation.message_stats 相同
+
+    approximate_users=True 且不需要各用户消息数时，不读取按用户的行，
+    发言用户数由 HyperLogLog 草图估计，另外返回 active_users_error（相对标准误差）。
+    """
+    approximate_users = approximate_users and not with_users and user_id is None
+    rows = window_rows(session, since, group_id=group_id, user_id=user_id, by_user=not approximate_users)
+    if not rows:
+        return None
+
+    message_types: Dict[str, int] = {}
+    daily_messages: Dict[date, int] = {}
+    user_counts: Dict[int, int] = {}
+    groups = set()
+    total = 0
+    media_bytes = 0
+    last_active = None
+    for day, row_group_id, row_user_id, chat_type, count, size, last_message_at in rows:
+        total += count
+        media_bytes += size
+        message_types[chat_type] = message_types.get(chat_type, 0) + count
+        daily_messages[day] = daily_messages.get(day, 0) + count
+        if row_user_id is not None:
+            user_counts[row_user_id] = user_counts.get(row_user_id, 0) + count
+        if row_group_id:
+            groups.add(row_group_id)
+        if last_active is None or last_message_at > last_active:
+            last_active = last_message_at
+
+    stats: Dict[str, Any] = {
+        'total_messages': total,
+        'message_types': message_types,
+        'daily_messages': daily_messages,
+        'active_users': len(user_counts),
+        'active_groups': len(groups),
+        'last_active': last_active,
+        'media_bytes': media_bytes
+    }
+    if approximate_users:
+        stats['active_users'], stats['active_users_error'] = distinct_users(session, since, group_id=group_id)
+    if with_users:
+        stats['user_counts'] = user_counts
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='每日消息汇总表维护')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild - 从消息表重建汇总表')
+    parser.add_argument('--days', type=int, help='只重建最近N天，默认重建全部历史')
+    args = parser.parse_args()
+
+    since = datetime.utcnow().date() - timedelta(days=args.days) if args.days else None
+    session = Session()
+    try:
+        count = rebuild_rollups(session, since)
+        session.commit()
+        logger.info(f"汇总表重建完成: {count} 行" + (f"（自 {since} 起）" if since else ""))
+    except Exception as e:
+        session.rollback()
+        logger.error(f"汇总表重建失败: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
@@ -0,0 +1,54 @@
+import os
+import time
+import logging
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# 加载环境变量（本模块在其他模块之前导入）
+load_dotenv()
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 从开始导入到轮询就绪的目标时间（秒），超出时记录警告
+STARTUP_TARGET = float(os.getenv('STARTUP_TARGET', '3').split('#')[0].strip())
+
+class StartupTimer:
+    """记录启动各阶段距进程开始导入的耗时：imports - 模块导入完成，ready - 初始化完成即将开始轮询，
+    first_update - 处理完第一条更新"""
+
+    def __init__(self, target: float = STARTUP_TARGET):
+        self.target = target
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> Optional[float]:
+        """记录阶段耗时，同一阶段只记录第一次"""
+        if phase in self.phases:
+            return None
+        elapsed = time.perf_counter() - self.started
+        self.phases[phase] = elapsed
+        return elapsed
+
+    def mark_ready(self) -> None:
+        elapsed = self.mark('ready')
+        if elapsed is None:
+            return
+        imports = self.phases.get('imports', 0.0)
+        message = f"启动完成: 导入 {imports:.2f} 秒, 就绪 {elapsed:.2f} 秒（目标 {self.target:.1f} 秒）"
+        if elapsed > self.target:
+            logger.warning(message + "，超出目标，可运行 python startup_report.py 查看各模块导入耗时")
+        else:
+            logger.info(message)
+
+    def mark_first_update(self) -> None:
+        if 'first_update' in self.phases:
+            return
+        elapsed = self.mark('first_update')
+        logger.info(f"首条更新处理完成: 距启动 {elapsed:.2f} 秒")
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self.phases, target=self.target)
+
+# 创建计时器实例（应在其他模块之前导入）
+startup_timer = StartupTimer()
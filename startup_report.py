@@ -0,0 +1,85 @@
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, NamedTuple
+from startup import STARTUP_TARGET
+
+# 项目目录
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 应在首次使用时才导入的重量级依赖，启动时出现即视为回归
+LAZY_PACKAGES = ('matplotlib', 'seaborn', 'pandas', 'numpy', 'jieba')
+
+class ImportRecord(NamedTuple):
+    name: str
+    self_us: int  # 模块自身导入耗时（微秒）
+    cumulative_us: int  # 含依赖的累计耗时（微秒）
+    level: int  # 导入层级，0 为被测模块本身
+
+def import_profile(module: str) -> List[ImportRecord]:
+    """在新进程中以 -X importtime 导入模块并解析各模块耗时"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BASE_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        raw_name = fields[2].rstrip()
+        name = raw_name.lstrip()
+        level = (len(raw_name) - len(name) - 1) // 2
+        records.append(ImportRecord(name, int(fields[0]), int(fields[1]), level))
+    return records
+
+def summarize(module: str, records: List[ImportRecord], top: int) -> Dict[str, float]:
+    """打印导入耗时报告，返回被测模块的总耗时与重量级依赖"""
+    # 被测模块在最后一行，层级为0
+    base_level = min(record.level for record in records if record.name == module)
+    total = next(record for record in reversed(records) if record.name == module).cumulative_us / 1e6
+
+    # 被测模块直接导入的模块（含其依赖）
+    direct = [record for record in records if record.level == base_level + 1]
+    # 按顶层包汇总自身耗时
+    packages: Dict[str, int] = defaultdict(int)
+    for record in records:
+        packages[record.name.split('.')[0]] += record.self_us
+
+    print(f"== import {module}: {total:.3f} 秒 ==")
+    print("直接导入的模块（累计耗时）:")
+    for record in sorted(direct, key=lambda item: item.cumulative_us, reverse=True)[:top]:
+        print(f"  {record.cumulative_us / 1000:9.1f} ms  {record.name}")
+    print("按顶层包汇总（自身耗时）:")
+    for name, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:9.1f} ms  {name}")
+
+    loaded = sorted(name for name in LAZY_PACKAGES if name in packages)
+    if loaded:
+        print(f"⚠️ 启动时加载了应延迟导入的依赖: {', '.join(loaded)}")
+    print()
+    return {'total': total, 'lazy_loaded': len(loaded)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='启动耗时报告：各模块导入耗时及重量级依赖检查')
+    parser.add_argument('modules', nargs='*', default=['main', 'webui.app'], help='要测量的模块，默认 main 和 webui.app')
+    parser.add_argument('--top', type=int, default=15, help='每个列表显示的条目数')
+    parser.add_argument('--check', action='store_true', help='导入超过目标时间或加载了重量级依赖时以状态码1退出')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        summary = summarize(module, import_profile(module), args.top)
+        if summary['total'] > STARTUP_TARGET or summary['lazy_loaded']:
+            failed = True
+
+    print(f"启动目标: 导入并进入轮询 {STARTUP_TARGET:.1f} 秒内（STARTUP_TARGET）")
+    print("运行时的就绪耗时和首条更新耗时见机器人启动日志及 /metrics")
+    if args.check and failed:
+        sys.exit(1)
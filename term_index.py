@@ -0,0 +1,345 @@
+import os
+import sys
+import argparse
+import logging
+import time
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from sqlalchemy import func, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Session, ReadSession, Message, TermFrequency, IndexCheckpoint
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(name, default).split('#')[0].strip()
+
+# 停用词文件（UTF-8，每行一个词），为空时不使用停用词
+STOPWORDS_FILE = _env('STOPWORDS_FILE', '')
+# 参与统计的最短词长
+MIN_TERM_LENGTH = int(_env('MIN_TERM_LENGTH', '2'))
+# 每批分词的消息数
+TERM_INDEX_BATCH_SIZE = int(_env('TERM_INDEX_BATCH_SIZE', '2000'))
+# 查询前顺带补建索引的最大消息数，积压更多时请运行 backfill
+TERM_INDEX_LAZY_LIMIT = int(_env('TERM_INDEX_LAZY_LIMIT', '20000'))
+# 批量回填：分词进程数（0 表示CPU核数）、每个任务的消息数、每次提交包含的任务数
+BACKFILL_WORKERS = int(_env('BACKFILL_WORKERS', '0')) or os.cpu_count() or 1
+BACKFILL_CHUNK_SIZE = int(_env('BACKFILL_CHUNK_SIZE', '5000'))
+BACKFILL_COMMIT_CHUNKS = int(_env('BACKFILL_COMMIT_CHUNKS', '10'))
+# 回填进度输出间隔（秒）
+BACKFILL_PROGRESS_INTERVAL = 5.0
+
+# 索引进度在 index_checkpoints 表中的名称
+CHECKPOINT_NAME = 'term_frequencies'
+
+def load_stopwords(path: str = STOPWORDS_FILE) -> FrozenSet[str]:
+    """读取停用词文件"""
+    if not path:
+        return frozenset()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return frozenset(line.strip() for line in f if line.strip())
+    except Exception as e:
+        logger.error(f"加载停用词失败: {e}")
+        return frozenset()
+
+STOPWORDS = load_stopwords()
+
+def tokenize(text: str, stopwords: FrozenSet[str] = STOPWORDS, min_length: int = MIN_TERM_LENGTH) -> List[str]:
+    """分词并过滤短词、空白和停用词"""
+    # jieba 只在第一次分词时导入
+    import jieba
+    return [
+        word for word in jieba.cut(text)
+        if len(word) >= min_length and word.strip() and word not in stopwords
+    ]
+
+def count_terms(rows: Iterable[Tuple[Optional[int], datetime, str]]) -> Counter:
+    """统计一批消息的词频，rows 为 (群组ID, 时间, 内容)，返回 {(群组ID, 日期, 词): 次数}"""
+    counts: Counter = Counter()
+    for group_id, created_at, content in rows:
+        group_key = group_id or 0
+        day = created_at.date()
+        for term in tokenize(content):
+            counts[(group_key, day, term)] += 1
+    return counts
+
+def apply_term_counts(session, counts: Dict[Tuple[int, date, str], int]) -> None:
+    """累加词频（不提交）"""
+    if not counts:
+        return
+    stmt = sqlite_insert(TermFrequency)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['group_id', 'day', 'term'],
+        set_={'count': TermFrequency.count + stmt.excluded.count}
+    )
+    session.execute(stmt, [
+        {'group_id': group_id, 'day': day, 'term': term, 'count': count}
+        for (group_id, day, term), count in counts.items()
+    ])
+
+def get_checkpoint(session, name: str = CHECKPOINT_NAME) -> int:
+    """返回已索引的最大消息ID"""
+    return session.query(IndexCheckpoint.last_message_id).filter_by(name=name).scalar() or 0
+
+def advance_checkpoint(session, old: int, new: int, name: str = CHECKPOINT_NAME) -> bool:
+    """仅当进度仍为 old 时推进到 new，用于防止多个进程重复统计"""
+    if old == 0 and session.query(IndexCheckpoint.name).filter_by(name=name).first() is None:
+        session.add(IndexCheckpoint(name=name, last_message_id=new))
+        session.flush()
+        return True
+    result = session.execute(
+        update(IndexCheckpoint)
+        .where(IndexCheckpoint.name == name, IndexCheckpoint.last_message_id == old)
+        .values(last_message_id=new, updated_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+def _pending_messages(session, after_id: int, limit: int) -> List[Tuple]:
+    return session.query(Message.id, Message.group_id, Message.created_at, Message.content).filter(
+        Message.id > after_id,
+        Message.content.isnot(None),
+        Message.content != ''
+    ).order_by(Message.id).limit(limit).all()
+
+# 同一进程内只允许一个线程推进索引
+_index_lock = threading.Lock()
+
+def index_pending(limit: Optional[int] = None, batch_size: int = TERM_INDEX_BATCH_SIZE) -> int:
+    """对上次进度之后的新消息分词并写入词频表（阻塞），返回本次处理的消息数
+
+    每批在一个事务中写入词频并推进进度，中断后从上次提交处继续。
+    """
+    indexed = 0
+    with _index_lock:
+        session = Session()
+        try:
+            while limit is None or indexed < limit:
+                size = batch_size if limit is None else min(batch_size, limit - indexed)
+                checkpoint = get_checkpoint(session)
+                rows = _pending_messages(session, checkpoint, size)
+                if not rows:
+                    break
+                apply_term_counts(session, count_terms((group_id, created_at, content) for _, group_id, created_at, content in rows))
+                if not advance_checkpoint(session, checkpoint, rows[-1][0]):
+                    # 其他进程已处理这批消息
+                    session.rollback()
+                    continue
+                session.commit()
+                indexed += len(rows)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    return indexed
+
+def reset_index() -> None:
+    """清空词频表和索引进度"""
+    with _index_lock:
+        session = Session()
+        try:
+            session.execute(delete(TermFrequency))
+            session.execute(delete(IndexCheckpoint).where(IndexCheckpoint.name == CHECKPOINT_NAME))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+def top_terms(session, group_id: Optional[int] = None, days: int = 30, limit: int = 20) -> Optional[Dict[str, Any]]:
+    """在词频表上聚合最近若干天（按天取整）的关键词
+
+    停用词和最短词长在查询时同样生效，收紧配置后无需重建索引。
+    返回 total_words、unique_words、top_keywords，无数据时返回None。
+    """
+    filters = [TermFrequency.day >= (datetime.utcnow() - timedelta(days=days)).date()]
+    if group_id is not None:
+        filters.append(TermFrequency.group_id == group_id)
+    if MIN_TERM_LENGTH > 1:
+        filters.append(func.length(TermFrequency.term) >= MIN_TERM_LENGTH)
+    if STOPWORDS:
+        filters.append(TermFrequency.term.notin_(STOPWORDS))
+
+    total_words, unique_words = session.query(
+        func.coalesce(func.sum(TermFrequency.count), 0),
+        func.count(func.distinct(TermFrequency.term))
+    ).filter(*filters).one()
+    if not total_words:
+        return None
+
+    total = func.sum(TermFrequency.count)
+    top = session.query(TermFrequency.term, total).filter(*filters).group_by(
+        TermFrequency.term
+    ).order_by(total.desc()).limit(limit).all()
+    return {
+        'total_words': total_words,
+        'unique_words': unique_words,
+        'top_keywords': dict(top)
+    }
+
+class CheckpointMoved(RuntimeError):
+    """回填过程中索引进度被其他进程推进，committed 为此前已提交的消息数"""
+
+    def __init__(self, committed: int = 0):
+        super().__init__(f"索引进度已被其他进程更新（已提交 {committed} 条）")
+        self.committed = committed
+
+# 分词进程内的配置，由 _init_worker 设置
+_worker_options: Tuple[FrozenSet[str], int] = (STOPWORDS, MIN_TERM_LENGTH)
+
+def _init_worker(stopwords: FrozenSet[str], min_length: int) -> None:
+    """分词进程初始化：每个进程只加载一次jieba词典"""
+    global _worker_options
+    _worker_options = (stopwords, min_length)
+    import jieba
+    jieba.initialize()
+
+def _count_chunk(rows: List[Tuple[int, date, str]]) -> Counter:
+    """在分词进程中统计一批消息的词频，rows 为 (群组ID, 日期, 内容)"""
+    stopwords, min_length = _worker_options
+    counts: Counter = Counter()
+    for group_id, day, content in rows:
+        for term in tokenize(content, stopwords, min_length):
+            counts[(group_id, day, term)] += 1
+    return counts
+
+def _iter_chunks(session, after_id: int, chunk_size: int):
+    """按消息ID顺序分块读取待索引的消息，产出 (块内最大消息ID, 行)"""
+    while True:
+        rows = _pending_messages(session, after_id, chunk_size)
+        # 结束读事务，避免长期持有快照
+        session.rollback()
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        yield after_id, [(group_id or 0, created_at.date(), content) for _, group_id, created_at, content in rows]
+
+class _Progress:
+    """回填进度与速率输出"""
+
+    def __init__(self, total: int, interval: float = BACKFILL_PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def update(self, count: int, force: bool = False) -> None:
+        self.done += count
+        now = time.monotonic()
+        if not force and now - self.reported < self.interval:
+            return
+        self.reported = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.done / elapsed
+        percent = self.done * 100 / self.total if self.total else 100.0
+        remaining = (self.total - self.done) / rate if rate and self.total > self.done else 0
+        logger.info(f"已处理 {self.done}/{self.total} 条 ({percent:.1f}%), {rate:.0f} 条/秒, 预计剩余 {remaining:.0f} 秒")
+
+def _backfill_once(pool: ProcessPoolExecutor, workers: int, chunk_size: int, commit_chunks: int) -> int:
+    reader = ReadSession()
+    writer = Session()
+    try:
+        checkpoint = get_checkpoint(writer)
+        total = reader.query(func.count(Message.id)).filter(
+            Message.id > checkpoint,
+            Message.content.isnot(None),
+            Message.content != ''
+        ).scalar()
+        writer.rollback()
+        progress = _Progress(total)
+        chunks = _iter_chunks(reader, checkpoint, chunk_size)
+
+        # 最多同时提交 workers*2 个任务，读取速度不会超过分词速度太多
+        pending = deque()
+        exhausted = False
+        counts: Counter = Counter()
+        uncommitted = 0
+        uncommitted_messages = 0
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                last_id, rows = chunk
+                pending.append((last_id, len(rows), pool.submit(_count_chunk, rows)))
+            if not pending:
+                break
+
+            # 按提交顺序取结果，进度只推进到连续完成的位置
+            last_id, size, future = pending.popleft()
+            counts.update(future.result())
+            uncommitted += 1
+            uncommitted_messages += size
+            if uncommitted < commit_chunks and (pending or not exhausted):
+                continue
+
+            apply_term_counts(writer, counts)
+            if not advance_checkpoint(writer, checkpoint, last_id):
+                writer.rollback()
+                for _, _, future in pending:
+                    future.cancel()
+                raise CheckpointMoved(progress.done)
+            writer.commit()
+            checkpoint = last_id
+            progress.update(uncommitted_messages)
+            counts.clear()
+            uncommitted = 0
+            uncommitted_messages = 0
+
+        progress.update(0, force=True)
+        return progress.done
+    except Exception:
+        writer.rollback()
+        raise
+    finally:
+        reader.close()
+        writer.close()
+
+def backfill(workers: int = BACKFILL_WORKERS, chunk_size: int = BACKFILL_CHUNK_SIZE,
+             commit_chunks: int = BACKFILL_COMMIT_CHUNKS) -> int:
+    """多进程回填词频索引（阻塞），返回处理的消息数
+
+    主进程按消息ID分块读取，分词在进程池中并行执行，词频在主进程合并后分批写入，
+    每次提交同时推进索引进度，中断后重新运行即从上次提交处继续。
+    """
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(STOPWORDS, MIN_TERM_LENGTH)) as pool:
+        logger.info(f"开始回填词频索引: 进程数={workers}, 每块 {chunk_size} 条")
+        while True:
+            try:
+                return processed + _backfill_once(pool, workers, chunk_size, commit_chunks)
+            except CheckpointMoved as e:
+                # 机器人在此期间增量索引了部分消息，从新的进度继续；此前已提交的消息计入总数
+                processed += e.committed
+                logger.warning("索引进度已被其他进程更新，从新的进度继续回填")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='关键词词频索引维护')
+    parser.add_argument('command', choices=['backfill', 'rebuild'],
+                        help='backfill - 补建未索引的消息；rebuild - 清空后重建全部索引')
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='分词进程数，默认为CPU核数')
+    parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE, help='每个分词任务的消息数')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'rebuild':
+            reset_index()
+        start = time.monotonic()
+        count = backfill(workers=max(1, args.workers), chunk_size=args.chunk_size)
+        logger.info(f"词频索引完成: 处理消息 {count} 条, 耗时 {time.monotonic() - start:.1f} 秒")
+    except Exception as e:
+        logger.error(f"词频索引失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# 测试使用临时数据库，须在导入 models 之前设置
+_tmpdir = tempfile.mkdtemp(prefix='tgbot-test-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmpdir, 'test.db')
+# 测试不依赖MongoDB：连接失败时很快返回，敏感词列表为空
+os.environ['MONGODB_URI'] = 'mongodb://localhost:1/telegram_bot?serverSelectionTimeoutMS=100'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _make_record(message_id, user_telegram_id, chat_telegram_id, **fields):
+    record = {
+        'message_id': message_id,
+        'user_telegram_id': user_telegram_id,
+        'username': 'user',
+        'first_name': 'Test',
+        'last_name': None,
+        'chat_telegram_id': chat_telegram_id,
+        'chat_title': f'group {chat_telegram_id}',
+        'chat_type': 'supergroup',
+        'is_group': True,
+        'content': 'hello',
+        'created_at': datetime.utcnow(),
+        'file_type': None,
+        'file_id': None,
+        'file_path': None,
+        'file_size': None,
+        'mime_type': None,
+        'file_status': None
+    }
+    record.update(fields)
+    return record
+
+@pytest.fixture
+def make_record():
+    """构造 ingest.save_records 使用的消息记录，其余字段可按关键字覆盖"""
+    return _make_record
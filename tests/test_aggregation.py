@@ -0,0 +1,27 @@
+import time
+from datetime import datetime, timedelta
+
+import ingest
+from aggregation import message_stats, resolve_group_id
+from models import Session
+
+def test_window_uses_utc_on_non_utc_host(monkeypatch, make_record):
+    """统计窗口按UTC计算，与主机时区无关"""
+    monkeypatch.setenv('TZ', 'Asia/Shanghai')
+    time.tzset()
+    try:
+        now = datetime.utcnow()
+        ingest.save_records([
+            make_record(1, 8101, -8101, created_at=now - timedelta(hours=20)),
+            make_record(2, 8101, -8101, created_at=now - timedelta(hours=30))
+        ])
+        session = Session()
+        try:
+            stats = message_stats(session, group_id=resolve_group_id(session, -8101), days=1)
+        finally:
+            session.close()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    assert stats['total_messages'] == 1
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from db_executor import DatabaseExecutor
+
+def _fail():
+    raise ValueError('failed')
+
+def test_failed_tasks_are_not_counted_as_completed():
+    executor = DatabaseExecutor('test', 1, 1)
+
+    async def run():
+        assert await executor.run(lambda: 42) == 42
+        with pytest.raises(ValueError):
+            await executor.run(_fail)
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert (stats['completed'], stats['failed'], stats['pending']) == (1, 1, 0)
@@ -0,0 +1,25 @@
+from sqlalchemy import inspect, text
+
+import ingest
+from file_handler import ensure_media_columns
+from models import engine
+
+def _columns():
+    return {column['name'] for column in inspect(engine).get_columns('messages')}
+
+def test_missing_file_status_column_is_added(make_record):
+    """升级前的数据库没有 file_status 列，启动时补齐后入库正常"""
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE messages DROP COLUMN file_status"))
+    # 像重新启动一样使用新连接，避免连接池中的连接沿用删除列之前的表结构
+    engine.dispose()
+    assert 'file_status' not in _columns()
+
+    ensure_media_columns()
+    ensure_media_columns()
+    assert 'file_status' in _columns()
+
+    ingest.save_records([make_record(
+        1, 8001, 8001, username=None, chat_title=None, chat_type='private', is_group=False, content='',
+        file_type='photo', file_id='file-8001', file_size=100, file_status='pending'
+    )])
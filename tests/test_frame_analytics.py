@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+import ingest
+from aggregation import message_stats, resolve_group_id
+from frame_analytics import frame_stats
+from models import Session
+
+def test_frame_stats_match_message_stats(make_record):
+    """pandas 统计与聚合查询结果一致（时间字符串有无微秒混合出现）"""
+    now = datetime.utcnow().replace(microsecond=500000)
+    ingest.save_records([
+        make_record(message_id, 8000 + message_id % 3, -8000,
+                    chat_type='photo' if message_id % 4 == 0 else 'text',
+                    created_at=(now - timedelta(hours=message_id * 7)).replace(microsecond=0 if message_id % 2 else 500000))
+        for message_id in range(40)
+    ])
+
+    session = Session()
+    try:
+        group_id = resolve_group_id(session, -8000)
+        frame = frame_stats(session, group_id=group_id, days=30, chunk_size=7)
+        expected = message_stats(session, group_id=group_id, days=30)
+    finally:
+        session.close()
+
+    assert frame['total_messages'] == expected['total_messages'] == 40
+    assert frame['message_types'] == expected['message_types']
+    assert frame['daily_messages'] == expected['daily_messages']
+    assert frame['active_users'] == expected['active_users'] == 3
+    assert sum(frame['hourly_messages'].values()) == 40
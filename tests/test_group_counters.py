@@ -0,0 +1,31 @@
+import importlib
+
+from sqlalchemy import inspect, text
+
+from models import engine, read_engine, Group
+
+COUNTER_COLUMNS = ('message_count', 'member_count', 'last_message_at')
+
+def _columns():
+    return {column['name'] for column in inspect(engine).get_columns('groups')}
+
+def test_webui_startup_adds_counter_columns():
+    """只启动Web界面时，升级前的数据库也能读取群组列表"""
+    with engine.begin() as conn:
+        for index in Group.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        for name in COUNTER_COLUMNS:
+            conn.execute(text(f"ALTER TABLE groups DROP COLUMN {name}"))
+    # 像重新启动一样使用新连接，避免连接池中的连接沿用删除列之前的表结构
+    engine.dispose()
+    read_engine.dispose()
+    assert not _columns() & set(COUNTER_COLUMNS)
+
+    import webui.app
+    webapp = importlib.reload(webui.app).app
+    assert _columns() >= set(COUNTER_COLUMNS)
+
+    read_engine.dispose()
+    webapp.config['LOGIN_DISABLED'] = True
+    response = webapp.test_client().get('/api/groups')
+    assert response.status_code == 200
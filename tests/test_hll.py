@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from hll import HyperLogLog, SketchStore
+from models import Session, UserSketch
+
+def _rows(group_id, day, user_ids):
+    return [{'group_id': group_id, 'user_id': user_id, 'created_at': day} for user_id in user_ids]
+
+def _stored(group_id, day):
+    session = Session()
+    try:
+        data = session.query(UserSketch.registers).filter(
+            UserSketch.group_id == group_id,
+            UserSketch.day == day.date()
+        ).scalar()
+    finally:
+        session.close()
+    return HyperLogLog.from_bytes(data)
+
+def _expected(user_ids):
+    sketch = HyperLogLog()
+    for user_id in user_ids:
+        sketch.add(user_id)
+    return sketch
+
+def test_interleaved_transactions_keep_all_users():
+    """两个事务从同一缓存草图出发，后提交的不能覆盖先提交的用户"""
+    store = SketchStore()
+    day = datetime(2024, 1, 1, 12)
+    group_id = 101
+
+    session = Session()
+    store.apply(session, _rows(group_id, day, [1]))
+    session.commit()
+    store.commit(session)
+    session.close()
+
+    first = Session()
+    second = Session()
+    try:
+        # 第一个事务提交后、更新缓存之前，第二个事务读到的仍是旧的缓存草图
+        store.apply(first, _rows(group_id, day, [2, 3]))
+        first.commit()
+        store.apply(second, _rows(group_id, day, [4, 5]))
+        second.commit()
+        store.commit(first)
+        store.commit(second)
+    finally:
+        first.close()
+        second.close()
+
+    assert _stored(group_id, day).registers == _expected([1, 2, 3, 4, 5]).registers
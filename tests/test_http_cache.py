@@ -0,0 +1,65 @@
+import gzip
+import json
+
+import pytest
+
+from models import Session, Alert
+from watermarks import ensure_watermarks
+from webui.app import app
+
+def _client():
+    ensure_watermarks()
+    app.config['LOGIN_DISABLED'] = True
+    return app.test_client()
+
+def test_unchanged_resource_returns_304():
+    client = _client()
+    response = client.get('/api/alerts')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert response.status_code == 200
+
+    response = client.get('/api/alerts', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+
+    # 同一秒内的修改：Last-Modified 可能不变，但ETag必须变化
+    session = Session()
+    try:
+        session.add(Alert(group_id=1, alert_type='test', message='changed'))
+        session.commit()
+    finally:
+        session.close()
+    response = client.get('/api/alerts', headers={'If-None-Match': etag, 'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    # 只带 If-Modified-Since 时不返回304
+    response = client.get('/api/alerts', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 200
+
+def _add_alerts(count=100):
+    """让 /api/alerts 的响应超过压缩阈值"""
+    session = Session()
+    try:
+        session.add_all([Alert(group_id=1, alert_type='bulk', message='告警' * 20) for _ in range(count)])
+        session.commit()
+    finally:
+        session.close()
+
+def test_large_json_is_gzipped():
+    client = _client()
+    _add_alerts()
+    plain = client.get('/api/alerts')
+    compressed = client.get('/api/alerts', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert json.loads(gzip.decompress(compressed.data)) == json.loads(plain.data)
+
+def test_brotli_preferred_when_installed():
+    brotli = pytest.importorskip('brotli')
+    client = _client()
+    _add_alerts()
+    plain = client.get('/api/alerts')
+    compressed = client.get('/api/alerts', headers={'Accept-Encoding': 'gzip, br'})
+    assert compressed.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(compressed.data)) == json.loads(plain.data)
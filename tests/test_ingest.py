@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+import ingest
+from identity_cache import identity_cache
+from models import Session, User, Group, Message, Counter
+
+def _counters():
+    session = Session()
+    try:
+        return dict(session.query(Counter.name, Counter.value).filter(Counter.name.in_(['users', 'groups'])))
+    finally:
+        session.close()
+
+def test_concurrent_first_messages_create_user_and_group_once(make_record):
+    """两个写入同时创建同一新用户和新群组时，两条消息都应保存"""
+    identity_cache.clear()
+    before = _counters()
+    first = Session()
+    errors = []
+
+    def second_writer():
+        try:
+            ingest.save_records([make_record(2, 9001, -9001)])
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        ingest.write_records(first, [make_record(1, 9001, -9001)])
+        # 第二个写入在第一个事务提交前开始，身份缓存中还没有该用户和群组
+        identity_cache.clear()
+        thread = threading.Thread(target=second_writer)
+        thread.start()
+        time.sleep(0.3)
+        first.commit()
+    finally:
+        first.close()
+    thread.join()
+
+    assert errors == []
+    session = Session()
+    try:
+        user_ids = [user_id for (user_id,) in session.query(User.id).filter(User.telegram_id == 9001)]
+        group_ids = [group_id for (group_id,) in session.query(Group.id).filter(Group.telegram_id == -9001)]
+        assert len(user_ids) == 1 and len(group_ids) == 1
+        messages = session.query(Message.user_id, Message.group_id).filter(Message.user_id == user_ids[0]).all()
+        assert messages == [(user_ids[0], group_ids[0])] * 2
+    finally:
+        session.close()
+    after = _counters()
+    assert {name: after[name] - before.get(name, 0) for name in after} == {'users': 1, 'groups': 1}
+
+def test_failing_flush_listener_does_not_rewrite_batch(make_record):
+    """回调出错时批次已提交，不能再逐条重写"""
+    identity_cache.clear()
+    queue = ingest.IngestQueue()
+    calls = []
+
+    def failing_listener(batch):
+        calls.append(len(batch))
+        raise RuntimeError('listener failed')
+
+    queue.flush_listeners.append(failing_listener)
+    queue.flush_listeners.append(lambda batch: calls.append(-len(batch)))
+    batch = [make_record(message_id, 9002, -9002) for message_id in (10, 11, 12)]
+    asyncio.run(queue._flush(batch))
+
+    assert calls == [3, -3]
+    session = Session()
+    try:
+        count = session.query(Message).join(User, Message.user_id == User.id).filter(User.telegram_id == 9002).count()
+        assert count == 3
+    finally:
+        session.close()
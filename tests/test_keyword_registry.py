@@ -0,0 +1,30 @@
+import time
+
+from keyword_registry import KeywordRegistry
+from models import Session, Group, Keyword
+
+def test_keyword_changes_rebuild_matcher():
+    """其他进程修改关键词表后，匹配器在检查间隔内重建（不依赖变更水位触发器）"""
+    registry = KeywordRegistry(refresh_interval=0, check_interval=0.01)
+    session = Session()
+    try:
+        group = Group(telegram_id=-5001, title='keywords', type='supergroup')
+        session.add(group)
+        session.flush()
+        keyword = Keyword(word='Spam', group_id=group.id, severity=3)
+        session.add(keyword)
+        session.commit()
+        group_id = group.id
+
+        assert registry.check(group_id, 'this is spam') == [('Spam', 3)]
+        builds = registry.builds
+        assert registry.check(group_id, 'more spam') == [('Spam', 3)]
+        assert registry.builds == builds
+
+        keyword.is_active = False
+        session.add(Keyword(word='scam', group_id=group_id, severity=2))
+        session.commit()
+        time.sleep(0.02)
+        assert registry.check(group_id, 'spam or scam') == [('scam', 2)]
+    finally:
+        session.close()
@@ -0,0 +1,71 @@
+import re
+
+import pytest
+from sqlalchemy import event, text
+
+import rollup
+import query_plan
+from export import encode_cursor
+from models import engine, read_engine, Session, Message
+from webui.app import app
+
+def _strip_labels(sql):
+    # ORM 执行时为列加 表名_列名 的别名，不影响执行计划
+    return re.sub(r' AS \w+', '', sql)
+
+def _executed_sql(run, bind=engine):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(_strip_labels(statement))
+
+    event.listen(bind, 'before_cursor_execute', capture)
+    try:
+        run()
+    finally:
+        event.remove(bind, 'before_cursor_execute', capture)
+    return statements
+
+def _hot_sql(name):
+    session = Session()
+    try:
+        stmt = query_plan.HOT_QUERIES[name](session).statement
+        return _strip_labels(str(stmt.compile(dialect=engine.dialect)))
+    finally:
+        session.close()
+
+def test_hot_queries_match_window_rows():
+    since = query_plan._partial_since()
+    session = Session()
+    try:
+        executed = _executed_sql(lambda: rollup.window_rows(session, since, group_id=1, by_user=False))
+    finally:
+        session.close()
+
+    assert _hot_sql('group_window_raw_merged_30d') in executed
+    assert _hot_sql('group_window_rollup_merged_30d') in executed
+
+def test_hot_queries_match_messages_api():
+    app.config['LOGIN_DISABLED'] = True
+    client = app.test_client()
+    cursor = encode_cursor(*query_plan._cursor())
+    executed = _executed_sql(
+        lambda: client.get(f'/api/messages?cursor={cursor}&file_type=photo&per_page=20'), bind=read_engine
+    )
+
+    assert _hot_sql('file_type_messages_page') in executed
+
+def test_startup_creates_missing_indexes():
+    # 模拟升级的旧数据库：消息表没有索引，且未运行 migrate.py
+    with engine.begin() as conn:
+        for index in Message.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    engine.dispose()
+    with pytest.raises(query_plan.QueryPlanError):
+        query_plan.verify_query_plans()
+
+    # main.post_init 启动时调用
+    query_plan.ensure_message_indexes()
+    plans = query_plan.verify_query_plans()
+    assert 'group_stats_user_counts_30d' in plans
+    assert 'all_window_rollup_merged_30d' in plans
@@ -0,0 +1,37 @@
+import random
+from datetime import datetime, timedelta
+
+import ingest
+from benchmark import measure_rss_growth, stats_operations
+from models import Session, Group, User
+
+# 调用次数和允许的常驻内存增长（按每次调用平均不超过 1 KB 折算），
+# 长时间运行可使用 python benchmark.py stats_memory
+CALLS = 2000
+WARMUP = 500
+LIMIT_MB = CALLS * 1024 / 2**20
+
+def _seed(make_record, group_count: int = 10, user_count: int = 20, message_count: int = 2000):
+    random.seed(7)
+    now = datetime.utcnow()
+    records = [
+        make_record(message_id, 7000 + random.randrange(user_count), -7000 - random.randrange(group_count),
+                    content='hello world', created_at=now - timedelta(seconds=random.randrange(7 * 86400)))
+        for message_id in range(message_count)
+    ]
+    for start in range(0, message_count, 200):
+        ingest.save_records(records[start:start + 200])
+
+def test_stats_calls_do_not_grow_memory(make_record):
+    """反复调用统计接口，常驻内存不随调用次数增长（会话或缓存泄漏）"""
+    _seed(make_record)
+    session = Session()
+    try:
+        groups = session.query(Group.id, Group.telegram_id).filter(Group.telegram_id <= -7000).all()
+        users = session.query(User.id, User.telegram_id).filter(User.telegram_id >= 7000).all()
+    finally:
+        session.close()
+    assert groups and users
+
+    growth = measure_rss_growth(stats_operations(groups, users), CALLS, WARMUP)
+    assert growth <= LIMIT_MB, f"常驻内存增长 {growth:.2f} MB 超过上限 {LIMIT_MB:.2f} MB"
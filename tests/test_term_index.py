@@ -0,0 +1,40 @@
+from sqlalchemy import func
+
+import ingest
+import term_index
+from models import Session, Message
+
+def _seed(make_record, count: int = 60):
+    ingest.save_records([
+        make_record(message_id, 6001, -6001, username=None, chat_title='terms', content=f'测试消息 关键词 第{message_id}条')
+        for message_id in range(count)
+    ])
+
+def test_backfill_counts_rows_committed_before_checkpoint_moved(monkeypatch, make_record):
+    """进度被其他进程推进后重试，之前已提交的消息仍计入返回值"""
+    _seed(make_record)
+    term_index.reset_index()
+    session = Session()
+    try:
+        expected = session.query(func.count(Message.id)).filter(
+            Message.content.isnot(None),
+            Message.content != ''
+        ).scalar()
+    finally:
+        session.close()
+
+    advance = term_index.advance_checkpoint
+    calls = []
+
+    def advance_once_moved(session, old, new, **kwargs):
+        calls.append(new)
+        # 第二次推进时模拟进度已被其他进程修改
+        if len(calls) == 2:
+            return False
+        return advance(session, old, new, **kwargs)
+
+    monkeypatch.setattr(term_index, 'advance_checkpoint', advance_once_moved)
+    processed = term_index.backfill(workers=1, chunk_size=10, commit_chunks=1)
+
+    assert len(calls) > 2
+    assert processed == expected
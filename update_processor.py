@@ -0,0 +1,93 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 同时处理的更新数上限；1 表示逐条处理
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '8').split('#')[0].strip())
+
+# 基类的信号量在进入 do_process_update 之前获取，等待时不保证先来先得，
+# 因此把它设为不会阻塞的大数，在保证会话内顺序之后再用自己的信号量限流
+_UNBOUNDED = 2 ** 31 - 1
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """不同会话的更新并行处理，同一会话内严格按到达顺序处理
+
+    验证码、签到等功能依赖同一会话内消息的先后顺序。
+    """
+
+    def __init__(self, max_in_flight: int = UPDATE_CONCURRENCY):
+        super().__init__(_UNBOUNDED)
+        self.max_in_flight = max_in_flight
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        # 每个会话排队中与处理中的更新数
+        self._depths: Dict[Hashable, int] = {}
+        self.max_depth = 0
+        self.running = 0
+        self.processed = 0
+
+    @staticmethod
+    def _chat_key(update: Any) -> Optional[Hashable]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            # 无会话的更新不需要排序
+            async with self._in_flight:
+                await self._run(coroutine)
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        depth = self._depths.get(key, 0) + 1
+        self._depths[key] = depth
+        self.max_depth = max(self.max_depth, depth)
+        try:
+            async with lock:
+                async with self._in_flight:
+                    await self._run(coroutine)
+        finally:
+            depth = self._depths[key] - 1
+            if depth:
+                self._depths[key] = depth
+            else:
+                del self._depths[key]
+                del self._chat_locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            self.processed += 1
+
+    async def initialize(self) -> None:
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        logger.info(f"并发处理更新: 上限={self.max_in_flight}")
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        """返回并发处理指标"""
+        depths = sorted(self._depths.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'max_in_flight': self.max_in_flight,
+            'running': self.running,
+            'queued_chats': len(depths),
+            'queued_updates': sum(depth for _, depth in depths),
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'top_chats': depths[:5]
+        }
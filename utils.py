@@ -2,7 +2,8 @@ import random
 import string
 from telegraph import Telegraph
 from sqlalchemy.orm import sessionmaker
-from models import engine, User, Group, Message, Keyword
+from models import engine, User, Group, Message
+from keyword_registry import keyword_registry
 
 # 创建数据库会话
 Session = sessionmaker(bind=engine)
@@ -32,17 +33,8 @@ def add_points(user_id, points):
     session.close()
 
 def check_keywords(message_text, group_id):
-    """检查消息中是否包含关键词"""
-    session = Session()
-    keywords = session.query(Keyword).filter_by(group_id=group_id).all()
-    found_keywords = []
-    
-    for keyword in keywords:
-        if keyword.word.lower() in message_text.lower():
-            found_keywords.append(keyword.word)
-    
-    session.close()
-    return found_keywords
+    """检查消息中是否包含关键词（群组关键词及全局敏感词）"""
+    return [word for word, _ in keyword_registry.check(group_id, message_text)]
 
 def save_message(message_id, user_id, group_id, content):
     """保存消息到数据库"""
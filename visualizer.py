@@ -1,15 +1,17 @@
+import os
 import logging
-from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from sqlalchemy.orm import sessionmaker
-from models import engine, Message, User, Group
-from telegram import Update
+from models import read_engine, session_scope, User, Group
+from telegram import Update, InputMediaPhoto
 from telegram.ext import ContextTypes
-import matplotlib.pyplot as plt
-import seaborn as sns
 from io import BytesIO
-import pandas as pd
 from database import get_db
+from db_executor import run_analytics
+from aggregation import message_stats, resolve_group_id, resolve_user_id
+from result_cache import result_cache
+from charts import chart_renderer, chart_data, render
+from frame_analytics import frame_stats
 
 # 配置日志
 logging.basicConfig(
@@ -18,96 +20,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 创建数据库会话
-Session = sessionmaker(bind=engine)
+# 创建数据库会话（只读，与机器人写入互不阻塞）
+Session = sessionmaker(bind=read_engine)
+
+# 图表数据来源：sql - 使用聚合查询或每日汇总表（耗时与历史数据量无关）；
+# pandas - 分块读取消息原始行并向量化统计，另有每小时分布，耗时随时间窗口内的消息数增长
+VISUALIZER_ENGINE = os.getenv('VISUALIZER_ENGINE', 'sql').split('#')[0].strip().lower()
+# /visualize 允许的最大天数
+VISUALIZE_MAX_DAYS = int(os.getenv('VISUALIZE_MAX_DAYS', '365').split('#')[0].strip())
 
 class DataVisualizer:
-    def __init__(self):
-        self.session = Session()
+    """图表数据读取与发送，每次调用使用独立的短生命周期会话，实例可在多个处理器间共享"""
+
+    def __init__(self, session_factory=Session):
+        self.session_factory = session_factory
         
-    def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """获取用户数据"""
+    def _stats(self, session, group_id: Optional[int] = None, user_id: Optional[int] = None,
+               days: int = 30) -> Optional[Dict[str, Any]]:
+        if VISUALIZER_ENGINE == 'pandas':
+            return frame_stats(session, group_id=group_id, user_id=user_id, days=days)
+        return message_stats(session, group_id=group_id, user_id=user_id, days=days)
+    
+    def get_user_data(self, user_id: int, days: int = 30) -> Optional[Dict[str, Any]]:
+        """获取用户数据（user_id 为Telegram用户ID）"""
         try:
-            # 获取用户最近30天的消息
-            start_date = datetime.now() - timedelta(days=30)
-            messages = self.session.query(Message).filter(
-                Message.user_id == user_id,
-                Message.created_at >= start_date
-            ).all()
-            
-            if not messages:
-                return None
-            
-            # 处理数据
-            data: Dict[str, Any] = {
-                'total_messages': len(messages),
-                'message_types': {},
-                'active_groups': set(),
-                'daily_messages': {},
-                'last_active': None
-            }
-            
-            for msg in messages:
-                # 统计消息类型
-                msg_type = msg.chat_type or 'text'
-                data['message_types'][msg_type] = data['message_types'].get(msg_type, 0) + 1
-                
-                # 记录活跃群组
-                if msg.group_id:
-                    data['active_groups'].add(msg.group_id)
+            with session_scope(self.session_factory) as session:
+                # 首先获取用户的内部ID
+                internal_id = resolve_user_id(session, user_id)
+                if not internal_id:
+                    return None
                 
-                # 统计每日消息
-                date = msg.created_at.date()
-                data['daily_messages'][date] = data['daily_messages'].get(date, 0) + 1
-                
-                # 更新最后活跃时间
-                if not data['last_active'] or msg.created_at > data['last_active']:
-                    data['last_active'] = msg.created_at
-            
-            return data
+                # 获取用户最近若干天的统计
+                return self._stats(session, user_id=internal_id, days=days)
         except Exception as e:
             logger.error(f"获取用户数据失败: {e}")
             return None
     
-    def get_group_data(self, group_id: int) -> Optional[Dict[str, Any]]:
-        """获取群组数据"""
+    def get_group_data(self, group_id: int, days: int = 30) -> Optional[Dict[str, Any]]:
+        """获取群组数据（group_id 为群组Telegram ID）"""
         try:
-            # 获取群组最近30天的消息
-            start_date = datetime.now() - timedelta(days=30)
-            messages = self.session.query(Message).filter(
-                Message.group_id == group_id,
-                Message.created_at >= start_date
-            ).all()
-            
-            if not messages:
-                return None
-            
-            # 处理数据
-            data: Dict[str, Any] = {
-                'total_messages': len(messages),
-                'message_types': {},
-                'active_users': set(),
-                'daily_messages': {},
-                'last_active': None
-            }
-            
-            for msg in messages:
-                # 统计消息类型
-                msg_type = msg.chat_type or 'text'
-                data['message_types'][msg_type] = data['message_types'].get(msg_type, 0) + 1
-                
-                # 记录活跃用户
-                data['active_users'].add(msg.user_id)
-                
-                # 统计每日消息
-                date = msg.created_at.date()
-                data['daily_messages'][date] = data['daily_messages'].get(date, 0) + 1
+            with session_scope(self.session_factory) as session:
+                # 首先获取群组的内部ID
+                internal_id = resolve_group_id(session, group_id)
+                if not internal_id:
+                    return None
                 
-                # 更新最后活跃时间
-                if not data['last_active'] or msg.created_at > data['last_active']:
-                    data['last_active'] = msg.created_at
-            
-            return data
+                # 获取群组最近若干天的统计
+                return self._stats(session, group_id=internal_id, days=days)
         except Exception as e:
             logger.error(f"获取群组数据失败: {e}")
             return None
@@ -115,56 +74,28 @@ class DataVisualizer:
     def generate_charts(self, data: Dict[str, Any]) -> Optional[List[BytesIO]]:
         """生成图表"""
         try:
-            charts: List[BytesIO] = []
-            
-            # 1. 消息类型分布饼图
-            plt.figure(figsize=(10, 6))
-            plt.pie(
-                data['message_types'].values(),
-                labels=data['message_types'].keys(),
-                autopct='%1.1f%%'
-            )
-            plt.title('消息类型分布')
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            charts.append(buf)
-            plt.close()
-            
-            # 2. 每日消息数量折线图
-            plt.figure(figsize=(12, 6))
-            dates = sorted(data['daily_messages'].keys())
-            counts = [data['daily_messages'][date] for date in dates]
-            plt.plot(dates, counts, marker='o')
-            plt.title('每日消息数量')
-            plt.xlabel('日期')
-            plt.ylabel('消息数量')
-            plt.xticks(rotation=45)
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            charts.append(buf)
-            plt.close()
-            
-            return charts
+            return [BytesIO(image) for image in render(chart_data(data))]
         except Exception as e:
             logger.error(f"生成图表失败: {e}")
             return None
     
     async def send_charts(self, update: Update, context: ContextTypes.DEFAULT_TYPE, charts: List[BytesIO]) -> None:
-        """发送图表"""
+        """发送图表，多张图表合并为一组发送"""
         try:
-            for chart in charts:
+            if len(charts) == 1:
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
-                    photo=chart
+                    photo=charts[0]
+                )
+                return
+            # 每组最多10张
+            for start in range(0, len(charts), 10):
+                await context.bot.send_media_group(
+                    chat_id=update.effective_chat.id,
+                    media=[InputMediaPhoto(chart) for chart in charts[start:start + 10]]
                 )
         except Exception as e:
             logger.error(f"发送图表失败: {e}")
-    
-    def close(self) -> None:
-        """关闭数据库会话"""
-        self.session.close()
 
 # 创建可视化器实例
 visualizer = DataVisualizer()
@@ -176,26 +107,49 @@ async def visualize_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("此命令只能在群组、频道或私聊中使用！")
         return
     
+    # 可选参数：统计天数，如 /visualize 90
+    days = 30
+    if context.args:
+        try:
+            days = int(context.args[0])
+        except ValueError:
+            days = 0
+        if not 1 <= days <= VISUALIZE_MAX_DAYS:
+            await update.message.reply_text(f"天数应为 1 到 {VISUALIZE_MAX_DAYS} 之间的整数，例如 /visualize 90")
+            return
+    
     try:
         if chat_type == 'private':
             # 私聊中显示用户在所有群组/频道的数据
-            user_id = update.effective_user.id
-            data = visualizer.get_user_data(user_id)
+            key = ('visualize', 'user', update.effective_user.id, days)
         else:
             # 群组/频道中显示该群组/频道的数据
-            group_id = update.effective_chat.id
-            data = visualizer.get_group_data(group_id)
+            key = ('visualize', 'group', update.effective_chat.id, days)
         
-        if not data:
-            await update.message.reply_text("没有找到足够的数据来生成图表")
-            return
+        # 缓存中保存图表的PNG字节
+        images = result_cache.get(key)
+        if images is None:
+            watermark = result_cache.watermark(key[1], key[2])
+            if key[1] == 'user':
+                data = await run_analytics(visualizer.get_user_data, key[2], days)
+            else:
+                data = await run_analytics(visualizer.get_group_data, key[2], days)
+            
+            if not data:
+                await update.message.reply_text("没有找到足够的数据来生成图表")
+                return
+            
+            # 在绘图进程池中生成图表
+            try:
+                images = await chart_renderer.render(data)
+            except Exception as e:
+                logger.error(f"生成图表失败: {e}")
+                await update.message.reply_text("生成图表时发生错误")
+                return
+            result_cache.put(key, images, watermark)
         
-        # 生成并发送图表
-        charts = visualizer.generate_charts(data)
-        if charts:
-            await visualizer.send_charts(update, context, charts)
-        else:
-            await update.message.reply_text("生成图表时发生错误")
+        # 发送图表
+        await visualizer.send_charts(update, context, [BytesIO(image) for image in images])
     except Exception as e:
         logger.error(f"生成可视化数据失败: {e}")
         await update.message.reply_text("生成可视化数据时发生错误") 
\ No newline at end of file
@@ -0,0 +1,88 @@
+import sys
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import text
+from models import Base, engine, TableVersion
+
+# 配置日志
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# 维护变更水位的表
+WATERMARKED_TABLES = ('users', 'groups', 'keywords', 'alerts')
+# 不由触发器跟踪的列：群组计数列每批消息都会逐行更新，由 group_counters 每条语句推进一次水位
+UNTRACKED_COLUMNS = {
+    'groups': ('message_count', 'member_count', 'last_message_at', 'updated_at'),
+}
+
+_versions = TableVersion.__table__
+
+# 行级触发器：任何进程（机器人、Web界面、手工SQL）的修改都会推进水位，
+# 与修改在同一事务中提交；时间精确到秒，与HTTP的 Last-Modified 一致
+_BUMP_SQL = (
+    f"UPDATE {_versions.name} SET version = version + 1, updated_at = strftime('%Y-%m-%d %H:%M:%S', 'now') "
+    "WHERE name = '{table}'"
+)
+
+_TRIGGER_DDL = """
+CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event}
+AFTER {EVENT} ON {table}
+BEGIN
+    {bump};
+END
+"""
+
+def _tracked_columns(table: str) -> Optional[str]:
+    untracked = UNTRACKED_COLUMNS.get(table)
+    if not untracked:
+        return None
+    columns = [column.name for column in Base.metadata.tables[table].columns if column.name not in untracked]
+    return ', '.join(columns)
+
+def bump_watermark(session, table: str) -> None:
+    """在修改不被触发器跟踪的列的同一事务中推进水位（不提交）"""
+    session.execute(text(_BUMP_SQL.format(table=table)))
+
+def ensure_watermarks() -> None:
+    """创建水位行和触发器（已存在时跳过）"""
+    with engine.begin() as conn:
+        for table in WATERMARKED_TABLES:
+            conn.execute(text(
+                f"INSERT OR IGNORE INTO {_versions.name} (name, version, updated_at) "
+                f"VALUES (:name, 0, strftime('%Y-%m-%d %H:%M:%S', 'now'))"
+            ), {'name': table})
+            columns = _tracked_columns(table)
+            for event in ('insert', 'update', 'delete'):
+                trigger_event = event.upper()
+                if event == 'update' and columns:
+                    trigger_event = f"UPDATE OF {columns}"
+                conn.execute(text(_TRIGGER_DDL.format(
+                    table=table, event=event, EVENT=trigger_event, bump=_BUMP_SQL.format(table=table)
+                )))
+
+def read_watermarks(session, tables: Iterable[str]) -> Optional[Dict[str, Tuple[int, datetime]]]:
+    """读取各表的 (版本号, 最后变更时间)；水位尚未初始化时返回 None"""
+    tables = list(tables)
+    rows = session.query(TableVersion.name, TableVersion.version, TableVersion.updated_at).filter(
+        TableVersion.name.in_(tables)
+    ).all()
+    if len(rows) < len(tables):
+        return None
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='表变更水位维护')
+    parser.add_argument('command', choices=['install'], help='install - 创建水位行和触发器')
+    args = parser.parse_args()
+
+    try:
+        ensure_watermarks()
+        logger.info(f"变更水位已就绪: {', '.join(WATERMARKED_TABLES)}")
+    except Exception as e:
+        logger.error(f"创建变更水位失败: {e}")
+        sys.exit(1)
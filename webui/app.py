@@ -1,9 +1,16 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
-from models import Session, User, Group, Message, Keyword, Alert
+from models import ReadSession as Session, User, Group, Message, Keyword, Alert
+from rollup import STATS_SOURCE
+from counters import read_counters
+from group_counters import ensure_counter_columns
+from hll import DISTINCT_USERS, distinct_users
+from sqlalchemy import func
+from aggregation import resolve_group_id, resolve_user_id
+from export import EXPORT_FORMATS, encode_cursor, decode_cursor, parse_time, messages_page_query, stream_export
+from http_cache import conditional, init_app as init_http_cache
 from datetime import datetime, timedelta
 import os
-import json
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__)
@@ -11,6 +18,14 @@ app.secret_key = os.urandom(24)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+# 快速JSON序列化和响应压缩
+init_http_cache(app)
+
+# 群组计数列由机器人启动时补齐，Web界面可能先于机器人读取升级后的数据库
+try:
+    ensure_counter_columns()
+except Exception as e:
+    app.logger.error(f"补齐群组计数列失败: {e}")
 
 # 配置
 UPLOAD_FOLDER = '/vol1/1000/tg'
@@ -52,73 +67,196 @@ def logout():
 @app.route('/api/stats')
 @login_required
 def get_stats():
+    """仪表盘统计
+
+    STATS_SOURCE=rollup 时读取入库时维护的计数（最近24小时按小时对齐），不扫描消息表；
+    computed_at 为计数最后更新的时间，reconciled_at 为最后一次与精确计数校准的时间（UTC）。
+    """
     session = Session()
     try:
-        # 获取基本统计信息
-        total_users = session.query(User).count()
-        total_groups = session.query(Group).count()
-        total_messages = session.query(Message).count()
-        
-        # 获取最近24小时的消息统计
         last_24h = datetime.utcnow() - timedelta(hours=24)
-        recent_messages = session.query(Message).filter(Message.created_at >= last_24h).count()
         
-        # 获取活跃群组（最近24小时有消息的群组）
-        active_groups = session.query(Group).join(Message).filter(
-            Message.created_at >= last_24h
-        ).distinct().count()
+        if STATS_SOURCE == 'rollup':
+            counters = read_counters(session, last_24h)
+            total_users = counters['users']
+            total_groups = counters['groups']
+            total_messages = counters['messages']
+            recent_messages = counters['recent_messages']
+            computed_at = counters['computed_at']
+            reconciled_at = counters['reconciled_at']
+            # 群组表的最后消息时间有索引，只扫描活跃群组
+            active_groups = session.query(func.count(Group.id)).filter(Group.last_message_at >= last_24h).scalar()
+        else:
+            # 获取基本统计信息
+            total_users = session.query(User).count()
+            total_groups = session.query(Group).count()
+            total_messages = session.query(Message).count()
+            
+            # 获取最近24小时的消息统计
+            recent_messages = session.query(Message).filter(Message.created_at >= last_24h).count()
+            
+            # 获取活跃群组（最近24小时有消息的群组）
+            active_groups = session.query(Group).join(Message).filter(
+                Message.created_at >= last_24h
+            ).distinct().count()
+            computed_at = reconciled_at = datetime.utcnow()
+        
+        # 最近24小时发言用户数
+        active_users_error = None
+        if DISTINCT_USERS == 'hll':
+            active_users, active_users_error = distinct_users(session, last_24h)
+        else:
+            active_users = session.query(func.count(func.distinct(Message.user_id))).filter(
+                Message.created_at >= last_24h
+            ).scalar()
         
         return jsonify({
             'total_users': total_users,
             'total_groups': total_groups,
             'total_messages': total_messages,
             'recent_messages': recent_messages,
-            'active_groups': active_groups
+            'active_groups': active_groups,
+            'active_users': active_users,
+            'active_users_error': active_users_error,
+            'computed_at': computed_at.isoformat() if computed_at else None,
+            'reconciled_at': reconciled_at.isoformat() if reconciled_at else None
         })
     finally:
         session.close()
 
+# 列表接口每页条数上限
+API_MAX_PER_PAGE = int(os.getenv('API_MAX_PER_PAGE', '100').split('#')[0].strip())
+
 @app.route('/api/messages')
 @login_required
 def get_messages():
+    """按时间倒序分页返回消息
+
+    使用 (created_at, id) 键集分页：cursor 为上一页返回的 next_cursor，没有更多消息时 next_cursor 为 null，
+    任意深度的翻页都只需在索引上定位一次。用户和群组与消息在同一查询中读取。
+    可选过滤：group_id / user_id（Telegram ID）、file_type、since / until（ISO时间，UTC）。
+    """
+    try:
+        per_page = min(max(int(request.args.get('per_page', 20)), 1), API_MAX_PER_PAGE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+        group_telegram_id = request.args.get('group_id', type=int)
+        user_telegram_id = request.args.get('user_id', type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    file_type = request.args.get('file_type')
+    
     session = Session()
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        # 过滤条件按内部ID比较，以便使用 (group_id, created_at) / (user_id, created_at) 索引
+        group_id = user_id = None
+        if group_telegram_id is not None:
+            group_id = resolve_group_id(session, group_telegram_id)
+            if group_id is None:
+                return jsonify({'messages': [], 'next_cursor': None})
+        if user_telegram_id is not None:
+            user_id = resolve_user_id(session, user_telegram_id)
+            if user_id is None:
+                return jsonify({'messages': [], 'next_cursor': None})
         
-        messages = session.query(Message).order_by(Message.created_at.desc()).offset(
-            (page - 1) * per_page
-        ).limit(per_page).all()
+        # 多取一条用于判断是否还有下一页
+        rows = messages_page_query(
+            session, per_page, group_id=group_id, user_id=user_id, file_type=file_type,
+            since=since, until=until, after=after
+        ).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
         
         result = []
-        for msg in messages:
+        for (message_id, content, msg_file_type, file_path, created_at,
+             user_tg_id, username, first_name, group_tg_id, group_title) in rows:
             result.append({
-                'id': msg.id,
-                'content': msg.content,
-                'file_type': msg.file_type,
-                'file_path': msg.file_path,
-                'created_at': msg.created_at.isoformat(),
+                'id': message_id,
+                'content': content,
+                'file_type': msg_file_type,
+                'file_path': file_path,
+                'created_at': created_at.isoformat(),
                 'user': {
-                    'id': msg.user.telegram_id,
-                    'username': msg.user.username,
-                    'first_name': msg.user.first_name
+                    'id': user_tg_id,
+                    'username': username,
+                    'first_name': first_name
                 },
                 'group': {
-                    'id': msg.group.telegram_id if msg.group else None,
-                    'title': msg.group.title if msg.group else None
+                    'id': group_tg_id,
+                    'title': group_title
                 }
             })
         
-        return jsonify(result)
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0]) if has_more else None
+        return jsonify({'messages': result, 'next_cursor': next_cursor})
     finally:
         session.close()
 
+# 群组列表可用的排序字段
+GROUP_SORT_COLUMNS = {
+    'activity': Group.last_message_at,
+    'messages': Group.message_count,
+    'members': Group.member_count,
+    'created': Group.id,
+}
+
+@app.route('/api/export')
+@login_required
+def export_messages():
+    """流式导出消息（按时间升序）
+
+    format: ndjson（默认）/ csv；gzip=1 时压缩；group_id（Telegram ID）、since / until（ISO时间，UTC）过滤；
+    cursor 为已导出的最后一条记录的 cursor 字段，从其后继续。数据库按批读取，边查询边发送。
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format 应为 {' / '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    try:
+        filters = {
+            'group_id': request.args.get('group_id', type=int),
+            'since': parse_time(request.args.get('since')),
+            'until': parse_time(request.args.get('until')),
+            'cursor': request.args.get('cursor')
+        }
+        if filters['cursor']:
+            decode_cursor(filters['cursor'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filename = f"messages_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{fmt}" + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(stream_export(fmt, compress, **filters)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @app.route('/api/groups')
 @login_required
+@conditional('groups')
 def get_groups():
+    """分页返回群组及其消息数、成员数（读取入库时维护的计数列）
+
+    sort: activity（最后消息时间，默认）/ messages / members / created；order: desc（默认）/ asc。
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 20)), 1), API_MAX_PER_PAGE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sort_column = GROUP_SORT_COLUMNS.get(request.args.get('sort', 'activity'))
+    if sort_column is None:
+        return jsonify({'error': f"sort 应为 {' / '.join(GROUP_SORT_COLUMNS)}"}), 400
+    descending = request.args.get('order', 'desc') != 'asc'
+    
     session = Session()
     try:
-        groups = session.query(Group).all()
+        total = session.query(func.count(Group.id)).scalar()
+        # 以ID作为第二排序键，保证分页结果稳定
+        order_by = [sort_column.desc(), Group.id.desc()] if descending else [sort_column.asc(), Group.id.asc()]
+        groups = session.query(Group).order_by(*order_by).offset((page - 1) * per_page).limit(per_page).all()
         result = []
         for group in groups:
             result.append({
@@ -127,15 +265,17 @@ def get_groups():
                 'title': group.title,
                 'type': group.type,
                 'is_monitoring': group.is_monitoring,
-                'message_count': len(group.messages),
-                'user_count': len(group.users)
+                'message_count': group.message_count,
+                'user_count': group.member_count,
+                'last_message_at': group.last_message_at.isoformat() if group.last_message_at else None
             })
-        return jsonify(result)
+        return jsonify({'groups': result, 'total': total, 'page': page, 'per_page': per_page})
     finally:
         session.close()
 
 @app.route('/api/users')
 @login_required
+@conditional('users')
 def get_users():
     session = Session()
     try:
@@ -158,6 +298,7 @@ def get_users():
 
 @app.route('/api/keywords')
 @login_required
+@conditional('keywords')
 def get_keywords():
     session = Session()
     try:
@@ -177,6 +318,7 @@ def get_keywords():
 
 @app.route('/api/alerts')
 @login_required
+@conditional('alerts')
 def get_alerts():
     session = Session()
     try: